@@ -26,6 +26,26 @@ def main(argv):
         from scoreboard.tests import data
         models.db.create_all()
         data.create_all()
+    elif 'scoreboard-at' in argv:
+        from scoreboard import replay
+        from scoreboard import utils
+        usage = 'Usage: %s scoreboard-at <timestamp>' % argv[0]
+        try:
+            when = utils.parse_datetime(
+                    argv[argv.index('scoreboard-at') + 1])
+        except IndexError:
+            sys.exit(usage)
+        except (ValueError, OverflowError) as ex:
+            sys.exit('%s\n%s' % (ex, usage))
+        for position, _, name, score in replay.scoreboard(when):
+            print('%4d  %6d  %s' % (position, score, name))
+    elif 'warm-cache' in argv:
+        from scoreboard import warmup
+        warmed = warmup.warm()
+        if warmed is None:
+            print('Cache warm-up already running.')
+        else:
+            print('Warmed %d cache entries.' % warmed)
     elif 'shell' in argv:
         try:
             import IPython
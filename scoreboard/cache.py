@@ -13,38 +13,472 @@
 # limitations under the License.
 
 
+import collections
 import functools
-import json
 import flask
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
 
 from werkzeug.contrib import cache
 
 from scoreboard import main
+from scoreboard import utils
 
 app = main.get_app()
 
 
 class CacheWrapper(object):
+    """The configured cache, optionally fronted by a per-process LRU.
+
+    With CACHE_LOCAL_BYTES set, values read from the shared cache are kept
+    locally for up to CACHE_LOCAL_TTL seconds.  Deletes and counter updates,
+    which is how entries are invalidated, move a shared version key, and
+    local copies are only served while the version they were stored under
+    is still current, so a hit costs one small get instead of moving the
+    whole value.  Sets are fills, of keys that embed the generations they
+    depend on, so they leave other processes' copies alone; one replacing
+    a value may be missed elsewhere for up to CACHE_LOCAL_TTL seconds.
+
+    With Redis, writes instead publish the keys they touched, and every
+    process evicts its local copies of those keys, so a local hit costs no
+    round trip at all.
+    """
+
+    VERSION_KEY = 'local/version'
+    # Keys never copied locally, and whose writes can't make a local copy
+    # of any other key stale.
+    VOLATILE_PREFIX = 'lease/'
 
     def __init__(self, app):
         cache_type = app.config.get('CACHE_TYPE')
         if cache_type == 'memcached':
             host = app.config.get('MEMCACHE_HOST')
             self._cache = cache.MemcachedCache([host])
+        elif cache_type == 'redis':
+            self._cache = RedisCache(app.config.get('REDIS_HOST'))
         elif cache_type == 'local':
             self._cache = cache.SimpleCache()
         else:
             self._cache = cache.NullCache()
+        self._local = None
+        self._invalidations = None
+        local_bytes = app.config.get('CACHE_LOCAL_BYTES')
+        if local_bytes and not isinstance(self._cache, cache.NullCache):
+            self._local = LocalCache(
+                    local_bytes, app.config.get('CACHE_LOCAL_TTL', 5))
+            if isinstance(self._cache, RedisCache):
+                self._invalidations = RedisInvalidations(
+                        self._cache._client, self._local)
+        self._counts = {'local': collections.Counter(),
+                        'shared': collections.Counter()}
 
     def __getattr__(self, name):
         return getattr(self._cache, name)
 
+    def get(self, key):
+        if self._local and key.startswith(self.VOLATILE_PREFIX):
+            value = self._cache.get(key)
+            self._count('shared', int(value is not None),
+                        int(value is None))
+            return value
+        return self.get_many(key)[0]
+
+    def get_many(self, *keys):
+        values = [None] * len(keys)
+        missing = list(range(len(keys)))
+        version = None
+        if self._local:
+            version = self._local_version()
+        if version is not None:
+            epoch = self._local.epoch
+            for i, key in enumerate(keys):
+                values[i] = self._local.get(key, version)
+            missing = [i for i in missing if values[i] is None]
+            self._count('local', len(keys) - len(missing), len(missing))
+        if not missing:
+            return values
+        fetched = self._cache.get_many(*[keys[i] for i in missing])
+        hits = 0
+        for i, value in zip(missing, fetched):
+            values[i] = value
+            if value is not None:
+                hits += 1
+                if version is not None:
+                    self._local.set(keys[i], value, version, epoch)
+        self._count('shared', hits, len(missing) - hits)
+        return values
+
+    def add(self, *args, **kwargs):
+        # Never replaces a value, so local copies stay valid.
+        return self._cache.add(*args, **kwargs)
+
+    def set(self, key, *args, **kwargs):
+        return self._write([key], False, 'set', key, *args, **kwargs)
+
+    def set_many(self, mapping, *args, **kwargs):
+        mapping = dict(mapping)
+        return self._write(
+                list(mapping), False, 'set_many', mapping, *args, **kwargs)
+
+    def delete(self, key):
+        return self._write([key], True, 'delete', key)
+
+    def delete_many(self, *keys):
+        return self._write(list(keys), True, 'delete_many', *keys)
+
+    def inc(self, key, *args, **kwargs):
+        return self._write([key], True, 'inc', key, *args, **kwargs)
+
+    def dec(self, key, *args, **kwargs):
+        return self._write([key], True, 'dec', key, *args, **kwargs)
+
+    def clear(self):
+        rv = self._cache.clear()
+        if self._local:
+            self._local.evict()
+        if self._invalidations:
+            self._invalidations.publish(None)
+        return rv
+
+    def stats(self):
+        """Hit, miss and eviction counts for each tier."""
+        result = {'shared': dict(self._counts['shared'])}
+        result['shared']['evictions'] = self._shared_evictions()
+        if self._local:
+            result['local'] = dict(self._counts['local'])
+            result['local']['evictions'] = self._local.evictions
+            result['local']['bytes'] = self._local.size
+        return result
+
+    def _write(self, keys, invalidates, method, *args, **kwargs):
+        """Write keys, and if the write invalidates them, every copy."""
+        rv = getattr(self._cache, method)(*args, **kwargs)
+        keys = [k for k in keys if not k.startswith(self.VOLATILE_PREFIX)]
+        if not self._local or not keys:
+            return rv
+        self._local.evict(keys)
+        if self._invalidations:
+            self._invalidations.publish(keys)
+        elif invalidates and self._cache.inc(self.VERSION_KEY) is None:
+            self._cache.set(self.VERSION_KEY, _new_generation(), timeout=0)
+        return rv
+
+    def _local_version(self):
+        if self._invalidations:
+            # None, bypassing the local tier, while not subscribed.
+            return self._invalidations.version()
+        version = self._cache.get(self.VERSION_KEY)
+        if version is None:
+            # Start from a new value in case the key was evicted.
+            self._cache.add(self.VERSION_KEY, _new_generation(), timeout=0)
+            version = self._cache.get(self.VERSION_KEY)
+        return version
+
+    def _count(self, tier, hits, misses):
+        counts = self._counts[tier]
+        counts['hits'] += hits
+        counts['misses'] += misses
+
+    def _shared_evictions(self):
+        try:
+            if isinstance(self._cache, RedisCache):
+                stats = self._cache._client.info('stats')
+                return int(stats.get('evicted_keys', 0))
+            servers = self._cache._client.get_stats()
+        except Exception:
+            return None
+        return sum(int(stats.get('evictions', 0)) for _, stats in servers)
+
+
+class LocalCache(object):
+    """In-process LRU bounded by an estimate of its size in bytes."""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.evictions = 0
+        # Moved by every evict(), so values read before one aren't stored.
+        self.epoch = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """Get a value stored under version that has not expired."""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            value, item_version, expires, size = item
+            if item_version != version or expires < time.time():
+                self.size -= size
+                return None
+            self._items[key] = item
+            return value
+
+    def set(self, key, value, version, epoch=None):
+        """Store a value, unless evict() was called since epoch."""
+        size = _sizeof(key) + _sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if epoch is not None and epoch != self.epoch:
+                return
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[3]
+            self._items[key] = (value, version, time.time() + self.ttl, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, item = self._items.popitem(last=False)
+                self.size -= item[3]
+                self.evictions += 1
+
+    def evict(self, keys=None):
+        """Drop keys, or every key."""
+        with self._lock:
+            self.epoch += 1
+            if keys is None:
+                self._items.clear()
+                self.size = 0
+                return
+            for key in keys:
+                item = self._items.pop(key, None)
+                if item is not None:
+                    self.size -= item[3]
+
+    def clear(self):
+        self.evict()
+
+
+class RedisCache(cache.RedisCache):
+    """Redis, given as 'host', 'host:port' or a redis.Redis client.
+
+    Unlike werkzeug's, add() is atomic and can keep a key forever, and
+    timeouts are rounded up to whole seconds.
+    """
+
+    def __init__(self, host, **kwargs):
+        if isinstance(host, str) and ':' in host:
+            host, port = host.rsplit(':', 1)
+            kwargs['port'] = int(port)
+        super(RedisCache, self).__init__(host, **kwargs)
+
+    def _normalize_timeout(self, timeout):
+        timeout = super(RedisCache, self)._normalize_timeout(timeout)
+        if timeout > 0:
+            timeout = int(math.ceil(timeout))
+        return timeout
+
+    def add(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        return bool(self._client.set(
+                name=self.key_prefix + key, value=self.dump_object(value),
+                ex=None if timeout == -1 else timeout, nx=True))
+
+
+class RedisInvalidations(object):
+    """Evicts local copies of keys written by any process.
+
+    Writes publish the keys they touched on CHANNEL, and each process
+    listens on a thread of its own, started on first use so it survives
+    forking.  Until the subscription is confirmed, and whenever the
+    connection is lost, messages may be missed, so the local tier is
+    cleared and bypassed.
+    """
+
+    CHANNEL = 'scoreboard/invalidate'
+    RETRY_INTERVAL = 1
+
+    def __init__(self, client, local):
+        self._client = client
+        self._local = local
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pubsub = None
+        self._subscriptions = 0
+        self._version = None
+        self._stopped = False
+
+    def version(self):
+        """Version to store local copies under, or None if unsubscribed."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._version = None
+                    thread = threading.Thread(
+                            target=self._run, name='cache invalidations')
+                    thread.daemon = True
+                    thread.start()
+        return self._version
+
+    def publish(self, keys):
+        """Tell every process to evict keys, or everything for None."""
+        try:
+            self._client.publish(self.CHANNEL, json.dumps(keys))
+        except Exception as ex:
+            app.logger.warning('Unable to publish invalidation: %s', ex)
+
+    def stop(self):
+        self._stopped = True
+        with self._lock:
+            if self._pubsub is not None:
+                self._pubsub.close()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                pubsub = self._client.pubsub()
+                with self._lock:
+                    self._pubsub = pubsub
+                pubsub.subscribe(self.CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        self._local.evict()
+                        self._subscriptions += 1
+                        self._version = self._subscriptions
+                    elif message['type'] == 'message':
+                        self._local.evict(json.loads(message['data']))
+            except Exception as ex:
+                if not self._stopped:
+                    app.logger.warning('Lost cache invalidations: %s', ex)
+            self._version = None
+            self._local.evict()
+            if not self._stopped:
+                time.sleep(self.RETRY_INTERVAL)
+
+
+def _sizeof(value):
+    """Rough size of a cached value in bytes."""
+    if isinstance(value, (tuple, list)):
+        return 64 + sum(_sizeof(v) for v in value)
+    try:
+        return 64 + len(value)
+    except TypeError:
+        return 64
+
 
 global_cache = CacheWrapper(app)
 
 
+class Stats(object):
+    """Per-process counters and timings for each family of REST entries.
+
+    A family is the entry key with team ids and page numbers folded, e.g.
+    'tags/%d' or 'scoreboard'.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = collections.defaultdict(collections.Counter)
+        self._invalidations = collections.Counter()
+
+    def count(self, family, name, n=1):
+        with self._lock:
+            self._families[family][name] += n
+
+    def timing(self, family, name, seconds):
+        with self._lock:
+            counts = self._families[family]
+            counts[name] += 1
+            counts[name + '_seconds'] += seconds
+            counts[name + '_max_seconds'] = max(
+                    counts[name + '_max_seconds'], seconds)
+
+    def stored(self, family, size):
+        with self._lock:
+            counts = self._families[family]
+            counts['sets'] += 1
+            counts['set_bytes'] += size
+            counts['max_set_bytes'] = max(counts['max_set_bytes'], size)
+
+    def invalidated(self, tag):
+        with self._lock:
+            self._invalidations[_family(tag)] += 1
+
+    def report(self):
+        """Get the counters, with averages, by family."""
+        with self._lock:
+            families = dict(
+                    (f, dict(c)) for f, c in self._families.items())
+            invalidations = dict(self._invalidations)
+        for counts in families.values():
+            lookups = counts.get('hits', 0) + counts.get('misses', 0)
+            if lookups:
+                counts['hit_ratio'] = counts.get('hits', 0) / float(lookups)
+            for name in ('fetch', 'recompute'):
+                if counts.get(name):
+                    counts[name + '_mean_seconds'] = (
+                            counts[name + '_seconds'] / counts[name])
+            if counts.get('sets'):
+                counts['mean_set_bytes'] = (
+                        counts['set_bytes'] / float(counts['sets']))
+        return {'families': families, 'invalidations': invalidations}
+
+    def reset(self):
+        with self._lock:
+            self._families.clear()
+            self._invalidations.clear()
+
+
+stats = Stats()
+
+
+def _family(key):
+    """Fold ids out of a key, dropping generations and arguments."""
+    key = key.rsplit('@', 1)[0].split('?', 1)[0]
+    return re.sub(r'(?<=[/:])\d+(?=/|$)', '%d', key)
+
+
+# Longest a recomputation holds its lease before others stop waiting.
+LEASE_TIMEOUT = 5
+LEASE_POLL = 0.05
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+# Refresh stale entries in a separate thread, instead of in the request.
+background_refresh = True
+
+# Generations bumped, and caches cleared, by this process.
+_local_generations = collections.Counter()
+_local_epoch = 0
+_local_lock = threading.Lock()
+
+# Dependency tags for cached entries, invalidated with invalidate().
+CHALLENGES = 'challenges'
+NEWS = 'news'
+PREREQUISITES = 'prerequisites'
+SCOREBOARD = 'scoreboard'
+TAGS = 'tags'
+
+
+def team_tag(tid):
+    """Tag for everything cached about a single team."""
+    return 'team:%d' % tid
+
+
+def page_tag(path):
+    """Tag for a static page."""
+    return 'page:%s' % path
+
+
+def challenge_tag(cid):
+    """Tag for the solves of a single challenge."""
+    return 'challenge:%d' % cid
+
+
 def rest_cache(f_or_key):
-    """Mark a function for global caching."""
+    """Mark a function for global caching.
+
+    Entries are invalidated with delete(key).
+    """
     override_cache_key = None
 
     def wrap_func(f):
@@ -58,6 +492,7 @@ def rest_cache(f_or_key):
                             f.im_class.__name__, f.__name__)
                 except AttributeError:
                     cache_key = f.__name__
+            cache_key = tagged_key(cache_key, [cache_key])
             return _rest_cache_caller(f, cache_key, *args, **kwargs)
         return wrapped
     if isinstance(f_or_key, str):
@@ -71,13 +506,70 @@ def rest_cache_path(f):
 
     @functools.wraps(f)
     def wrapped(*args, **kwargs):
-        cache_key = flask.request.path.encode('utf-8')
+        cache_key = flask.request.path
+        cache_key = tagged_key(cache_key, [cache_key])
         return _rest_cache_caller(f, cache_key, *args, **kwargs)
     return wrapped
 
 
-def rest_team_cache(f_or_key):
-    """Mark a function for per-team caching."""
+def rest_cache_tagged(key, tags, stale=None):
+    """Cache a result under key until any of tags is invalidated.
+
+    The key and tags are formatted with the view's keyword arguments, e.g.
+    rest_cache_tagged('page/{path}', ['page:{path}']).
+
+    With stale set to a pair of (soft, hard) seconds, entries are refreshed
+    after soft seconds or an invalidation, and meanwhile served stale for up
+    to hard seconds after they were built.
+    """
+
+    def wrap_func(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            entry_key = key.format(**kwargs)
+            cache_key = tagged_key(
+                    entry_key, [t.format(**kwargs) for t in tags])
+            return _rest_cache_stale(
+                    f, entry_key, cache_key, stale, *args, **kwargs)
+        return wrapped
+    return wrap_func
+
+
+def rest_cache_args(base_key, tags=(), stale=None, **arg_types):
+    """Cache a result per combination of request arguments.
+
+    arg_types maps argument names to the type used to normalize them.
+    Every variant is invalidated with base_key, as well as with tags.
+    stale is as for rest_cache_tagged.
+    """
+
+    def wrap_func(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            variant = []
+            for name in sorted(arg_types):
+                value = flask.request.args.get(name)
+                if value is None:
+                    continue
+                try:
+                    variant.append('%s=%s' % (name, arg_types[name](value)))
+                except ValueError:
+                    # Let the handler report the bad argument.
+                    return f(*args, **kwargs)
+            entry_key = '%s?%s' % (base_key, '&'.join(variant))
+            cache_key = tagged_key(entry_key, (base_key,) + tuple(tags))
+            return _rest_cache_stale(
+                    f, entry_key, cache_key, stale, *args, **kwargs)
+        return wrapped
+    return wrap_func
+
+
+def rest_team_cache(f_or_key, tags=(), stale=None):
+    """Mark a function for per-team caching.
+
+    Entries are invalidated with the team's tag, as well as with tags.
+    stale is as for rest_cache_tagged.
+    """
     override_cache_key = None
 
     def wrap_func(f):
@@ -93,7 +585,11 @@ def rest_team_cache(f_or_key):
                     except AttributeError:
                         cache_key = '%s/%s' % (
                                 f.__name__, flask.g.tid)
-                return _rest_cache_caller(f, cache_key, *args, **kwargs)
+                entry_key = cache_key
+                cache_key = tagged_key(
+                        entry_key, (team_tag(flask.g.tid),) + tuple(tags))
+                return _rest_cache_stale(
+                        f, entry_key, cache_key, stale, *args, **kwargs)
             return f(*args, **kwargs)
         return wrapped
     if isinstance(f_or_key, str):
@@ -105,36 +601,347 @@ def rest_team_cache(f_or_key):
 
 
 def delete(key):
-    """Delete cache entry."""
+    """Delete cache entry, and any entries tagged with the key."""
     global_cache.delete(key)
+    bump_generation(key)
+    stats.invalidated(key)
+
+
+def invalidate(*tags):
+    """Invalidate every entry cached with any of tags."""
+    for tag in tags:
+        bump_generation(tag)
+        stats.invalidated(tag)
 
 
 def clear():
     """Flush global cache."""
+    global _local_epoch
     global_cache.clear()
+    with _local_lock:
+        _local_epoch += 1
 
 
-def delete_team(base_key):
-    """Delete team-based cache entry."""
-    if not flask.g.tid:
-        return
-    global_cache.delete(base_key % flask.g.tid)
+def tagged_key(key, tags):
+    """Get a key for an entry that depends on tags.
+
+    The key embeds the current generation of each tag, so invalidating a
+    tag orphans the entries built before it.
+    """
+    if not tags:
+        return key
+    return '%s@%s' % (key, '.'.join(str(g) for g in get_generations(tags)))
+
+
+def get_generations(names):
+    """Get the current generation numbers for names in one round trip."""
+    gens = global_cache.get_many(*[_generation_key(n) for n in names])
+    return [get_generation(n) if g is None else g
+            for n, g in zip(names, gens)]
+
+
+def get_generation(name):
+    """Get the current generation number for name."""
+    key = _generation_key(name)
+    gen = global_cache.get(key)
+    if gen is None:
+        gen = _new_generation()
+        if not global_cache.add(key, gen, timeout=0):
+            gen = global_cache.get(key) or gen
+    return gen
+
+
+def bump_generation(name):
+    """Move name to a new generation, orphaning entries keyed on the old."""
+    key = _generation_key(name)
+    gen = None
+    if global_cache.get(key) is not None:
+        gen = global_cache.inc(key)
+    if gen is None:
+        # Never restart from a small number: entries keyed on an evicted
+        # generation may still be in the cache.  The delete drops copies of
+        # the old generation kept in other processes.
+        gen = _new_generation()
+        global_cache.delete(key)
+        global_cache.set(key, gen, timeout=0)
+    with _local_lock:
+        _local_generations[name] += 1
+    return gen
+
+
+def is_shared():
+    """Whether the cache is shared with other processes."""
+    backend = getattr(global_cache, '_cache', global_cache)
+    return isinstance(backend, (cache.MemcachedCache, cache.RedisCache))
+
+
+def is_disabled():
+    """Whether the cache throws every entry away."""
+    backend = getattr(global_cache, '_cache', global_cache)
+    return isinstance(backend, cache.NullCache)
+
+
+def copy_version(names, generations=None):
+    """Get the version a copy built in process memory is valid under.
+
+    With a shared cache this is only the current generation of each of
+    names, the same in every process, so it can also be stored with shared
+    entries derived from the copy.  Otherwise generations never leave this
+    process (or, without a cache, are never stored), so the version counts
+    this process's bumps of names and cache clears.  Either way the last
+    element moves by one for each bump in this process.  See copy_expired
+    for changes that don't move the version.
+
+    generations, if given, are the current generations of names, to save
+    reading them again.
+    """
+    if is_shared():
+        if generations is None:
+            generations = get_generations(names)
+        return tuple(generations)
+    with _local_lock:
+        return (_local_epoch,) + tuple(_local_generations[n] for n in names)
+
+
+def copy_expired(built_at):
+    """Whether a copy built at built_at may miss other processes' changes.
+
+    Without a shared cache, versions only move for changes made in this
+    process, so copies are rebuilt after LOCAL_COPY_TTL seconds.
+    """
+    ttl = app.config.get('LOCAL_COPY_TTL')
+    if not ttl or is_shared():
+        return False
+    return time.time() - built_at >= ttl
+
+
+def _generation_key(name):
+    return 'generation/%s' % name
+
+
+def _new_generation():
+    return int(time.time() * 1000)
+
+
+class _Flight(object):
+    """A recomputation of a cache entry in progress in this process."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.rendered = None
+
+
+# How long an entry is fresh, and how long it may be served stale, along
+# with the key that holds the last response served.
+_Stale = collections.namedtuple('_Stale', ('key', 'soft', 'hard'))
 
 
 def _rest_cache_caller(f, cache_key, *args, **kwargs):
-    value = global_cache.get(cache_key)
-    if value:
+    """Serve from cache, with one recomputation per key at a time.
+
+    Entries hold the final response (status, headers and encoded body), so
+    a hit is returned without decoding or encoding any JSON.  Every key
+    embeds the generations it depends on, so a hash of the key is the ETag
+    of the entry, and conditional requests are answered before fetching it.
+
+    Threads missing the same key wait for the first one to finish, and
+    processes coordinate through a short lease in the shared cache.  If the
+    recomputation fails or takes longer than LEASE_TIMEOUT, the waiters
+    compute the value themselves.
+    """
+    return _rest_cache_serve(f, cache_key, None, args, kwargs)
+
+
+def _rest_cache_stale(f, key, cache_key, stale, *args, **kwargs):
+    """Serve from cache, tolerating stale entries.
+
+    stale is a (soft, hard) pair of seconds.  Entries are fresh for soft
+    seconds and until their tags are invalidated.  After that, the last
+    response for key is served for up to hard seconds after it was built,
+    while one request refreshes it in the background.
+    """
+    if stale is None:
+        return _rest_cache_caller(f, cache_key, *args, **kwargs)
+    stale = _Stale('stale/%s' % key, *stale)
+    family = _family(cache_key)
+    etag = _rest_etag(cache_key)
+    if flask.has_request_context() and (
+            flask.request.if_none_match.contains(etag)):
+        return _not_modified(etag, family)
+    start = time.time()
+    cached, last = global_cache.get_many(cache_key, stale.key)
+    stats.timing(family, 'fetch', time.time() - start)
+    if _is_rendered(cached):
+        stats.count(family, 'hits')
+        return _rest_response(cached, True, etag)
+    if isinstance(last, tuple) and len(last) == 2 and _is_rendered(last[0]):
+        stats.count(family, 'stale')
+        rendered, last_key = last
+        _rest_cache_refresh(f, cache_key, stale, args, kwargs)
+        etag = _rest_etag(last_key)
+        if flask.has_request_context() and (
+                flask.request.if_none_match.contains(etag)):
+            return _not_modified(etag, family)
+        return _rest_response(rendered, True, etag)
+    return _rest_cache_serve(f, cache_key, stale, args, kwargs)
+
+
+def _rest_cache_serve(f, cache_key, stale, args, kwargs):
+    family = _family(cache_key)
+    etag = _rest_etag(cache_key)
+    if flask.has_request_context() and (
+            flask.request.if_none_match.contains(etag)):
+        return _not_modified(etag, family)
+    start = time.time()
+    cached = global_cache.get(cache_key)
+    stats.timing(family, 'fetch', time.time() - start)
+    if _is_rendered(cached):
+        stats.count(family, 'hits')
+        return _rest_response(cached, True, etag)
+    stats.count(family, 'misses')
+    with _flights_lock:
+        flight = _flights.get(cache_key)
+        leader = flight is None
+        if leader:
+            flight = _flights[cache_key] = _Flight()
+    if not leader:
+        flight.done.wait(LEASE_TIMEOUT)
+        if flight.rendered is not None:
+            stats.count(family, 'coalesced')
+            return _rest_response(flight.rendered, True, etag)
+        return _rest_cache_fill(f, cache_key, cached, stale, args, kwargs)[0]
+    try:
+        rv, flight.rendered = _rest_cache_leader(
+                f, cache_key, cached, stale, args, kwargs)
+        return rv
+    finally:
+        flight.done.set()
+        with _flights_lock:
+            _flights.pop(cache_key, None)
+
+
+def _rest_etag(cache_key):
+    return hashlib.sha1(utils.to_bytes(cache_key)).hexdigest()
+
+
+def _not_modified(etag, family):
+    stats.count(family, 'not_modified')
+    resp = flask.Response(status=304)
+    resp.set_etag(etag)
+    return resp
+
+
+def _rest_cache_leader(f, cache_key, cached, stale, args, kwargs):
+    lease_key = 'lease/%s' % cache_key
+    deadline = time.time() + LEASE_TIMEOUT
+    while not global_cache.add(lease_key, 1, timeout=LEASE_TIMEOUT):
+        # Another process is recomputing: wait for its value, or for the
+        # lease to be released without one.
+        time.sleep(LEASE_POLL)
+        rendered = global_cache.get(cache_key)
+        if _is_rendered(rendered):
+            return _rest_response(
+                    rendered, True, _rest_etag(cache_key)), rendered
+        if time.time() > deadline or global_cache.get(lease_key) is None:
+            return _rest_cache_fill(
+                    f, cache_key, cached, stale, args, kwargs)
+    try:
+        return _rest_cache_fill(f, cache_key, cached, stale, args, kwargs)
+    finally:
+        global_cache.delete(lease_key)
+
+
+def _rest_cache_refresh(f, cache_key, stale, args, kwargs):
+    """Recompute a stale entry, unless someone already is."""
+    lease_key = 'lease/%s' % cache_key
+    if not global_cache.add(lease_key, 1, timeout=LEASE_TIMEOUT):
+        return
+
+    def refresh():
         try:
-            return _rest_add_cache_header(json.loads(value), True)
-        except ValueError:
-            pass
-    value = f(*args, **kwargs)
+            _rest_cache_fill(f, cache_key, True, stale, args, kwargs)
+        except Exception:
+            app.logger.exception('Refreshing %s failed.', cache_key)
+        finally:
+            global_cache.delete(lease_key)
+
+    if not background_refresh:
+        refresh()
+        return
+    # The handler may use the request and the session's identity.
+    globals_ = dict((name, getattr(flask.g, name))
+                    for name in ('uid', 'tid', 'admin')
+                    if hasattr(flask.g, name))
+
+    @flask.copy_current_request_context
+    def run():
+        for name, value in globals_.items():
+            setattr(flask.g, name, value)
+        refresh()
+
+    thread = threading.Thread(target=run, name='refresh %s' % cache_key)
+    thread.daemon = True
+    thread.start()
+
+
+def _rest_cache_fill(f, cache_key, cached, stale, args, kwargs):
+    """Compute and store a response, returning (response, rendered)."""
+    family = _family(cache_key)
+    start = time.time()
+    rv = f(*args, **kwargs)
+    rendered = _rest_render(rv)
+    stats.timing(family, 'recompute', time.time() - start)
+    if rendered is None:
+        stats.count(family, 'uncacheable')
+        return _rest_add_cache_header(rv), None
+    stats.stored(family, len(rendered[2]))
+    # TODO: only cache on success
+    timeout = stale.soft if stale else None
+    if cached:
+        # Replace an entry that couldn't be used.
+        global_cache.set(cache_key, rendered, timeout=timeout)
+    else:
+        global_cache.add(cache_key, rendered, timeout=timeout)
+    if stale:
+        global_cache.set(
+                stale.key, (rendered, cache_key), timeout=stale.hard)
+    return _rest_response(rendered, False, _rest_etag(cache_key)), rendered
+
+
+def _rest_render(rv):
+    """Encode a handler's return value as (status, headers, body).
+
+    Returns None for values that can't be encoded as JSON.
+    """
+    data, code, headers = rv, 200, None
+    if isinstance(rv, tuple):
+        if not 1 <= len(rv) <= 3:
+            return None
+        data, code, headers = (rv + (200, None))[:3]
+    if headers is not None and not isinstance(headers, dict):
+        return None
+    headers = dict(headers or {})
+    xssi = not headers.pop('X-No-XSSI', None)
     try:
-        # TODO: only cache on success
-        global_cache.set(cache_key, json.dumps(value))
+        body = utils.dump_json(data, xssi)
     except TypeError:
-        pass
-    return _rest_add_cache_header(value)
+        return None
+    return (code, sorted(headers.items()), utils.to_bytes(body))
+
+
+def _is_rendered(cached):
+    # Anything else was stored by an older version and is recomputed.
+    return isinstance(cached, tuple) and len(cached) == 3
+
+
+def _rest_response(rendered, hit, etag=None):
+    code, headers, body = rendered
+    resp = flask.Response(
+            body, status=code, headers=headers, mimetype='application/json')
+    resp.headers['X-Cache-Hit'] = str(hit)
+    if etag and code == 200:
+        resp.set_etag(etag)
+    return resp
 
 
 def _rest_add_cache_header(rv, hit=False):
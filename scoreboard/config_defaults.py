@@ -17,6 +17,8 @@ import os
 
 class Defaults(object):
     ATTACHMENT_BACKEND = 'file://attachments'
+    CACHE_LOCAL_BYTES = 0
+    CACHE_LOCAL_TTL = 5
     COUNT_QUERIES = False
     CSP_POLICY = None
     CWD = os.path.dirname(os.path.realpath(__file__))
@@ -27,17 +29,23 @@ class Defaults(object):
     FIRST_BLOOD_MIN = 0
     GAME_TIME = (None, None)
     INVITE_KEY = None
+    LOCAL_COPY_TTL = 10
     LOGIN_METHOD = 'local'
     MAIL_FROM = None
     MAIL_FROM_NAME = None
     MAIL_HOST = 'localhost'
     NEWS_POLL_INTERVAL = 60000
     PROOF_OF_WORK_BITS = 0
+    REDIS_HOST = 'localhost'
     RULES = '/rules'
+    SCOREBOARD_HISTORY_BUCKET = None
+    SCOREBOARD_HISTORY_POINTS = None
     SCOREBOARD_ZEROS = True
     SCORING = 'plain'
     SECRET_KEY = None
     TEAM_SECRET_KEY = None
+    SNAPSHOT_INTERVAL = 2
+    SNAPSHOT_MAX_AGE = 60
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SECURE = True
     SQLALCHEMY_TRACK_MODIFICATIONS = True
@@ -47,3 +55,6 @@ class Defaults(object):
     TEASE_HIDDEN = True
     TITLE = 'Scoreboard'
     SUBMIT_AFTER_END = True
+    WARMUP_ON_START = False
+    WARMUP_TEAMS = 100
+    WARMUP_THREADS = 4
@@ -12,16 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import datetime
 import flask
 import re
 from sqlalchemy import exc
+from sqlalchemy import orm
+import time
 import urllib
 
+from scoreboard import cache
 from scoreboard import errors
 from scoreboard import mail
 from scoreboard import main
 from scoreboard import models
+from scoreboard import prerequisites
+from scoreboard import ranking
 from scoreboard import utils
 from scoreboard import validators
 
@@ -85,7 +91,9 @@ def register_user(email, nick, password, team_id=None,
         raise errors.ValidationError('Unknown integrity error.')
     if not user.admin:
         models.ScoreHistory.add_entry(team)
+        tid = team.tid
         models.commit()
+        cache.invalidate(cache.team_tag(tid), cache.SCOREBOARD)
     app.logger.info('User %s <%s> registered from IP %s.',
                     nick, email, flask.request.remote_addr)
     return user
@@ -116,7 +124,9 @@ def change_user_team(uid, team_tid, code):
                         old_team.name)
         models.db.session.delete(old_team)
 
+    tids = (old_team.tid, team.tid)
     models.commit()
+    cache.invalidate(*([cache.team_tag(t) for t in tids] + [cache.SCOREBOARD]))
 
 
 @utils.require_submittable
@@ -140,10 +150,15 @@ def submit_answer(cid, answer, token):
         raise errors.AccessDeniedError('No team!')
     try:
         challenge = models.Challenge.query.get(cid)
-        if not challenge.unlocked_for_team(team):
+        if not challenge.unlocked:
             raise errors.AccessDeniedError('Challenge is locked!')
         validator = validators.GetValidatorForChallenge(challenge)
         if validator.validate_answer(answer, team):
+            # Only correct answers need the team's solves for prerequisites.
+            if not challenge.unlocked_for_team(team):
+                raise errors.AccessDeniedError('Challenge is locked!')
+            if challenge.is_answered(team):
+                raise errors.AccessDeniedError('Previously solved!')
             points = save_team_answer(challenge, team, answer)
             if utils.GameTime.over():
                 correct = 'CORRECT (Game Over)'
@@ -169,17 +184,82 @@ def submit_answer(cid, answer, token):
 def save_team_answer(challenge, team, answer):
     """Create the answer entry and update the scores."""
     ans = models.Answer.create(challenge, team, answer)
-    models.commit()
+    # Inserting the answer bumps the challenge's solve_count, which holds the
+    # challenge row lock until commit.  Read the count back inside the same
+    # transaction so the scoring delta comes from this solve's own ordinal,
+    # even if other solves landed after the challenge was loaded.
+    models.db.session.flush()
+    models.db.session.refresh(
+            challenge, ['solve_count'], with_for_update=True)
 
     team.last_solve = datetime.datetime.utcnow()
     challenge.update_answers(exclude_team=team)
+    challenge.update_current_points()
+
+    points = 0
+    if not utils.GameTime.over():
+        points = ans.current_points
+        # Other solves adjust this team's score in bulk, so add to the stored
+        # value rather than writing back the one loaded with the team.
+        team.score = models.Team.score + points
+        models.db.session.flush()
+        models.ScoreHistory.add_entry(team)
+    models.commit()
+
+    prerequisites.record_solve(team)
+    # Every team's challenge list shows the solve count, and maybe the value.
+    cache.invalidate(cache.challenge_tag(challenge.cid), cache.CHALLENGES)
+    return points
+
+
+def recalculate_scores():
+    """Recompute every team's score and challenge solve count from answers.
+
+    All answers are fetched in a single query and reduced to team totals in
+    one pass, rather than loading each team's answers and challenges.
+
+    Returns:
+      Tuple of (number of teams whose score changed, seconds elapsed).
+    """
+    start = time.time()
+    answers = models.db.session.query(
+            models.Answer.team_tid, models.Answer.challenge_cid,
+            models.Answer.timestamp, models.Answer.first_blood).all()
+    solves = collections.Counter(cid for _, cid, _, _ in answers)
+    challenges = models.Challenge.query.options(orm.lazyload('*')).all()
+    values = dict((c.cid, c.points_at(solves[c.cid])) for c in challenges)
+
+    totals = collections.defaultdict(int)
+    for tid, cid, timestamp, first_blood in answers:
+        if utils.GameTime.state(timestamp) == 'AFTER':
+            continue
+        totals[tid] += values.get(cid, 0) + first_blood
 
-    if utils.GameTime.over():
-        return 0
-    team.score += ans.current_points
-    models.ScoreHistory.add_entry(team)
+    changed = []
+    for tid, score in models.db.session.query(
+            models.Team.tid, models.Team.score):
+        if score != totals[tid]:
+            changed.append({'tid': tid, 'score': totals[tid]})
+    now = datetime.datetime.utcnow()
+    models.db.session.bulk_update_mappings(models.Team, changed)
+    models.db.session.bulk_insert_mappings(models.ScoreHistory, [
+        {'team_tid': t['tid'], 'when': now, 'score': t['score']}
+        for t in changed])
+    models.db.session.bulk_update_mappings(models.Challenge, [
+        {'cid': c.cid, 'cur_points': values[c.cid]}
+        for c in challenges if c.cur_points != values[c.cid]])
+    # Also repair the denormalized solve counters if they have drifted.
+    recounted = [
+        {'cid': c.cid, 'solve_count': solves[c.cid]}
+        for c in challenges if c.solve_count != solves[c.cid]]
+    if recounted:
+        app.logger.warning('Repaired solve counts for %d challenges.',
+                           len(recounted))
+        models.db.session.bulk_update_mappings(models.Challenge, recounted)
     models.commit()
-    return ans.current_points
+    if changed:
+        ranking.invalidate()
+    return len(changed), time.time() - start
 
 
 def test_answer(cid, answer):
@@ -20,21 +20,21 @@ import hashlib
 import hmac
 import json
 import logging
-import math
 import os
 import pbkdf2
 import re
 import sqlalchemy as sqlalchemy_base
 import time
 
+from sqlalchemy import event
 from sqlalchemy import exc
-from sqlalchemy import func
 from sqlalchemy import orm
 from sqlalchemy.ext import hybrid
 
 from scoreboard import attachments
 from scoreboard import errors
 from scoreboard import main
+from scoreboard import scoring
 from scoreboard import utils
 
 app = main.get_app()
@@ -105,15 +105,20 @@ class Team(db.Model):
             return None
 
     @classmethod
-    def enumerate(cls, with_history=False, above_zero=False):
+    def enumerate(cls, with_history=False, above_zero=False, limit=None,
+                  offset=0):
         if with_history:
             base = cls.query.options(orm.joinedload(cls.score_history))
         else:
             base = cls.query
         if above_zero:
             base = base.filter(cls.score > 0)
-        sorting = base.order_by(cls.score.desc(), cls.last_solve)
-        return enumerate(sorting.all(), 1)
+        sorting = base.order_by(cls.score.desc(), cls.last_solve, cls.tid)
+        if offset:
+            sorting = sorting.offset(offset)
+        if limit is not None:
+            sorting = sorting.limit(limit)
+        return enumerate(sorting.all(), offset + 1)
 
     @classmethod
     def all(cls, with_history=True):
@@ -152,6 +157,18 @@ class ScoreHistory(db.Model):
         entry.score = team.score
         db.session.merge(entry)
 
+    @classmethod
+    def for_teams(cls, tids):
+        """Get (when, score) rows for several teams, keyed by team."""
+        history = dict((tid, []) for tid in tids)
+        if not tids:
+            return history
+        rows = db.session.query(cls.team_tid, cls.when, cls.score).filter(
+                cls.team_tid.in_(tids))
+        for row in rows:
+            history[row.team_tid].append(row)
+        return history
+
 
 class User(db.Model):
     """A single User for login.  Player or admin."""
@@ -316,9 +333,9 @@ class Tag(db.Model):
     name = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text)
     challenges = db.relationship('Challenge',
-                                 backref=db.backref('tags', lazy='joined'),
+                                 backref=db.backref('tags', lazy='select'),
                                  secondary='tag_chall_association',
-                                 lazy='joined')
+                                 lazy='select')
 
     def __repr__(self):
         return '<Tag: %s/%s>' % (self.tagslug, self.name)
@@ -378,6 +395,7 @@ class Challenge(db.Model):
     weight = db.Column(db.Integer, nullable=False)  # Order for display
     prerequisite = db.Column(db.Text, nullable=False)  # Prerequisite Metadata
     cur_points = db.Column(db.Integer, nullable=True)
+    solve_count = db.Column(db.Integer, nullable=False, default=0)
     answers = db.relationship('Answer',
                               backref=db.backref('challenge', lazy='joined'),
                               lazy='select')
@@ -385,36 +403,26 @@ class Challenge(db.Model):
     def __repr__(self):
         return '<Challenge: %d/%s>' % (self.cid, self.name)
 
-    def is_answered(self, team=None, answers=None):
+    def is_answered(self, team=None):
         if team is None:
             team = Team.current()
         if not team:
             return False
-        if answers is not None:
-            for a in answers:
-                if a.team_tid == team.tid and a.challenge_cid == self.cid:
-                    return True
-            return False
-        return bool(Answer.query.filter(Answer.challenge == self,
-                                        Answer.team == team).count())
+        # Imported here, as prerequisites depends on this module.
+        from scoreboard import prerequisites
+        return prerequisites.is_solved(self, team)
 
     @hybrid.hybrid_property
     def solves(self):
-        try:
-            return self._solves
-        except AttributeError:
-            self._solves = len(self.answers)
-            return self._solves
+        return self.solve_count or 0
 
     @solves.expression
     def solves(cls):
-        return func.count(cls.answers)
+        return cls.solve_count
 
     @property
     def answered(self):
-        if not Team.current():
-            return False
-        return self.is_answered(answers=Team.current().answers)
+        return self.is_answered()
 
     @property
     def teaser(self):
@@ -426,70 +434,30 @@ class Challenge(db.Model):
 
     @property
     def current_points(self):
+        if app.config.get('SCORING', 'plain') == 'progressive':
+            return self.points_at(self.solves)
+        return self.points
+
+    def update_current_points(self):
+        """Persist cur_points, to be called when the solve count changes."""
+        self.cur_points = self.current_points
+
+    def points_at(self, solves):
+        """Value of this challenge once it has been solved solves times."""
         mode = app.config.get('SCORING', 'plain')
-        value = self.points
-        if mode == 'plain':
-            self.cur_points = value
-        elif mode == 'progressive':
+        if mode == 'progressive':
             speed = app.config.get('SCORING_SPEED', 12)
             min_points = 0 if self.min_points is None else self.min_points
-            self.cur_points = self.log_score(
-                    value, min_points, speed, self.solves)
-        return self.cur_points
-
-    @staticmethod
-    def log_score(max_points, min_points, midpoint, solves):
-        # Algorithm designed by symmetric
-        # logit(u, l, m, s, x) =
-        #       (u - l) * ((1.0 / (1.0 + exp((1.0/s) * (x - m)))) /
-        #       (1.0 / (1.0 + exp((1.0/s) * (1 - m))))) + l
-        if solves == 0:
-            return max_points
-
-        def log_func(midpoint, solves):
-            spread = midpoint / 3.0
-            delta = solves - midpoint
-            return (
-                    1.0 / (1.0 + math.exp((1.0 / spread) * delta)))
-        max_delta = (max_points - min_points)
-        base_point = log_func(midpoint, 1.0)
-        cur_point = log_func(midpoint, solves)
-        return math.ceil(max_delta * cur_point / base_point + min_points)
+            return scoring.points(self.points, min_points, speed, solves)
+        return self.points
+
+    log_score = staticmethod(scoring.log_score)
 
     def unlocked_for_team(self, team):
         """Checks if prerequisites are met for this team."""
-        if not self.unlocked:
-            return False
-        if not self.prerequisite:
-            return True
-        try:
-            prereq = json.loads(self.prerequisite)
-        except ValueError:
-            logging.error('Unable to parse prerequisite data for challenge %d',
-                          self.cid)
-            return False
-        if prereq['type'] == 'None':
-            return True
-        if not team:
-            return False
-        try:
-            eval_func = getattr(self, 'prereq_' + prereq['type'])
-        except AttributeError:
-            logging.error(
-                'Could not find prerequisite function for challenge %d',
-                self.cid)
-            return False
-        return eval_func(prereq, team)
-
-    def prereq_solved(self, prereq, team):
-        """Require that another challenge be solved first."""
-        chall = Challenge.query.get(int(prereq['challenge']))
-        if not chall:
-            logging.error('Challenge %d prerequisite depends on '
-                          'non-existent challenge %d.', self.cid,
-                          int(prereq['challenge']))
-            return False
-        return chall.is_answered(team=team, answers=team.answers)
+        # Imported here, as prerequisites depends on this module.
+        from scoreboard import prerequisites
+        return prerequisites.is_unlocked(self, team)
 
     @classmethod
     def create(cls, name, description, points, answer, unlocked=False,
@@ -505,6 +473,7 @@ class Challenge(db.Model):
         weight = db.session.query(db.func.max(Challenge.weight)).scalar()
         challenge.weight = (weight + 1) if weight else 1
         challenge.prerequisite = ''
+        challenge.cur_points = points
         db.session.add(challenge)
         return challenge
 
@@ -559,21 +528,53 @@ class Challenge(db.Model):
                 self.tags.remove(t)
 
     def update_answers(self, exclude_team=None):
-        """Update answers for variable scoring."""
+        """Update answers for variable scoring.
+
+        Only this challenge's value changes on a solve, so every earlier
+        solver moves by the same delta.  That is applied with a single bulk
+        UPDATE and recorded with a single INSERT ... SELECT into
+        ScoreHistory, rather than recomputing each team from its answers.
+
+        Call this in the transaction that inserted the solve, with
+        solve_count read back after the insert, so the delta is taken at
+        that solve's own position.
+        """
         mode = app.config.get('SCORING')
-        if mode == 'plain':
+        if mode != 'progressive':
             return
-        if mode == 'progressive':
-            for a in self.answers:
-                if a.team == exclude_team:
-                    continue
-                a.team.update_score()
+        solves = self.solves
+        delta = self.points_at(solves) - self.points_at(solves - 1)
+        if not delta:
+            return
+        solvers = db.session.query(Answer.team_tid).filter(
+                Answer.challenge_cid == self.cid)
+        if exclude_team is not None:
+            solvers = solvers.filter(Answer.team_tid != exclude_team.tid)
+        if utils.GameTime.end:
+            # Answers after the end of the game are worth nothing.
+            solvers = solvers.filter(Answer.timestamp <= utils.GameTime.end)
+        solvers = solvers.subquery()
+        Team.query.filter(Team.tid.in_(solvers)).update(
+                {Team.score: Team.score + delta}, synchronize_session=False)
+        now = sqlalchemy_base.literal(datetime.datetime.utcnow(), db.DateTime)
+        history = db.session.query(Team.tid, now, Team.score).filter(
+                Team.tid.in_(solvers))
+        db.session.execute(ScoreHistory.__table__.insert().from_select(
+                ['team_tid', 'when', 'score'], history))
+        # Teams already in the session now hold stale scores.
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, Team) and obj is not exclude_team:
+                db.session.expire(obj, ['score', 'score_history'])
 
     @classmethod
-    def get_joined_query(cls):
-        """Get a prejoined-query with answers and teams."""
+    def get_list_query(cls):
+        """Get a query loading what challenge lists show, in one query.
+
+        Only the tags and attachments are joined, not their challenges, so
+        each challenge takes at most its tags times its attachments rows.
+        """
         return cls.query.options(
-                orm.joinedload(cls.answers).joinedload(Answer.team))
+                orm.joinedload(cls.tags), orm.joinedload(cls.attachments))
 
 
 attach_challenge_association = db.Table(
@@ -595,8 +596,8 @@ class Attachment(db.Model):
     storage_path = db.Column(db.String(256))
 
     challenges = db.relationship(
-            'Challenge', backref=db.backref('attachments', lazy='joined'),
-            secondary='attach_chall_association', lazy='joined')
+            'Challenge', backref=db.backref('attachments', lazy='select'),
+            secondary='attach_chall_association', lazy='select')
 
     def __str__(self):
         return repr(self)
@@ -665,8 +666,6 @@ class Answer(db.Model):
         if flask.request:
             answer.submit_ip = flask.request.remote_addr
         db.session.add(answer)
-        # remove cache here
-        del challenge._solves
         return answer
 
     @property
@@ -677,6 +676,30 @@ class Answer(db.Model):
         return self.challenge.current_points + self.first_blood
 
 
+def _count_solve(connection, answer, delta):
+    """Keep Challenge.solve_count in step with the Answer table."""
+    table = Challenge.__table__
+    connection.execute(table.update().where(
+        table.c.cid == answer.challenge_cid).values(
+            solve_count=table.c.solve_count + delta))
+    session = orm.object_session(answer)
+    challenge = session.identity_map.get(
+            orm.util.identity_key(Challenge, answer.challenge_cid))
+    if challenge is not None and 'solve_count' in challenge.__dict__:
+        orm.attributes.set_committed_value(
+                challenge, 'solve_count', challenge.solve_count + delta)
+
+
+@event.listens_for(Answer, 'after_insert')
+def _answer_inserted(unused_mapper, connection, answer):
+    _count_solve(connection, answer, 1)
+
+
+@event.listens_for(Answer, 'after_delete')
+def _answer_deleted(unused_mapper, connection, answer):
+    _count_solve(connection, answer, -1)
+
+
 class News(db.Model):
     """News updates & broadcasts."""
 
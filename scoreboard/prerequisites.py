@@ -0,0 +1,369 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compiled challenge prerequisites.
+
+Each challenge's prerequisite is parsed and compiled into a rule once per
+version of the catalog, and a team's unlocked challenges are then found in
+a single pass over the rules.  Rules only read a TeamState, built once per
+team and request from the set of challenges it has solved, so however
+complex the prerequisites, evaluating them makes no queries.
+The catalog version is the copy version of the cache.PREREQUISITES tag, so
+challenges are only recompiled after the unlocked flag, prerequisite,
+weight or tags of a challenge change, or a challenge is added or deleted.
+Without a shared cache, edits made in other processes are picked up within
+LOCAL_COPY_TTL seconds.
+
+The challenges a team has solved are kept as a bitmap over the ordinals of
+the catalog's challenges, cached per team and rebuilt on each solve.  The
+graph also indexes the challenges with each tag in display order, so tag
+pages only load the challenges they show.
+
+Prerequisites are JSON objects with a type, and the parameters for it:
+  None: always unlocked.
+  solved: the challenge with cid 'challenge' is solved.
+  all, any: all or any of the challenges with the cids in 'challenges' are
+    solved, and all or any of the prerequisites in 'prerequisites' are met.
+  tag_solves: at least 'count' challenges with the tag 'tag' are solved.
+  score: the team has a score of at least 'score'.
+"""
+
+import collections
+import json
+import logging
+import threading
+import time
+
+import flask
+
+from scoreboard import cache
+from scoreboard import main
+from scoreboard import models
+
+app = main.get_app()
+
+# What rules are evaluated against: the set of cids solved, the number of
+# challenges solved by tag, and the score.
+TeamState = collections.namedtuple(
+        'TeamState', ('solved', 'tag_solves', 'score'))
+
+
+def _always(state):
+    return True
+
+
+def _never(state):
+    return False
+
+
+def _compile_solved(cid, prereq, graph):
+    """Require that another challenge be solved first."""
+    return _compile_challenge(cid, prereq['challenge'], graph)
+
+
+def _compile_challenge(cid, other, graph):
+    other = int(other)
+    if other not in graph:
+        logging.error('Challenge %d prerequisite depends on '
+                      'non-existent challenge %d.', cid, other)
+        return _never
+    return lambda state: other in state.solved
+
+
+def _compile_combination(combine):
+    def compile_combination(cid, prereq, graph):
+        rules = [_compile_challenge(cid, other, graph)
+                 for other in prereq.get('challenges', ())]
+        rules.extend(_compile(cid, p, graph)
+                     for p in prereq.get('prerequisites', ()))
+        return lambda state: combine(rule(state) for rule in rules)
+    return compile_combination
+
+
+def _compile_tag_solves(cid, prereq, graph):
+    """Require a number of solves among the challenges with a tag."""
+    tag = prereq['tag']
+    count = int(prereq['count'])
+    return lambda state: state.tag_solves.get(tag, 0) >= count
+
+
+def _compile_score(cid, prereq, graph):
+    """Require a minimum score."""
+    score = int(prereq['score'])
+    return lambda state: state.score >= score
+
+
+# Compilers for each type of prerequisite, by name.
+COMPILERS = {
+    'solved': _compile_solved,
+    'all': _compile_combination(all),
+    'any': _compile_combination(any),
+    'tag_solves': _compile_tag_solves,
+    'score': _compile_score,
+}
+
+
+def _compile(cid, prereq, graph):
+    if prereq['type'] == 'None':
+        return _always
+    try:
+        compiler = COMPILERS[prereq['type']]
+    except KeyError:
+        logging.error(
+            'Could not find prerequisite function for challenge %d', cid)
+        return _never
+    return compiler(cid, prereq, graph)
+
+
+def compile_rule(cid, unlocked, prerequisite, graph):
+    """Compile a challenge's prerequisite into a function of a TeamState.
+
+    Challenges referred to by the prerequisite are looked up in graph.
+    """
+    if not unlocked:
+        return _never
+    if not prerequisite:
+        return _always
+    try:
+        return _compile(cid, json.loads(prerequisite), graph)
+    except (KeyError, TypeError, ValueError):
+        logging.error('Unable to parse prerequisite data for challenge %d',
+                      cid)
+        return _never
+
+
+class Graph(object):
+    """The compiled prerequisites of every challenge."""
+
+    def __init__(self, rows, tags=(), version=None):
+        """Compile rows of (cid, unlocked, prerequisite), in display order.
+
+        tags are (tagslug, cid) pairs for the challenges with each tag.
+        """
+        rows = list(rows)
+        self.version = version
+        # Dense ordinals for solved bitmaps, the same in every process.
+        self.cids = sorted(row[0] for row in rows)
+        self.ordinals = dict((cid, i) for i, cid in enumerate(self.cids))
+        self.released = set(cid for cid, unlocked, _ in rows if unlocked)
+        order = dict((row[0], i) for i, row in enumerate(rows))
+        self.tags = collections.defaultdict(set)
+        for tag, cid in tags:
+            if cid in order:
+                self.tags[tag].add(cid)
+        self._tag_index = dict(
+                (tag, sorted(cids, key=order.get))
+                for tag, cids in self.tags.items())
+        self._rules = dict(
+                (cid, compile_rule(cid, unlocked, prerequisite, self))
+                for cid, unlocked, prerequisite in rows)
+
+    def __contains__(self, cid):
+        return cid in self.ordinals
+
+    def tagged(self, tag):
+        """Get the cids of unlocked challenges with tag, in display order."""
+        return [cid for cid in self._tag_index.get(tag, ())
+                if cid in self.released]
+
+    def state(self, solved, score):
+        """Get the TeamState of a team with the solved cids and score."""
+        tag_solves = dict(
+                (tag, len(cids & solved)) for tag, cids in self.tags.items())
+        return TeamState(solved, tag_solves, score or 0)
+
+    def unlocked(self, state):
+        """Get the cids unlocked for a team in state, a TeamState.
+
+        Without a team, state is None and only challenges without
+        prerequisites are unlocked.
+        """
+        if state is None:
+            return set(
+                    cid for cid, rule in self._rules.items()
+                    if rule is _always)
+        return set(
+                cid for cid, rule in self._rules.items() if rule(state))
+
+    def to_bits(self, cids):
+        """Get the bitmap of cids, ignoring any not in the catalog."""
+        bits = 0
+        for cid in cids:
+            if cid in self.ordinals:
+                bits |= 1 << self.ordinals[cid]
+        return bits
+
+    def from_bits(self, bits):
+        """Get the set of cids in a bitmap."""
+        rv = set()
+        for cid in self.cids:
+            if not bits:
+                break
+            if bits & 1:
+                rv.add(cid)
+            bits >>= 1
+        return rv
+
+
+_compiled = None
+_compiled_lock = threading.Lock()
+
+
+def get_graph(challenges=None):
+    """Get the Graph of the current catalog, compiling it if it changed.
+
+    challenges, if given, are every Challenge, to compile from instead of
+    querying for them.
+    """
+    global _compiled
+    graph = flask.g.get('prerequisite_graph')
+    if graph is not None:
+        return graph
+    # Read the version first, so a change made while compiling leaves the
+    # graph under an outdated version.
+    version = cache.copy_version([cache.PREREQUISITES])
+    with _compiled_lock:
+        compiled = _compiled
+    if compiled is not None and compiled[0] == version:
+        if cache.copy_expired(compiled[1]):
+            # Another process may have changed the catalog.  Move the
+            # version, so what was cached here against the old graph goes.
+            cache.bump_generation(cache.PREREQUISITES)
+            version = cache.copy_version([cache.PREREQUISITES])
+        else:
+            graph = compiled[2]
+    if graph is None:
+        built_at = time.time()
+        if challenges is None:
+            association = models.tag_challenge_association.c
+            joined = models.db.session.query(
+                    models.Challenge.cid, models.Challenge.unlocked,
+                    models.Challenge.prerequisite,
+                    association.tag_tagslug).outerjoin(
+                    models.tag_challenge_association,
+                    association.challenge_cid == models.Challenge.cid
+                    ).order_by(
+                    models.Challenge.weight, models.Challenge.cid).all()
+            rows = list(collections.OrderedDict.fromkeys(
+                    row[:3] for row in joined))
+            tags = [(row[3], row[0]) for row in joined if row[3]]
+        else:
+            challenges = sorted(challenges, key=lambda c: (c.weight, c.cid))
+            rows = [(c.cid, c.unlocked, c.prerequisite) for c in challenges]
+            tags = [(t.tagslug, c.cid) for c in challenges for t in c.tags]
+        graph = Graph(rows, tags, version)
+        with _compiled_lock:
+            _compiled = (version, built_at, graph)
+    flask.g.prerequisite_graph = graph
+    return graph
+
+
+def _solved_key(tid):
+    return cache.tagged_key('solved/%d' % tid, ['solved:%d' % tid])
+
+
+def _query_solved(team):
+    rows = models.db.session.query(models.Answer.challenge_cid).filter(
+            models.Answer.team_tid == team.tid)
+    return [cid for cid, in rows]
+
+
+def solved_bits(team):
+    """Get the bitmap of challenges solved by team, by ordinal in the graph."""
+    graph = get_graph()
+    memo = flask.g.setdefault('solved_bits', {})
+    if team.tid in memo:
+        return memo[team.tid]
+    key = _solved_key(team.tid)
+    cached = cache.global_cache.get(key)
+    if cached is not None and cached[0] == graph.version:
+        bits = cached[1]
+    else:
+        bits = graph.to_bits(_query_solved(team))
+        cache.global_cache.set(key, (graph.version, bits))
+    memo[team.tid] = bits
+    return bits
+
+
+def record_solve(team):
+    """Rebuild team's solved bitmap, after committing a new answer.
+
+    The bitmap moves to a new generation before the answers are read, so
+    with concurrent solves the current entry is always the newest one.
+    """
+    graph = get_graph()
+    cache.bump_generation('solved:%d' % team.tid)
+    bits = graph.to_bits(_query_solved(team))
+    cache.global_cache.set(_solved_key(team.tid), (graph.version, bits))
+    flask.g.setdefault('solved_bits', {})[team.tid] = bits
+    flask.g.get('unlocked_cids', {}).pop(team.tid, None)
+
+
+def solved_cids(team):
+    """Get the set of cids solved by team."""
+    return get_graph().from_bits(solved_bits(team))
+
+
+def is_solved(challenge, team):
+    """Check if team has solved challenge."""
+    ordinal = get_graph().ordinals.get(challenge.cid)
+    if ordinal is None:
+        # Not yet committed, so not in the graph.
+        return challenge.cid in _query_solved(team)
+    return bool(solved_bits(team) >> ordinal & 1)
+
+
+def team_state(team):
+    """Get the TeamState of team, or None without a team."""
+    if not team:
+        return None
+    return get_graph().state(solved_cids(team), team.score)
+
+
+def unlocked_cids(team, challenges=None):
+    """Get the set of cids unlocked for team, or for no team if None.
+
+    challenges is as for get_graph.
+    """
+    graph = get_graph(challenges)
+    memo = flask.g.setdefault('unlocked_cids', {})
+    tid = team.tid if team else None
+    if tid not in memo:
+        memo[tid] = graph.unlocked(team_state(team))
+    return memo[tid]
+
+
+def is_unlocked(challenge, team):
+    """Check if challenge is unlocked for team."""
+    if not challenge.unlocked:
+        return False
+    if not challenge.prerequisite:
+        return True
+    if challenge.cid in get_graph():
+        return challenge.cid in unlocked_cids(team)
+    # Not yet committed, so not in the graph.
+    rule = compile_rule(
+            challenge.cid, challenge.unlocked, challenge.prerequisite,
+            get_graph())
+    if rule is _always:
+        return True
+    return bool(team) and rule(team_state(team))
+
+
+@app.before_request
+def reset():
+    """Forget the graph and team state of the previous request."""
+    flask.g.pop('prerequisite_graph', None)
+    flask.g.pop('unlocked_cids', None)
+    flask.g.pop('solved_bits', None)
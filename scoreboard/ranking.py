@@ -0,0 +1,179 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-process index of team ranks.
+
+Teams are kept sorted the way Team.enumerate orders them, so a team's rank
+is a binary search away.  Committed changes to a team's score are applied
+in place.  Bulk updates cause a rebuild from the database, as do changes
+made by other processes: at once with a shared cache, or within
+LOCAL_COPY_TTL seconds without one.
+"""
+
+import bisect
+import datetime
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy import orm
+
+from scoreboard import cache
+from scoreboard import main
+from scoreboard import models
+
+app = main.get_app()
+
+GENERATION = 'ranks'
+
+
+def sort_key(tid, score, last_solve):
+    """Key ordering teams as on the scoreboard."""
+    return (-(score or 0), last_solve or datetime.datetime.min, tid)
+
+
+class RankIndex(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._by_tid = {}
+        self._version = None
+        self._built_at = 0
+
+    def ranks(self, tids):
+        """Get a dict of rank by team id.
+
+        Teams not shown on the scoreboard have a rank of None.
+        """
+        version = cache.copy_version([GENERATION])
+        zeros = app.config.get('SCOREBOARD_ZEROS')
+        with self._lock:
+            if (version != self._version or
+                    cache.copy_expired(self._built_at)):
+                self._rebuild(version)
+            result = {}
+            for tid in tids:
+                key = self._by_tid.get(tid)
+                if key is None or (key[0] >= 0 and not zeros):
+                    result[tid] = None
+                else:
+                    result[tid] = bisect.bisect_left(self._keys, key) + 1
+            return result
+
+    def rank(self, tid):
+        return self.ranks([tid])[tid]
+
+    def apply(self, changes):
+        """Apply committed changes, a dict of sort key (or None) by tid."""
+        gen = cache.bump_generation(GENERATION)
+        version = cache.copy_version([GENERATION], [gen])
+        with self._lock:
+            if not _follows(version, self._version):
+                # Someone else changed scores too; rebuild on next read.
+                self._version = None
+                return
+            for tid, key in changes.items():
+                old = self._by_tid.pop(tid, None)
+                if old is not None:
+                    del self._keys[bisect.bisect_left(self._keys, old)]
+                if key is not None:
+                    bisect.insort(self._keys, key)
+                    self._by_tid[tid] = key
+            self._version = version
+
+    def invalidate(self):
+        """Force a rebuild in every process."""
+        cache.bump_generation(GENERATION)
+        with self._lock:
+            self._version = None
+
+    def _rebuild(self, version):
+        self._built_at = time.time()
+        rows = models.db.session.query(
+                models.Team.tid, models.Team.score, models.Team.last_solve)
+        self._by_tid = dict((r[0], sort_key(*r)) for r in rows)
+        self._keys = sorted(self._by_tid.values())
+        self._version = version
+
+
+def _follows(version, previous):
+    """Whether version is previous after a single bump by this process."""
+    return (previous is not None and version[:-1] == previous[:-1] and
+            version[-1] == previous[-1] + 1)
+
+
+index = RankIndex()
+
+
+def rank(tid):
+    return index.rank(tid)
+
+
+def ranks(tids):
+    return index.ranks(tids)
+
+
+def invalidate():
+    index.invalidate()
+
+
+# Track changes to team scores and apply them to the index on commit.
+_INFO_KEY = 'ranking'
+
+
+@event.listens_for(orm.Session, 'after_flush')
+def _record_changes(session, flush_context):
+    changes = {}
+    for team in session.new:
+        if isinstance(team, models.Team):
+            changes[team.tid] = sort_key(team.tid, team.score, team.last_solve)
+    for team in session.dirty:
+        if isinstance(team, models.Team) and (
+                orm.attributes.get_history(team, 'score').has_changes() or
+                orm.attributes.get_history(
+                    team, 'last_solve').has_changes()):
+            changes[team.tid] = sort_key(team.tid, team.score, team.last_solve)
+    for team in session.deleted:
+        if isinstance(team, models.Team):
+            changes[team.tid] = None
+    if not changes:
+        return
+    pending = session.info.setdefault(_INFO_KEY, {})
+    if pending is not None:
+        pending.update(changes)
+
+
+@event.listens_for(orm.Session, 'after_bulk_update')
+@event.listens_for(orm.Session, 'after_bulk_delete')
+def _record_bulk(bulk_context):
+    if bulk_context.mapper.class_ is models.Team:
+        bulk_context.session.info[_INFO_KEY] = None
+
+
+@event.listens_for(orm.Session, 'after_commit')
+def _apply_changes(session):
+    if _INFO_KEY not in session.info:
+        return
+    changes = session.info.pop(_INFO_KEY)
+    if changes is None:
+        index.invalidate()
+    else:
+        index.apply(changes)
+
+
+@event.listens_for(orm.Session, 'after_transaction_end')
+def _discard_changes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_INFO_KEY, None)
@@ -0,0 +1,163 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reconstruct the scoreboard at a point in time from the answer log.
+
+Answers are replayed in timestamp order with the same rules the live
+scoreboard applies: the active scoring mode, stored first blood bonuses,
+and no points for answers after the end of the game.  The team scores are
+checkpointed every CHECKPOINT_INTERVAL answers, so reconstructing any time
+only replays the answers since the nearest checkpoint.
+"""
+
+import bisect
+import collections
+import threading
+
+from sqlalchemy import func
+from sqlalchemy import orm
+
+from scoreboard import main
+from scoreboard import models
+from scoreboard import ranking
+from scoreboard import scoring
+from scoreboard import utils
+
+app = main.get_app()
+
+CHECKPOINT_INTERVAL = 256
+
+Event = collections.namedtuple(
+        'Event', ('timestamp', 'tid', 'cid', 'first_blood'))
+
+
+class Replay(object):
+    """Team scores over time."""
+
+    def __init__(self, events, value, end=None,
+                 interval=CHECKPOINT_INTERVAL):
+        """Replay events, a list of Event sorted by timestamp.
+
+        value(cid, solves) gives the points of a challenge with that many
+        solves, and answers after end count as solves but score nothing.
+        """
+        self._events = events
+        self._times = [e.timestamp for e in events]
+        self._value = value
+        self._end = end
+        self._interval = interval
+        self._by_cid = collections.defaultdict(list)
+        for i, e in enumerate(events):
+            self._by_cid[e.cid].append(i)
+        # Checkpoint k holds the state after k * interval events.
+        self._checkpoints = [self._empty_state()]
+        self._lock = threading.Lock()
+
+    def scores(self, when):
+        """Get (score, last solve) dicts by team id as of when."""
+        count = bisect.bisect_right(self._times, when)
+        k = count // self._interval
+        with self._lock:
+            while len(self._checkpoints) <= k:
+                state = self._copy_state(self._checkpoints[-1])
+                start = (len(self._checkpoints) - 1) * self._interval
+                self._advance(state, start, start + self._interval)
+                self._checkpoints.append(state)
+            state = self._copy_state(self._checkpoints[k])
+        self._advance(state, k * self._interval, count)
+        return state[0], state[1]
+
+    def _advance(self, state, start, stop):
+        scores, last_solve, solves = state
+        for i in range(start, stop):
+            e = self._events[i]
+            solves[e.cid] += 1
+            value = self._value(e.cid, solves[e.cid])
+            delta = value - self._value(e.cid, solves[e.cid] - 1)
+            if delta and solves[e.cid] > 1:
+                # Earlier solvers hold the challenge at its new value too.
+                earlier = self._by_cid[e.cid]
+                for j in earlier[:bisect.bisect_left(earlier, i)]:
+                    if not self._after_end(self._events[j]):
+                        scores[self._events[j].tid] += delta
+            if self._after_end(e):
+                continue
+            scores[e.tid] += value + e.first_blood
+            last_solve[e.tid] = e.timestamp
+
+    def _after_end(self, event):
+        return self._end is not None and event.timestamp > self._end
+
+    @staticmethod
+    def _empty_state():
+        return (collections.defaultdict(int), {}, collections.Counter())
+
+    @staticmethod
+    def _copy_state(state):
+        scores, last_solve, solves = state
+        return (collections.defaultdict(int, scores), dict(last_solve),
+                collections.Counter(solves))
+
+
+_cached = None
+_cached_lock = threading.Lock()
+
+
+def get_replay():
+    """Get a Replay of the current answer log, reused while it is current."""
+    global _cached
+    challenges = models.Challenge.query.options(orm.lazyload('*')).all()
+    params = dict(
+            (c.cid, (c.points, c.min_points or 0)) for c in challenges)
+    count, latest = models.db.session.query(
+            func.count(models.Answer.team_tid),
+            func.max(models.Answer.timestamp)).one()
+    mode = app.config.get('SCORING', 'plain')
+    speed = app.config.get('SCORING_SPEED', 12)
+    key = (count, latest, sorted(params.items()), mode, speed,
+           utils.GameTime.end)
+    with _cached_lock:
+        if _cached is not None and _cached[0] == key:
+            return _cached[1]
+
+    def value(cid, solves):
+        if cid not in params:
+            return 0
+        points, min_points = params[cid]
+        if mode == 'progressive':
+            return scoring.points(points, min_points, speed, solves)
+        return points
+
+    rows = models.db.session.query(
+            models.Answer.timestamp, models.Answer.team_tid,
+            models.Answer.challenge_cid, models.Answer.first_blood).order_by(
+            models.Answer.timestamp)
+    events = [Event(*row) for row in rows]
+    replay = Replay(events, value, end=utils.GameTime.end)
+    with _cached_lock:
+        _cached = (key, replay)
+    return replay
+
+
+def scoreboard(when):
+    """Get the scoreboard as of when, as (position, tid, name, score)."""
+    scores, last_solve = get_replay().scores(when)
+    teams = models.db.session.query(models.Team.tid, models.Team.name).all()
+    standings = sorted(
+            teams, key=lambda t: ranking.sort_key(
+                t.tid, scores.get(t.tid), last_solve.get(t.tid)))
+    if not app.config.get('SCOREBOARD_ZEROS'):
+        standings = [t for t in standings if scores.get(t.tid, 0) > 0]
+    return [(i, t.tid, t.name, scores.get(t.tid, 0))
+            for i, t in enumerate(standings, 1)]
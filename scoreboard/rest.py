@@ -16,8 +16,11 @@ import datetime
 import flask
 import flask_restful
 from flask_restful import fields
+import functools
 import json
+import os
 import pytz
+import time
 
 from scoreboard import attachments
 from scoreboard import auth
@@ -28,8 +31,13 @@ from scoreboard import csrfutil
 from scoreboard import errors
 from scoreboard import main
 from scoreboard import models
+from scoreboard import prerequisites
+from scoreboard import ranking
+from scoreboard import replay
+from scoreboard import snapshot
 from scoreboard import utils
 from scoreboard import validators
+from scoreboard import warmup
 
 app = main.get_app()
 api = flask_restful.Api(app)
@@ -67,19 +75,30 @@ class PrerequisiteField(fields.Raw):
 @api.representation('application/json')
 def output_json(data, code, headers=None):
     """Custom JSON output with JSONP buster."""
+    xssi = not (headers and headers.pop('X-No-XSSI', None))
+    resp = flask.make_response(utils.dump_json(data, xssi), code)
+    resp.headers.extend(headers or {})
+    return resp
 
-    settings = {}
-    if app.debug:
-        settings['indent'] = 4
-        settings['sort_keys'] = True
 
-    dumped = json.dumps(data, **settings)
-    if not (headers and headers.pop('X-No-XSSI', None)):
-        dumped = ")]}',\n" + dumped + "\n"
+@app.after_request
+def add_etag(response):
+    """Answer conditional API reads that don't already have an ETag.
 
-    resp = flask.make_response(dumped, code)
-    resp.headers.extend(headers or {})
-    return resp
+    Cached endpoints derive their ETags from cache generations; anything
+    else gets one from a hash of the body, which saves the transfer but
+    not the work of producing it.
+    """
+    if (flask.request.method not in ('GET', 'HEAD') or
+            not flask.request.path.startswith('/api/') or
+            response.status_code not in (200, 304) or
+            response.is_streamed or response.direct_passthrough):
+        return response
+    response.headers.setdefault('Cache-Control', 'no-cache')
+    if response.status_code == 200:
+        response.add_etag()
+        response.make_conditional(flask.request)
+    return response
 
 
 def get_field(name, *args):
@@ -202,6 +221,7 @@ class Team(flask_restful.Resource):
         'points': fields.Integer,
     }
     resource_fields = team_fields.copy()
+    resource_fields['rank'] = fields.Integer
     resource_fields['players'] = fields.Nested(User.resource_fields)
     resource_fields['score_history'] = fields.Nested(history_fields)
     resource_fields['solved_challenges'] = fields.Nested(solved_challenges)
@@ -227,6 +247,7 @@ class Team(flask_restful.Resource):
                     })
             result['solved_challenges'] = challenges
             result['score_history'] = team.score_history
+            result['rank'] = ranking.rank(team.tid)
         else:
             result['solved_challenges'] = []
             result['score_history'] = []
@@ -243,11 +264,20 @@ class Team(flask_restful.Resource):
         app.logger.info('Update of team %r by %r.',
                         team, models.User.current())
         data = flask.request.get_json()
+        old_name = team.name
         # Writable fields
         for field in ('name', 'score'):
             setattr(team, field, data.get(field, getattr(team, field)))
         models.commit()
-        cache.delete_team('team/%d')
+        tags = [cache.team_tag(team.tid), cache.SCOREBOARD]
+        if team.name != old_name:
+            # Solves of a challenge name the teams that solved it.
+            solved = models.db.session.query(
+                    models.Answer.challenge_cid).filter(
+                    models.Answer.team_tid == team.tid)
+            tags.extend(cache.challenge_tag(cid) for cid, in solved)
+        cache.invalidate(*tags)
+        scoreboard_snapshot.invalidate()
         return self._marshal_team(team)
 
 
@@ -291,6 +321,7 @@ class Session(flask_restful.Resource):
         'name': fields.String,
         'score': fields.Integer,
         'code': fields.String,
+        'rank': fields.Integer,
     }
     resource_fields = {
         'user': fields.Nested(User.resource_fields),
@@ -302,9 +333,13 @@ class Session(flask_restful.Resource):
     @flask_restful.marshal_with(resource_fields)
     def get(self):
         """Get the current session."""
-        return dict(
-                user=models.User.current(),
-                team=models.Team.current())
+        team = models.Team.current()
+        if team:
+            team = dict(
+                    (k, getattr(team, k)) for k in self.team_fields
+                    if k != 'rank')
+            team['rank'] = ranking.rank(team['tid'])
+        return dict(user=models.User.current(), team=team)
 
     @flask_restful.marshal_with(resource_fields)
     def post(self):
@@ -421,11 +456,14 @@ class Challenge(flask_restful.Resource):
         'team': fields.Nested(team_fields),
     }
 
-    resource_fields = challenge_fields.copy()
-    resource_fields['attachments'] = fields.List(
+    # Lists leave out the answers, which are served by ChallengeSolves.
+    list_fields = challenge_fields.copy()
+    list_fields['attachments'] = fields.List(
             fields.Nested(attachment_fields))
-    resource_fields['tags'] = fields.List(
+    list_fields['tags'] = fields.List(
             fields.Nested(tags_fields))
+
+    resource_fields = list_fields.copy()
     resource_fields['answers'] = fields.List(
             fields.Nested(answers_fields))
 
@@ -438,6 +476,9 @@ class Challenge(flask_restful.Resource):
         challenge = models.Challenge.query.get_or_404(challenge_id)
         data = flask.request.get_json()
         old_unlocked = challenge.unlocked
+        old_prerequisite = challenge.prerequisite
+        old_weight = challenge.weight
+        old_tags = set(t.tagslug for t in challenge.tags)
         for field in (
                 'name', 'description', 'points', 'min_points',
                 'unlocked', 'weight'):
@@ -459,22 +500,30 @@ class Challenge(flask_restful.Resource):
             challenge.prerequisite = ''
         if 'tags' in data:
             challenge.set_tags(data['tags'])
+        challenge.update_current_points()
+        tags = [cache.CHALLENGES]
         if challenge.unlocked and not old_unlocked:
             news = 'Challenge "%s" unlocked!' % challenge.name
             models.News.game_broadcast(message=news)
+            tags.append(cache.NEWS)
+        if (challenge.unlocked != old_unlocked or
+                challenge.prerequisite != old_prerequisite or
+                challenge.weight != old_weight or
+                set(t.tagslug for t in challenge.tags) != old_tags):
+            tags.append(cache.PREREQUISITES)
 
         app.logger.info('Challenge %s updated by %r.',
                         challenge, models.User.current())
 
         models.commit()
-        cache.clear()
+        cache.invalidate(*tags)
         return challenge
 
     def delete(self, challenge_id):
         challenge = models.Challenge.query.get_or_404(challenge_id)
         models.db.session.delete(challenge)
         models.commit()
-        cache.clear()
+        cache.invalidate(cache.CHALLENGES, cache.PREREQUISITES)
 
 
 class ChallengeList(flask_restful.Resource):
@@ -487,24 +536,27 @@ class ChallengeList(flask_restful.Resource):
     decorators = [utils.require_started]
 
     resource_fields = {
-        'challenges': fields.Nested(Challenge.resource_fields)
+        'challenges': fields.Nested(Challenge.list_fields)
     }
 
     @staticmethod
     def _tease_challenge(chall):
         """Hide parts to be teased."""
-        res = {k: getattr(chall, k) for k in Challenge.resource_fields}
+        res = {k: getattr(chall, k) for k in Challenge.list_fields}
         for f in ('description', 'attachments'):
             del res[f]
         return res
 
+    @cache.rest_team_cache('challenges/%d', tags=[cache.CHALLENGES])
     @flask_restful.marshal_with(resource_fields)
     def get(self):
-        q = models.Challenge.get_joined_query()
+        q = models.Challenge.get_list_query()
         challs = []
-        t = models.Team.current()
-        for chall in q.all():
-            if utils.is_admin() or chall.unlocked_for_team(t):
+        challenges = q.all()
+        unlocked = prerequisites.unlocked_cids(
+                models.Team.current(), challenges)
+        for chall in challenges:
+            if utils.is_admin() or chall.cid in unlocked:
                 challs.append(chall)
             elif chall.teaser:
                 challs.append(self._tease_challenge(chall))
@@ -531,6 +583,7 @@ class ChallengeList(flask_restful.Resource):
             chall.min_points = data['min_points']
         else:
             chall.min_points = chall.points
+        chall.update_current_points()
         if 'attachments' in data:
             chall.set_attachments(data['attachments'])
         if 'prerequisite' in data:
@@ -538,16 +591,49 @@ class ChallengeList(flask_restful.Resource):
         if 'tags' in data:
             chall.set_tags(data['tags'])
 
+        tags = [cache.CHALLENGES, cache.PREREQUISITES]
         if unlocked and utils.GameTime.open():
             news = 'New challenge created: "%s"' % chall.name
             models.News.game_broadcast(message=news)
+            tags.append(cache.NEWS)
 
         models.commit()
         app.logger.info('Challenge %s created by %r.',
                         chall, models.User.current())
+        cache.invalidate(*tags)
         return chall
 
 
+class ChallengeSolves(flask_restful.Resource):
+    """Teams that solved a challenge, in the order they solved it."""
+
+    decorators = [utils.require_started]
+
+    resource_fields = {
+        'solves': fields.List(fields.Nested(Challenge.answers_fields)),
+    }
+
+    def get(self, challenge_id):
+        if not utils.is_admin():
+            unlocked = prerequisites.unlocked_cids(models.Team.current())
+            if challenge_id not in unlocked:
+                flask.abort(404)
+        return self._get_solves(challenge_id=challenge_id)
+
+    @cache.rest_cache_tagged(
+            'solves/{challenge_id}', ['challenge:{challenge_id}'])
+    @flask_restful.marshal_with(resource_fields)
+    def _get_solves(self, challenge_id):
+        rows = models.db.session.query(
+                models.Answer.timestamp, models.Team.tid, models.Team.name
+                ).join(models.Team).filter(
+                models.Answer.challenge_cid == challenge_id).order_by(
+                models.Answer.timestamp)
+        return {'solves': [
+            {'timestamp': timestamp, 'team': {'tid': tid, 'name': name}}
+            for timestamp, tid, name in rows]}
+
+
 class Tag(flask_restful.Resource):
     """Single tag for challenges."""
 
@@ -559,7 +645,7 @@ class Tag(flask_restful.Resource):
         'description': fields.String
     }
     resource_fields = tag_fields.copy()
-    resource_fields['challenges'] = fields.Nested(Challenge.resource_fields)
+    resource_fields['challenges'] = fields.Nested(Challenge.list_fields)
 
     @flask_restful.marshal_with(resource_fields)
     def get(self, tag_slug):
@@ -575,28 +661,44 @@ class Tag(flask_restful.Resource):
 
         app.logger.info('Tag %s updated by %r', tag, models.User.current())
         models.commit()
-        cache.clear()
+        # Challenges embed the names of their tags.
+        cache.invalidate(cache.TAGS, cache.CHALLENGES)
         return self.get_challenges(tag)
 
     @utils.admin_required
     def delete(self, tag_slug):
         tag = models.Tag.query.get_or_404(tag_slug)
         models.db.session.delete(tag)
-        cache.clear()
         models.commit()
+        cache.invalidate(cache.TAGS, cache.CHALLENGES, cache.PREREQUISITES)
 
     @classmethod
     def get_challenges(cls, tag):
+        query = models.Challenge.get_list_query()
         if models.User.current() and models.User.current().admin:
-            challenges = tag.challenges
+            challenges = query.filter(
+                    models.Challenge.tags.any(tagslug=tag.tagslug)).order_by(
+                    models.Challenge.weight).all()
         else:
-            raw = tag.get_challenges()
+            # Only load the challenges shown, found from the tag index.
+            team = models.Team.current()
+            unlocked = prerequisites.unlocked_cids(team)
+            tease = app.config.get('TEASE_HIDDEN') and team
+            cids = [cid for cid in prerequisites.get_graph().tagged(
+                    tag.tagslug) if cid in unlocked or tease]
+            loaded = {}
+            if cids:
+                loaded = dict((ch.cid, ch) for ch in query.filter(
+                    models.Challenge.cid.in_(cids)))
             challenges = []
-            for ch in raw:
-                if ch.unlocked_for_team(models.Team.current()):
-                    challenges.append(ch)
-                elif ch.teaser:
-                    challenges.append(ChallengeList._tease_challenge(ch))
+            for cid in cids:
+                if cid not in loaded:
+                    continue
+                if cid in unlocked:
+                    challenges.append(loaded[cid])
+                else:
+                    challenges.append(
+                            ChallengeList._tease_challenge(loaded[cid]))
         res = {k: getattr(tag, k) for k in cls.tag_fields}
         res['challenges'] = list(challenges)
         return res
@@ -611,7 +713,7 @@ class TagList(flask_restful.Resource):
         'tags': fields.Nested(Tag.tag_fields)
     }
 
-    @cache.rest_team_cache('tags/%d')
+    @cache.rest_team_cache('tags/%d', tags=[cache.TAGS], stale=(300, 600))
     @flask_restful.marshal_with(resource_fields)
     def get(self):
         q = models.Tag.query.all()
@@ -625,7 +727,7 @@ class TagList(flask_restful.Resource):
             get_field('description', ''))
         models.commit()
         app.logger.info('Tag %s created by %r.', tag, models.User.current())
-        cache.clear()
+        cache.invalidate(cache.TAGS)
         return tag
 
 
@@ -668,8 +770,8 @@ class Answer(flask_restful.Resource):
             models.db.session.rollback()
             raise errors.AccessDeniedError(
                 'Unable to save answer for team. See log for details.')
-        cache.delete('cats/%d' % tid)
-        cache.delete('scoreboard')
+        cache.invalidate(cache.team_tag(tid), cache.SCOREBOARD)
+        scoreboard_snapshot.invalidate()
         return dict(points=points)
 
     def post_player(self, data):
@@ -682,8 +784,8 @@ class Answer(flask_restful.Resource):
             models.db.session.rollback()
             raise errors.AccessDeniedError(
                     'Previously solved or flag already used.')
-        cache.delete_team('cats/%d')
-        cache.delete('scoreboard')
+        cache.invalidate(cache.team_tag(flask.g.tid), cache.SCOREBOARD)
+        scoreboard_snapshot.invalidate()
         return dict(points=points)
 
 
@@ -708,6 +810,8 @@ api.add_resource(Tag, '/api/tags/<string:tag_slug>')
 api.add_resource(TagList, '/api/tags')
 api.add_resource(ChallengeList, '/api/challenges')
 api.add_resource(Challenge, '/api/challenges/<int:challenge_id>')
+api.add_resource(
+        ChallengeSolves, '/api/challenges/<int:challenge_id>/solves')
 api.add_resource(Answer, '/api/answers')
 api.add_resource(Validator, '/api/validator')
 
@@ -726,19 +830,145 @@ class APIScoreboard(flask_restful.Resource):
         'scoreboard': fields.Nested(line_fields),
     }
 
-    @cache.rest_cache('scoreboard')
-    @flask_restful.marshal_with(resource_fields)
+    variant_args = ('limit', 'offset', 'history_for_top')
+    # The scoreboard page charts the history of this many leading teams,
+    # and is also served from a snapshot.
+    page_history_for_top = 10
+
     def get(self):
+        """Get the scoreboard.
+
+        Optional arguments:
+          limit, offset: Return only a page of the scoreboard.
+          history_for_top: Only include history for this many leading teams.
+          at: Admins only, the scoreboard as of this ISO8601 time, without
+            history.
+
+        The full scoreboard, and the variant the scoreboard page shows, are
+        served from snapshots.
+        """
+        args = flask.request.args
+        if 'at' in args:
+            return self._get_at()
+        variant = dict(
+                (name, args[name]) for name in self.variant_args
+                if name in args)
+        if not variant:
+            source = scoreboard_snapshot
+        elif variant == {
+                'history_for_top': str(self.page_history_for_top)}:
+            source = page_scoreboard_snapshot
+        else:
+            return self._get_variant()
+        snap = source.get()
+        if snap is None:
+            raise errors.ServerError('Scoreboard is not available yet.')
+        version, built_at, body = snap
+        etag = '%s-%s' % (source.name, version)
+        if flask.request.if_none_match.contains(etag):
+            resp = flask.Response(status=304)
+            resp.set_etag(etag)
+            return resp
+        resp = flask.make_response(body)
+        resp.set_etag(etag)
+        resp.mimetype = 'application/json'
+        resp.headers['X-Snapshot-Version'] = str(version)
+        resp.headers['X-Snapshot-Age'] = '%.1f' % max(
+                0, time.time() - built_at)
+        return resp
+
+    @cache.rest_cache_args(
+            'scoreboard', stale=(60, 120),
+            limit=int, offset=int, history_for_top=int)
+    @flask_restful.marshal_with(resource_fields)
+    def _get_variant(self):
+        return self.scoreboard(
+                limit=self._int_arg('limit'),
+                offset=self._int_arg('offset') or 0,
+                history_for_top=self._int_arg('history_for_top'))
+
+    @utils.admin_required
+    @flask_restful.marshal_with(resource_fields)
+    def _get_at(self):
+        try:
+            when = utils.parse_datetime(flask.request.args['at'])
+        except (ValueError, OverflowError):
+            raise errors.ValidationError('at must be an ISO8601 time.')
+        return dict(scoreboard=[
+            {'position': i, 'tid': tid, 'name': name, 'score': score,
+             'history': []}
+            for i, tid, name, score in replay.scoreboard(when)])
+
+    @classmethod
+    def render(cls, **kwargs):
+        """Encode the scoreboard, as served from a snapshot.
+
+        kwargs are as for scoreboard().
+        """
+        data = flask_restful.marshal(
+                cls.scoreboard(**kwargs), cls.resource_fields)
+        return utils.to_bytes(utils.dump_json(data))
+
+    @classmethod
+    def scoreboard(cls, limit=None, offset=0, history_for_top=None):
         opts = {
-            'with_history': True,
+            'with_history': history_for_top is None,
             'above_zero': not app.config.get('SCOREBOARD_ZEROS'),
+            'limit': limit,
+            'offset': offset,
         }
+        teams = list(models.Team.enumerate(**opts))
+        if history_for_top is None:
+            history = dict((v.tid, v.score_history) for _, v in teams)
+        else:
+            history = models.ScoreHistory.for_teams(
+                    [v.tid for i, v in teams if i <= history_for_top])
         return dict(scoreboard=[
             {'position': i, 'name': v.name, 'tid': v.tid,
-             'score': v.score, 'history': v.score_history}
-            for i, v in models.Team.enumerate(**opts)])
+             'score': v.score, 'history': cls._history(history.get(v.tid))}
+            for i, v in teams])
 
+    @staticmethod
+    def _int_arg(name):
+        value = flask.request.args.get(name)
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            value = -1
+        if value < 0:
+            raise errors.ValidationError(
+                    '%s must be a non-negative integer.' % name)
+        return value
 
+    @staticmethod
+    def _history(history):
+        """Downsample history per SCOREBOARD_HISTORY_{BUCKET,POINTS}."""
+        epoch = datetime.datetime(1970, 1, 1)
+        history = sorted(history or [], key=lambda h: h.when)
+        bucket = app.config.get('SCOREBOARD_HISTORY_BUCKET')
+        if bucket:
+            history = utils.downsample_buckets(
+                    history, bucket,
+                    key=lambda h: (h.when - epoch).total_seconds())
+        max_points = app.config.get('SCOREBOARD_HISTORY_POINTS')
+        if max_points:
+            history = utils.downsample_lttb(
+                    history, max_points,
+                    key=lambda h: ((h.when - epoch).total_seconds(), h.score))
+        return history
+
+
+# Rebuilt whenever anything cached for the scoreboard is invalidated.
+scoreboard_snapshot = snapshot.Snapshot(
+        'scoreboard', APIScoreboard.render, generation=cache.SCOREBOARD)
+page_scoreboard_snapshot = snapshot.Snapshot(
+        'scoreboard-page',
+        functools.partial(
+            APIScoreboard.render,
+            history_for_top=APIScoreboard.page_history_for_top),
+        generation=scoreboard_snapshot.generation)
 api.add_resource(APIScoreboard, '/api/scoreboard')
 
 
@@ -784,13 +1014,20 @@ class News(flask_restful.Resource):
         'message': fields.String,
     }
 
-    @flask_restful.marshal_with(resource_fields)
     def get(self):
-        if models.Team.current():
-            news = models.News.for_team(models.Team.current())
-        else:
-            news = models.News.for_public()
-        return list(news)
+        team = models.Team.current()
+        if team:
+            return self._get_team(team)
+        return self._get_public()
+
+    @flask_restful.marshal_with(resource_fields)
+    def _get_team(self, team):
+        return list(models.News.for_team(team))
+
+    @cache.rest_cache_tagged('news', [cache.NEWS])
+    @flask_restful.marshal_with(resource_fields)
+    def _get_public(self):
+        return list(models.News.for_public())
 
     @utils.admin_required
     @flask_restful.marshal_with(resource_fields)
@@ -808,6 +1045,7 @@ class News(flask_restful.Resource):
         else:
             item = models.News.broadcast(author, data['message'])
         models.commit()
+        cache.invalidate(cache.NEWS)
         return item
 
 
@@ -823,7 +1061,7 @@ class Page(flask_restful.Resource):
         'contents': fields.String,
     }
 
-    @cache.rest_cache_path
+    @cache.rest_cache_tagged('page/{path}', ['page:{path}'])
     @flask_restful.marshal_with(resource_fields)
     def get(self, path):
         app.logger.info('Path: %s', path)
@@ -842,6 +1080,7 @@ class Page(flask_restful.Resource):
         page.title = data.get('title', page.title)
         page.contents = data.get('contents', page.contents)
         models.commit()
+        cache.invalidate(cache.page_tag(path), cache.page_tag(page.path))
         return page
 
     @utils.admin_required
@@ -849,6 +1088,7 @@ class Page(flask_restful.Resource):
         page = models.Page.query.get_or_404(path)
         models.db.session.delete(page)
         models.commit()
+        cache.invalidate(cache.page_tag(path))
         return {}
 
 
@@ -903,7 +1143,7 @@ class Attachment(flask_restful.Resource):
         app.logger.info('Attachment %s updated by %r.',
                         attachment, models.User.current())
         models.commit()
-        cache.clear()
+        cache.invalidate(cache.CHALLENGES)
         return attachment
 
     def delete(self, aid):
@@ -914,7 +1154,7 @@ class Attachment(flask_restful.Resource):
         app.logger.info('Attachment %s deleted by %r.',
                         attachment, models.User.current())
         models.commit()
-        cache.clear()
+        cache.invalidate(cache.CHALLENGES)
 
 
 class AttachmentList(flask_restful.Resource):
@@ -934,9 +1174,9 @@ class AttachmentList(flask_restful.Resource):
         app.logger.info('File uploaded to backend, got aid %s', aid)
         attachment = models.Attachment.query.get(aid)
         if not attachment:
+            # Not attached to any challenge yet, so nothing to invalidate.
             models.Attachment.create(aid, fp.filename, fp.mimetype)
             models.commit()
-            cache.clear()
         return dict(aid=aid, fpath=fpath, content_type=fp.mimetype)
 
     @flask_restful.marshal_with(resource_fields)
@@ -1015,6 +1255,7 @@ class BackupRestore(flask_restful.Resource):
         challs = []
         models.commit()
         cache.clear()
+        warmup.start()
         return {'message': '%d Challenges imported.' % (len(challs),)}
 
 
@@ -1050,20 +1291,43 @@ class Configz(flask_restful.Resource):
 api.add_resource(Configz, '/api/configz')
 
 
+class CacheStats(flask_restful.Resource):
+    """Cache counters for this process, by key family."""
+
+    decorators = [utils.admin_required]
+
+    def get(self):
+        result = cache.stats.report()
+        result['pid'] = os.getpid()
+        result['tiers'] = cache.global_cache.stats()
+        return result
+
+    def delete(self):
+        cache.stats.reset()
+        return {'message': 'Cache statistics reset.'}
+
+
+api.add_resource(CacheStats, '/api/cachez')
+
+
 class ToolsRecalculate(flask_restful.Resource):
     """Recalculate the scores."""
 
     decorators = [utils.admin_required]
 
     def post(self):
-        changed = 0
-        for team in models.Team.query.all():
-            old = team.score
-            team.update_score()
-            changed += 1 if team.score != old else 0
-        models.commit()
-        cache.clear()
-        return {'message': ('Recalculated, %d changed.' % changed)}
+        changed, elapsed = controllers.recalculate_scores()
+        cache.invalidate(cache.SCOREBOARD, cache.CHALLENGES)
+        scoreboard_snapshot.invalidate()
+        warmup.start()
+        app.logger.info('Recalculated scores in %.3fs, %d changed.',
+                        elapsed, changed)
+        return {
+            'message': ('Recalculated, %d changed in %.2fs.' % (
+                changed, elapsed)),
+            'changed': changed,
+            'elapsed': elapsed,
+        }
 
 
 api.add_resource(ToolsRecalculate, '/api/tools/recalculate')
@@ -1087,6 +1351,10 @@ class DBReset(flask_restful.Resource):
             models.NonceFlagUsed.query.delete()
             for team in models.Team.query.all():
                 team.score = 0
+            models.Challenge.query.update(
+                    {models.Challenge.cur_points: models.Challenge.points,
+                     models.Challenge.solve_count: 0},
+                    synchronize_session=False)
         elif op == 'players':
             app.logger.info('Player reset requested by %r.',
                             models.User.current())
@@ -1097,6 +1365,8 @@ class DBReset(flask_restful.Resource):
             raise ValueError('Unknown operation %s' % op)
         models.commit()
         cache.clear()
+        scoreboard_snapshot.invalidate()
+        warmup.start()
         return {'message': 'Done'}
 
 
@@ -0,0 +1,90 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Point values for progressive scoring."""
+
+import math
+import threading
+
+from scoreboard import main
+
+app = main.get_app()
+
+# Points by number of solves, keyed by (max_points, min_points, speed).
+_tables = {}
+_tables_config = None
+_tables_lock = threading.Lock()
+
+
+def log_score(max_points, min_points, midpoint, solves):
+    # Algorithm designed by symmetric
+    # logit(u, l, m, s, x) =
+    #       (u - l) * ((1.0 / (1.0 + exp((1.0/s) * (x - m)))) /
+    #       (1.0 / (1.0 + exp((1.0/s) * (1 - m))))) + l
+    if solves == 0:
+        return max_points
+
+    def log_func(midpoint, solves):
+        spread = midpoint / 3.0
+        delta = solves - midpoint
+        return (
+                1.0 / (1.0 + math.exp((1.0 / spread) * delta)))
+    max_delta = (max_points - min_points)
+    base_point = log_func(midpoint, 1.0)
+    cur_point = log_func(midpoint, solves)
+    return math.ceil(max_delta * cur_point / base_point + min_points)
+
+
+def points(max_points, min_points, speed, solves):
+    """Memoized log_score.
+
+    A table of values by solve count is kept for each distinct set of
+    parameters, and extended when a higher solve count is requested.
+    """
+    key = (max_points, min_points, speed)
+    table = _tables.get(key)
+    if (table is None or solves >= len(table) or
+            _tables_config != _config_key()):
+        table = _extend_table(key, solves)
+    return table[solves]
+
+
+def clear():
+    """Drop all tables."""
+    global _tables_config
+    with _tables_lock:
+        _tables.clear()
+        _tables_config = None
+
+
+def _config_key():
+    return (app.config.get('SCORING'), app.config.get('SCORING_SPEED'))
+
+
+def _extend_table(key, solves):
+    global _tables_config
+    with _tables_lock:
+        if _tables_config != _config_key():
+            _tables.clear()
+            _tables_config = _config_key()
+        table = _tables.get(key, [])
+        if solves < len(table):
+            return table
+        # Grow geometrically so a busy challenge doesn't extend every solve.
+        size = max(solves + 1, 2 * len(table))
+        table = table + [
+                log_score(key[0], key[1], key[2], n)
+                for n in range(len(table), size)]
+        _tables[key] = table
+        return table
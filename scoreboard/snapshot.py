@@ -0,0 +1,157 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Materialized responses, rebuilt off the request path."""
+
+import threading
+import time
+
+from scoreboard import cache
+from scoreboard import main
+
+app = main.get_app()
+
+# When False, invalidate() only moves the version and the next get()
+# rebuilds the snapshot synchronously.  Tests run this way to stay
+# deterministic.
+background = True
+
+# How long a request waits for the very first snapshot to be built.
+COLD_START_WAIT = 10
+
+_snapshots = []
+
+
+class Snapshot(object):
+    """Pre-encoded response body with a version number.
+
+    Each process builds and keeps its own copy, under the copy version (see
+    cache.copy_version) of the snapshot's generation.  Only that generation
+    is shared: invalidate() moves it, and every process rebuilds once it
+    sees the move, so bodies never have to fit in the shared cache.  Without
+    a shared cache, copies are also rebuilt every LOCAL_COPY_TTL seconds, and
+    with one, every SNAPSHOT_MAX_AGE seconds, bounding their age.  Rebuilds
+    run on a single background thread per snapshot, at most once per
+    SNAPSHOT_INTERVAL seconds however many invalidations arrive, while the
+    previous copy is still served.
+    """
+
+    def __init__(self, name, build, generation=None):
+        """Build is called in an app context and returns the body bytes.
+
+        Snapshots with the same generation are invalidated together.
+        """
+        self.name = name
+        self._build = build
+        self.generation = generation or 'snapshot/%s' % name
+        self._lock = threading.Lock()
+        self._built = threading.Condition(self._lock)
+        self._wanted = threading.Event()
+        self._thread = None
+        # (version, built_at, body, copy version)
+        self._local = None
+        self._last_build = 0
+        _snapshots.append(self)
+
+    def get(self):
+        """Get the latest snapshot as (version, built_at, body).
+
+        Returns None if no snapshot could be built in time.
+        """
+        snap = self._local
+        if snap is not None and self._current(snap):
+            return snap[:3]
+        if not background:
+            return self.rebuild()
+        self._schedule()
+        if snap is None:
+            with self._built:
+                if self._local is None:
+                    self._built.wait(COLD_START_WAIT)
+            snap = self._local
+        return snap and snap[:3]
+
+    def invalidate(self):
+        """Rebuild everywhere, with the snapshots sharing its generation."""
+        cache.bump_generation(self.generation)
+        for snap in _snapshots:
+            if snap.generation == self.generation:
+                snap._schedule()
+
+    def rebuild(self):
+        """Build a new snapshot now."""
+        # Read the version first, so a change made while building leaves the
+        # snapshot under an outdated version.
+        current = self._copy_version()
+        body = self._build()
+        now = time.time()
+        with self._lock:
+            version = int(now * 1000)
+            if self._local is not None:
+                version = max(version, self._local[0] + 1)
+            self._local = (version, now, body, current)
+            self._last_build = now
+            self._built.notify_all()
+        return (version, now, body)
+
+    def reset(self):
+        """Forget the current snapshot."""
+        with self._lock:
+            self._local = None
+            self._last_build = 0
+        self._wanted.clear()
+
+    def _copy_version(self):
+        return cache.copy_version([self.generation])
+
+    def _current(self, snap):
+        max_age = app.config.get('SNAPSHOT_MAX_AGE')
+        if max_age and time.time() - snap[1] >= max_age:
+            return False
+        return (snap[3] == self._copy_version() and
+                not cache.copy_expired(snap[1]))
+
+    def _schedule(self):
+        if not background:
+            return
+        self._wanted.set()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                        target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wanted.wait()
+            delay = (self._last_build +
+                     app.config.get('SNAPSHOT_INTERVAL', 0) - time.time())
+            if delay > 0:
+                time.sleep(delay)
+            # Clear first so solves during the build schedule another pass.
+            self._wanted.clear()
+            try:
+                with app.app_context():
+                    self.rebuild()
+            except Exception:
+                app.logger.exception('Failed to rebuild snapshot %s.',
+                                     self.name)
+                self._last_build = time.time()
+
+
+def reset():
+    """Forget all snapshots."""
+    for snap in _snapshots:
+        snap.reset()
@@ -34,7 +34,9 @@ from scoreboard import attachments
 from scoreboard import cache
 from scoreboard import main
 from scoreboard import models
+from scoreboard import snapshot
 from scoreboard import utils
+from scoreboard import warmup
 
 
 class BaseTestCase(flask_testing.TestCase):
@@ -52,6 +54,8 @@ class BaseTestCase(flask_testing.TestCase):
         TESTING=True,
         DEBUG=False,
         ATTACHMENT_BACKEND='test://volatile',
+        # Only expire copies kept in process memory where a test asks to.
+        LOCAL_COPY_TTL=0,
     )
 
     def create_app(self):
@@ -74,6 +78,12 @@ class BaseTestCase(flask_testing.TestCase):
         models.db.init_app(app)
         models.db.create_all()
         cache.global_cache = cache.cache.NullCache()  # Reset cache
+        cache.clear()
+        snapshot.background = False
+        cache.background_refresh = False
+        warmup.background = False
+        cache.stats.reset()
+        snapshot.reset()
 
     def tearDown(self):
         models.db.session.remove()
@@ -221,6 +231,11 @@ class MaxQueryBlock(object):
     def query_count(self):
         return len(self.queries)
 
+    @property
+    def write_queries(self):
+        return [q for q in self.queries
+                if q.split(None, 1)[0] in ('INSERT', 'UPDATE', 'DELETE')]
+
     def _count_query(self, unused_conn, unused_cursor, statement, parameters,
                      unused_context, unused_executemany):
         statement = '%s (%s)' % (
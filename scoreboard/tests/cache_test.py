@@ -15,11 +15,24 @@
 """Cache test module."""
 
 import flask
+import json
 import mock
+import threading
+import time
 
 from scoreboard.tests import base
+from scoreboard.tests import fake_redis
 
 from scoreboard import cache
+from scoreboard import utils
+
+
+def unwrap(resp):
+    """Decode the data in a cached JSON response."""
+    body = resp.get_data(as_text=True)
+    prefix = ")]}',\n"
+    assert body.startswith(prefix)
+    return json.loads(body[len(prefix):])
 
 
 class BaseCacheTest(base.BaseTestCase):
@@ -43,19 +56,119 @@ class BaseCacheTest(base.BaseTestCase):
     def testBuildCaches(self):
         """Test that we can build the various types of caches."""
         for ctype in ('memcached', 'local'):
+            mock_get = self.makeMockGet(ctype, 'localhost')
             with mock.patch.object(self.app, 'config') as m:
-                m.get = self.makeMockGet(ctype, 'localhost')
+                m.get = mock_get
                 c = cache.CacheWrapper(self.app)
                 with self.assertRaises(AttributeError):
                     c._non_existent_attribute_really
 
+    def makeTwoTier(self, local_bytes=4096, ttl=60, shared=None):
+        config = dict(CACHE_TYPE='local', CACHE_LOCAL_BYTES=local_bytes,
+                      CACHE_LOCAL_TTL=ttl)
+        with mock.patch.object(self.app, 'config', config):
+            wrapper = cache.CacheWrapper(self.app)
+        if shared:
+            wrapper._cache = shared._cache
+        return wrapper
+
+    def testTwoTier_LocalHit(self):
+        c = self.makeTwoTier()
+        c.set('foo', 'bar')
+        self.assertEqual('bar', c.get('foo'))
+        with mock.patch.object(
+                c._cache, 'get_many', wraps=c._cache.get_many) as m:
+            self.assertEqual('bar', c.get('foo'))
+            self.assertEqual(['bar', None], c.get_many('foo', 'baz'))
+            self.assertEqual([mock.call('baz')], m.call_args_list)
+        stats = c.stats()
+        self.assertEqual(2, stats['local']['hits'])
+        self.assertEqual(2, stats['local']['misses'])
+        self.assertEqual(1, stats['shared']['hits'])
+        self.assertEqual(1, stats['shared']['misses'])
+
+    def testTwoTier_WritesInvalidateOtherProcesses(self):
+        one = self.makeTwoTier()
+        two = self.makeTwoTier(shared=one)
+        one.set('foo', 'bar')
+        self.assertEqual('bar', two.get('foo'))
+        one.delete('foo')
+        self.assertIsNone(two.get('foo'))
+        one.set('n', 1)
+        self.assertEqual(1, two.get('n'))
+        one.inc('n')
+        self.assertEqual(2, two.get('n'))
+        one.clear()
+        self.assertIsNone(two.get('n'))
+
+    def testTwoTier_FillKeepsOtherProcessesCopies(self):
+        one = self.makeTwoTier()
+        two = self.makeTwoTier(shared=one)
+        one.set('foo', 'bar')
+        two.get('foo')
+        one.set('other', 'value')
+        one.set_many({'more': 1})
+        self.assertEqual('bar', two.get('foo'))
+        self.assertEqual(1, two.stats()['local']['hits'])
+        # Replacing a value is only seen by the writer until copies expire.
+        one.set('foo', 'baz')
+        self.assertEqual('baz', one.get('foo'))
+        self.assertEqual('bar', two.get('foo'))
+
+    def testTwoTier_AddKeepsLocalCopies(self):
+        c = self.makeTwoTier()
+        c.set('foo', 'bar')
+        c.get('foo')
+        c.add('other', 'value')
+        c.get('foo')
+        self.assertEqual(1, c.stats()['local']['hits'])
+
+    def testTwoTier_Expires(self):
+        c = self.makeTwoTier(ttl=0.01)
+        c.set('foo', 'bar')
+        c.get('foo')
+        time.sleep(0.02)
+        self.assertEqual('bar', c.get('foo'))
+        self.assertEqual(0, c.stats()['local']['hits'])
+
+    def testTwoTier_Evicts(self):
+        c = self.makeTwoTier(local_bytes=500)
+        for key in ('a', 'b', 'c'):
+            c.set(key, 'x' * 100)
+            c.get(key)
+        stats = c.stats()
+        self.assertEqual(1, stats['local']['evictions'])
+        self.assertLessEqual(stats['local']['bytes'], 500)
+        # Too large to keep locally at all.
+        c.set('big', 'x' * 1000)
+        self.assertEqual('x' * 1000, c.get('big'))
+        self.assertEqual('x' * 1000, c.get('big'))
+        self.assertEqual(
+                stats['shared']['hits'] + 2, c.stats()['shared']['hits'])
+
+    def testTwoTier_Disabled(self):
+        c = self.makeTwoTier(local_bytes=0)
+        c.set('foo', 'bar')
+        self.assertEqual('bar', c.get('foo'))
+        self.assertNotIn('local', c.stats())
+
+    def testLocalCache_LRU(self):
+        local = cache.LocalCache(3 * (64 + 64 + 1), 60)
+        for key in ('a', 'b', 'c'):
+            local.set(key, 1, 'v')
+        local.get('a', 'v')
+        local.set('d', 1, 'v')
+        self.assertEqual(1, local.get('a', 'v'))
+        self.assertIsNone(local.get('b', 'v'))
+        self.assertIsNone(local.get('c', 'other version'))
+
     def testRestCache_Basic(self):
         m = mock.Mock()
         m.__name__ = 'mockMethod'
         m.return_value = 5
         wrapped = cache.rest_cache(m)
-        self.assertEqual(5, wrapped())
-        self.assertEqual(5, wrapped())  # called twice for caching
+        self.assertEqual(5, unwrap(wrapped()))
+        self.assertEqual(5, unwrap(wrapped()))  # called twice for caching
         m.assert_called_once()
 
     def testRestCache_Override(self):
@@ -63,13 +176,13 @@ class BaseCacheTest(base.BaseTestCase):
         m.__name__ = 'mockMethod'
         m.return_value = 8
         wrapped = cache.rest_cache('key')(m)
-        self.assertEqual(8, wrapped())
-        self.assertEqual(8, wrapped())  # called twice for caching
+        self.assertEqual(8, unwrap(wrapped()))
+        self.assertEqual(8, unwrap(wrapped()))  # called twice for caching
         m2 = mock.Mock()
         m2.__name__ = 'mockMethod2'
         m2.return_value = 42
         wrapped2 = cache.rest_cache('key')(m2)  # same key
-        self.assertEqual(8, wrapped2())
+        self.assertEqual(8, unwrap(wrapped2()))
         m.assert_called_once()
         m2.assert_not_called()
 
@@ -79,12 +192,139 @@ class BaseCacheTest(base.BaseTestCase):
         m.return_value = 1337
         wrapped = cache.rest_cache_path(m)
         with self.app.test_request_context('/foo/bar'):
-            self.assertEqual(1337, wrapped())
+            self.assertEqual(1337, unwrap(wrapped()))
         m.return_value = 1338
         with self.app.test_request_context('/foo/bar?baz=1'):
-            self.assertEqual(1337, wrapped())
+            self.assertEqual(1337, unwrap(wrapped()))
         with self.app.test_request_context('/foo/baz'):
-            self.assertEqual(1338, wrapped())
+            self.assertEqual(1338, unwrap(wrapped()))
+
+    def testRestCacheArgs(self):
+        m = mock.Mock()
+        m.__name__ = 'mockMethod'
+        m.return_value = 1
+        wrapped = cache.rest_cache_args('key', page=int)(m)
+        with self.app.test_request_context('/foo'):
+            self.assertEqual(1, unwrap(wrapped()))
+        m.return_value = 2
+        with self.app.test_request_context('/foo?page=2'):
+            self.assertEqual(2, unwrap(wrapped()))
+        m.return_value = 3
+        with self.app.test_request_context('/foo?page=02&other=1'):
+            self.assertEqual(2, unwrap(wrapped()))
+        with self.app.test_request_context('/foo'):
+            self.assertEqual(1, unwrap(wrapped()))
+        self.assertEqual(2, m.call_count)
+        cache.delete('key')
+        with self.app.test_request_context('/foo?page=2'):
+            self.assertEqual(3, unwrap(wrapped()))
+
+    def testRestCacheArgs_Invalid(self):
+        m = mock.Mock()
+        m.__name__ = 'mockMethod'
+        m.return_value = 1
+        wrapped = cache.rest_cache_args('key', page=int)(m)
+        with self.app.test_request_context('/foo?page=abc'):
+            self.assertEqual(1, wrapped())
+            self.assertEqual(1, wrapped())
+        self.assertEqual(2, m.call_count)
+
+    def testGeneration(self):
+        gen = cache.get_generation('foo')
+        self.assertEqual(gen, cache.get_generation('foo'))
+        self.assertEqual(gen + 1, cache.bump_generation('foo'))
+        self.assertEqual(gen + 1, cache.get_generation('foo'))
+        cache.clear()
+        self.assertNotEqual(1, cache.bump_generation('foo'))
+
+    def testRestCacheTagged(self):
+        m = mock.Mock()
+        m.__name__ = 'mockMethod'
+        m.return_value = 1
+        wrapped = cache.rest_cache_tagged(
+                'page/{path}', ['page:{path}', cache.TAGS])(m)
+        with self.app.test_request_context('/foo'):
+            self.assertEqual(1, unwrap(wrapped(path='a')))
+            self.assertEqual(1, unwrap(wrapped(path='b')))
+            m.return_value = 2
+            self.assertEqual(1, unwrap(wrapped(path='a')))
+            cache.invalidate(cache.page_tag('a'))
+            self.assertEqual(2, unwrap(wrapped(path='a')))
+            self.assertEqual(1, unwrap(wrapped(path='b')))
+            m.return_value = 3
+            cache.invalidate(cache.TAGS)
+            self.assertEqual(3, unwrap(wrapped(path='a')))
+            self.assertEqual(3, unwrap(wrapped(path='b')))
+        self.assertEqual(5, m.call_count)
+
+    def testRestCacheArgs_Tags(self):
+        m = mock.Mock()
+        m.__name__ = 'mockMethod'
+        m.return_value = 1
+        wrapped = cache.rest_cache_args(
+                'key', tags=[cache.CHALLENGES], page=int)(m)
+        with self.app.test_request_context('/foo?page=1'):
+            self.assertEqual(1, unwrap(wrapped()))
+            m.return_value = 2
+            cache.invalidate(cache.SCOREBOARD)
+            self.assertEqual(1, unwrap(wrapped()))
+            cache.invalidate(cache.CHALLENGES)
+            self.assertEqual(2, unwrap(wrapped()))
+
+    def testGenerations(self):
+        gens = cache.get_generations(['a', 'b'])
+        self.assertEqual(gens, cache.get_generations(['a', 'b']))
+        cache.invalidate('b')
+        self.assertEqual(
+                [gens[0], gens[1] + 1], cache.get_generations(['a', 'b']))
+
+    def testCopyVersion_Local(self):
+        cache.global_cache = cache.cache.NullCache()
+        version = cache.copy_version(['a', 'b'])
+        self.assertEqual(version, cache.copy_version(['a', 'b']))
+        cache.invalidate('b')
+        bumped = cache.copy_version(['a', 'b'])
+        self.assertEqual(version[:-1], bumped[:-1])
+        self.assertEqual(version[-1] + 1, bumped[-1])
+        cache.clear()
+        self.assertNotEqual(bumped, cache.copy_version(['a', 'b']))
+
+    def testCopyVersion_Shared(self):
+        with mock.patch.object(cache, 'is_shared', return_value=True):
+            version = cache.copy_version(['a'])
+            # Nothing local, so every process agrees on it.
+            self.assertEqual(tuple(cache.get_generations(['a'])), version)
+            cache.invalidate('a')
+            self.assertEqual((version[0] + 1,), cache.copy_version(['a']))
+
+    def testCopyExpired(self):
+        self.app.config['LOCAL_COPY_TTL'] = 10
+        with mock.patch.object(time, 'time', return_value=1010.0):
+            self.assertFalse(cache.copy_expired(1000.5))
+            self.assertTrue(cache.copy_expired(1000.0))
+            with mock.patch.object(cache, 'is_shared', return_value=True):
+                self.assertFalse(cache.copy_expired(1000.0))
+        self.app.config['LOCAL_COPY_TTL'] = 0
+        self.assertFalse(cache.copy_expired(0))
+
+    def testRestTeamCache_InvalidatedByTags(self):
+        m = mock.Mock()
+        m.__name__ = 'mockMethod'
+        m.return_value = 5
+        wrapped = cache.rest_team_cache('foo-%d', tags=[cache.TAGS])(m)
+        with mock.patch.object(flask, 'g'):
+            for tid in (111, 123):
+                flask.g.tid = tid
+                self.assertEqual(5, unwrap(wrapped()))
+            m.return_value = 6
+            cache.invalidate(cache.team_tag(111))
+            flask.g.tid = 111
+            self.assertEqual(6, unwrap(wrapped()))
+            flask.g.tid = 123
+            self.assertEqual(5, unwrap(wrapped()))
+            m.return_value = 7
+            cache.invalidate(cache.TAGS)
+            self.assertEqual(7, unwrap(wrapped()))
 
     def testRestTeamCache_Basic(self):
         m = mock.Mock()
@@ -93,12 +333,12 @@ class BaseCacheTest(base.BaseTestCase):
         wrapped = cache.rest_team_cache(m)
         with mock.patch.object(flask, 'g'):
             flask.g.tid = 111
-            self.assertEqual(5, wrapped())
+            self.assertEqual(5, unwrap(wrapped()))
             m.return_value = 555
-            self.assertEqual(5, wrapped())  # called twice for caching
+            self.assertEqual(5, unwrap(wrapped()))  # called twice for caching
             m.assert_called_once()
             flask.g.tid = 123
-            self.assertEqual(555, wrapped())  # different team?
+            self.assertEqual(555, unwrap(wrapped()))  # different team?
 
     def testRestTeamCache_Override(self):
         m = mock.Mock()
@@ -109,12 +349,12 @@ class BaseCacheTest(base.BaseTestCase):
         wrapped = cache.rest_team_cache('foo-%d')(m)
         with mock.patch.object(flask, 'g'):
             flask.g.tid = 111
-            self.assertEqual(5, wrapped())
+            self.assertEqual(5, unwrap(wrapped()))
             m.return_value = 555
-            self.assertEqual(5, wrapped())  # called twice for caching
+            self.assertEqual(5, unwrap(wrapped()))  # called twice for caching
             m.assert_called_once()
             flask.g.tid = 123
-            self.assertEqual(555, wrapped())  # different team?
+            self.assertEqual(555, unwrap(wrapped()))  # different team?
 
     def testRestCacheCaller_NonSerializable(self):
         m = mock.Mock()
@@ -123,13 +363,223 @@ class BaseCacheTest(base.BaseTestCase):
         self.assertEqual(5, cache._rest_cache_caller(m, 'foo').foo)
         m.assert_called_once()
 
+    def testRestCacheCaller_HitNotReencoded(self):
+        m = mock.Mock()
+        m.return_value = {'a': [1, 2]}
+        cache._rest_cache_caller(m, 'foo')
+        with mock.patch.object(utils, 'dump_json') as dump:
+            rv = cache._rest_cache_caller(m, 'foo')
+            dump.assert_not_called()
+        self.assertEqual({'a': [1, 2]}, unwrap(rv))
+        self.assertEqual('application/json', rv.mimetype)
+        m.assert_called_once()
+
+    def testRestCacheCaller_NotModified(self):
+        m = mock.Mock()
+        m.return_value = {'a': 1}
+        with self.app.test_request_context('/foo'):
+            etag = cache._rest_cache_caller(m, 'foo@1').headers['ETag']
+        headers = {'If-None-Match': etag}
+        with self.app.test_request_context('/foo', headers=headers):
+            with mock.patch.object(cache.global_cache, 'get') as get:
+                rv = cache._rest_cache_caller(m, 'foo@1')
+                get.assert_not_called()
+        self.assertEqual(304, rv.status_code)
+        self.assertEqual(etag, rv.headers['ETag'])
+        with self.app.test_request_context('/foo', headers=headers):
+            rv = cache._rest_cache_caller(m, 'foo@2')
+        self.assertEqual(200, rv.status_code)
+        self.assertNotEqual(etag, rv.headers['ETag'])
+        self.assertEqual(2, m.call_count)
+
     def testRestCacheCaller_NonLoadable(self):
         cache.global_cache.set('foo', '{ not valid json')
         m = mock.Mock()
         m.return_value = 5
-        self.assertEqual(5, cache._rest_cache_caller(m, 'foo'))
-        self.assertEqual(5, cache._rest_cache_caller(m, 'foo'))
+        self.assertEqual(5, unwrap(cache._rest_cache_caller(m, 'foo')))
+        self.assertEqual(5, unwrap(cache._rest_cache_caller(m, 'foo')))
+        m.assert_called_once()
+
+    def testRestCacheCaller_SingleFlight(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'value': len(calls)}
+
+        results = []
+
+        def request():
+            results.append(unwrap(cache._rest_cache_caller(compute, 'key')))
+
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(calls))
+        self.assertEqual([{'value': 1}] * 5, results)
+
+    def testRestCacheCaller_SingleFlightWithoutCache(self):
+        cache.global_cache = cache.cache.NullCache()
+        self.testRestCacheCaller_SingleFlight()
+
+    def testRestCacheCaller_LeaderFails(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            if len(calls) == 1:
+                raise ValueError('first one fails')
+            return 5
+
+        threads = [threading.Thread(target=cache._rest_cache_caller,
+                                    args=(compute, 'key'))
+                   for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(2, len(calls))
+        self.assertEqual(b")]}',\n5\n", cache.global_cache.get('key')[2])
+
+    def testRestCacheCaller_WaitsForOtherProcess(self):
+        cache.global_cache.add('lease/key', 1)
+
+        def other_process():
+            time.sleep(0.1)
+            cache.global_cache.set('key', cache._rest_render({'a': 42}))
+            cache.global_cache.delete('lease/key')
+
+        t = threading.Thread(target=other_process)
+        t.start()
+        m = mock.Mock()
+        rv = cache._rest_cache_caller(m, 'key')
+        t.join()
+        self.assertEqual({'a': 42}, unwrap(rv))
+        self.assertEqual('True', rv.headers['X-Cache-Hit'])
+        m.assert_not_called()
+
+    def testRestCacheCaller_OtherProcessGivesUp(self):
+        cache.global_cache.add('lease/key', 1)
+        timer = threading.Timer(
+                0.1, cache.global_cache.delete, args=('lease/key',))
+        timer.start()
+        m = mock.Mock()
+        m.return_value = {'a': 7}
+        self.assertEqual(
+                {'a': 7}, unwrap(cache._rest_cache_caller(m, 'key')))
+        timer.join()
         m.assert_called_once()
+        self.assertIsNone(cache.global_cache.get('lease/key'))
+
+    def makeStale(self, soft, hard):
+        m = mock.Mock()
+        m.__name__ = 'mockMethod'
+        m.side_effect = lambda: {'n': m.call_count}
+        return m, cache.rest_cache_args('key', stale=(soft, hard))(m)
+
+    def testRestCacheStale_Invalidated(self):
+        m, wrapped = self.makeStale(60, 120)
+        with self.app.test_request_context('/foo'):
+            self.assertEqual({'n': 1}, unwrap(wrapped()))
+            cache.invalidate('key')
+            rv = wrapped()
+            self.assertEqual({'n': 1}, unwrap(rv))
+            self.assertEqual('True', rv.headers['X-Cache-Hit'])
+            # Refreshed inline in tests.
+            self.assertEqual(2, m.call_count)
+            rv = wrapped()
+            self.assertEqual({'n': 2}, unwrap(rv))
+            self.assertEqual('True', rv.headers['X-Cache-Hit'])
+        self.assertEqual(2, m.call_count)
+
+    def testRestCacheStale_SoftExpiry(self):
+        m, wrapped = self.makeStale(0.05, 60)
+        with self.app.test_request_context('/foo'):
+            etag = wrapped().headers['ETag']
+            time.sleep(0.1)
+            rv = wrapped()
+            self.assertEqual({'n': 1}, unwrap(rv))
+            self.assertEqual(etag, rv.headers['ETag'])
+            self.assertEqual({'n': 2}, unwrap(wrapped()))
+
+    def testRestCacheStale_HardExpiry(self):
+        m, wrapped = self.makeStale(0.05, 0.1)
+        with self.app.test_request_context('/foo'):
+            wrapped()
+            time.sleep(0.15)
+            rv = wrapped()
+            self.assertEqual({'n': 2}, unwrap(rv))
+            self.assertEqual('False', rv.headers['X-Cache-Hit'])
+
+    def testRestCacheStale_StaleNotModified(self):
+        m, wrapped = self.makeStale(60, 120)
+        with self.app.test_request_context('/foo'):
+            etag = wrapped().headers['ETag']
+        cache.invalidate('key')
+        headers = {'If-None-Match': etag}
+        with self.app.test_request_context('/foo', headers=headers):
+            self.assertEqual(304, wrapped().status_code)
+            self.assertEqual(200, wrapped().status_code)
+
+    def testRestCacheStale_RefreshedInBackground(self):
+        cache.background_refresh = True
+        release = threading.Event()
+        m, wrapped = self.makeStale(60, 120)
+        with self.app.test_request_context('/foo'):
+            wrapped()
+            cache.invalidate('key')
+            m.side_effect = lambda: release.wait(5) and {'n': 2}
+            for _ in range(3):
+                self.assertEqual({'n': 1}, unwrap(wrapped()))
+            release.set()
+            deadline = time.time() + 5
+            while (unwrap(wrapped()) != {'n': 2} and
+                   time.time() < deadline):
+                time.sleep(0.01)
+            self.assertEqual({'n': 2}, unwrap(wrapped()))
+        self.assertEqual(2, m.call_count)
+
+    def testStats(self):
+        m = mock.Mock()
+        m.__name__ = 'mockMethod'
+        m.return_value = {'a': 1}
+        wrapped = cache.rest_team_cache('tags/%d')(m)
+        with self.app.test_request_context('/foo'):
+            flask.g.tid = 5
+            etag = wrapped().headers['ETag']
+            wrapped()
+        with self.app.test_request_context(
+                '/foo', headers={'If-None-Match': etag}):
+            flask.g.tid = 5
+            wrapped()
+        cache.invalidate(cache.team_tag(5))
+        report = cache.stats.report()
+        counts = report['families']['tags/%d']
+        self.assertEqual(1, counts['hits'])
+        self.assertEqual(1, counts['misses'])
+        self.assertEqual(0.5, counts['hit_ratio'])
+        self.assertEqual(1, counts['not_modified'])
+        self.assertEqual(2, counts['fetch'])
+        self.assertEqual(1, counts['recompute'])
+        self.assertEqual(1, counts['sets'])
+        self.assertEqual(len(b")]}',\n{\"a\": 1}\n"), counts['set_bytes'])
+        self.assertEqual({'team:%d': 1}, report['invalidations'])
+        cache.stats.reset()
+        self.assertEqual({}, cache.stats.report()['families'])
+
+    def testFamily(self):
+        for key, family in (
+                ('scoreboard?limit=3@1.2', 'scoreboard'),
+                ('challenges/12@1.2', 'challenges/%d'),
+                ('page/a@b@1', 'page/a@b'),
+                ('page/2019/rules@1', 'page/%d/rules'),
+                ('team:42', 'team:%d'),
+                ('mockMethod', 'mockMethod')):
+            self.assertEqual(family, cache._family(key))
 
     def testRestAddCacheHeader(self):
         foo = 'foo'
@@ -170,3 +620,106 @@ class BaseCacheTest(base.BaseTestCase):
         self.assertEqual(baz, cache._rest_add_cache_header(baz))
         bang = (1, 2, 3)
         self.assertEqual(bang, cache._rest_add_cache_header(bang))
+
+
+class RedisCacheTest(base.BaseTestCase):
+    """Test the Redis backend against an in-process server."""
+
+    def setUp(self):
+        super(RedisCacheTest, self).setUp()
+        self.server = fake_redis.Server()
+        self.wrappers = []
+
+    def tearDown(self):
+        for wrapper in self.wrappers:
+            if wrapper._invalidations:
+                wrapper._invalidations.stop()
+        super(RedisCacheTest, self).tearDown()
+
+    def makeRedis(self, local_bytes=4096):
+        config = dict(CACHE_TYPE='redis', REDIS_HOST=self.server.client(),
+                      CACHE_LOCAL_BYTES=local_bytes, CACHE_LOCAL_TTL=60)
+        with mock.patch.object(self.app, 'config', config):
+            wrapper = cache.CacheWrapper(self.app)
+        self.wrappers.append(wrapper)
+        if local_bytes:
+            self.waitFor(lambda: wrapper._local_version() is not None)
+        return wrapper
+
+    def waitFor(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def testBasic(self):
+        c = self.makeRedis(local_bytes=0)
+        c.set('foo', {'a': 1})
+        self.assertEqual({'a': 1}, c.get('foo'))
+        self.assertFalse(c.add('foo', 'other'))
+        self.assertTrue(c.add('bar', 5, timeout=0))
+        self.assertEqual(6, c.inc('bar'))
+        self.assertEqual([{'a': 1}, 6, None], c.get_many('foo', 'bar', 'baz'))
+        c.delete('foo')
+        self.assertIsNone(c.get('foo'))
+        c.clear()
+        self.assertIsNone(c.get('bar'))
+
+    def testAddExpires(self):
+        c = self.makeRedis(local_bytes=0)
+        c.add('foo', 1, timeout=0.01)
+        self.assertEqual(1, c.get('foo'))
+        time.sleep(1.1)
+        self.assertIsNone(c.get('foo'))
+
+    def testGetManyOneRoundTrip(self):
+        c = self.makeRedis(local_bytes=0)
+        c.set_many({'a': 1, 'b': 2})
+        commands = self.server.commands
+        self.assertEqual([1, 2, None], c.get_many('a', 'b', 'c'))
+        self.assertEqual(commands + 1, self.server.commands)
+
+    def testLocalHitsNoRoundTrip(self):
+        c = self.makeRedis()
+        c.set('foo', 'bar')
+        c.get('foo')
+        commands = self.server.commands
+        self.assertEqual('bar', c.get('foo'))
+        self.assertEqual(commands, self.server.commands)
+        self.assertEqual(1, c.stats()['local']['hits'])
+
+    def testInvalidationsPropagate(self):
+        one = self.makeRedis()
+        two = self.makeRedis()
+        one.set('foo', 'bar')
+        self.assertEqual('bar', two.get('foo'))
+        one.set('foo', 'baz')
+        self.waitFor(lambda: two.get('foo') == 'baz')
+        cache.global_cache = one
+        cache.invalidate('tag')
+        self.waitFor(lambda: two._local.get(
+            cache._generation_key('tag'), two._local_version()) is None)
+        one.clear()
+        self.waitFor(lambda: two.get('foo') is None)
+
+    def testLeasesNotPublished(self):
+        c = self.makeRedis()
+        with mock.patch.object(c._invalidations, 'publish') as publish:
+            c.add('lease/foo', 1)
+            c.delete('lease/foo')
+            publish.assert_not_called()
+
+    def testReconnects(self):
+        c = self.makeRedis()
+        c.set('foo', 'bar')
+        c.get('foo')
+        with mock.patch.object(cache.RedisInvalidations, 'RETRY_INTERVAL',
+                               0.2):
+            version = c._local_version()
+            c._invalidations._pubsub.close()
+            self.waitFor(lambda: c._local_version() is None)
+            # Served from Redis while messages could be missed.
+            self.assertEqual('bar', c.get('foo'))
+            self.waitFor(lambda: c._local_version() is not None)
+        self.assertNotEqual(version, c._local_version())
+        self.assertEqual(0, c.stats()['local'].get('hits', 0))
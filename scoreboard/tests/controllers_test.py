@@ -12,10 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+import mock
+
 from scoreboard.tests import base
 
 from scoreboard import controllers
 from scoreboard import errors
+from scoreboard import models
+from scoreboard import utils
 
 
 class RegisterTest(base.BaseTestCase):
@@ -52,3 +57,56 @@ class RegisterTest(base.BaseTestCase):
         controllers.register_user('foo@bar.com', 'foo', 'pass')
         with self.assertRaises(errors.ValidationError):
             controllers.register_user('foo@bar.com', 'sam', 'pass')
+
+
+class RecalculateTest(base.BaseTestCase):
+    """Test recalculate_scores controller."""
+
+    def setUp(self):
+        super(RecalculateTest, self).setUp()
+        self.app.config['SCORING'] = 'progressive'
+        self.challs = [
+                models.Challenge.create(
+                    'Chall %d' % i, 'Challenge', 100 * (i + 1), 'flag',
+                    unlocked=True)
+                for i in range(3)]
+        self.teams = [models.Team.create('Team %d' % i) for i in range(5)]
+        models.commit()
+        for i, team in enumerate(self.teams):
+            for chall in self.challs[:i % 3 + 1]:
+                models.Answer.create(chall, team, '')
+        models.commit()
+
+    def expectedScore(self, team):
+        return sum(a.current_points for a in team.answers)
+
+    def testRecalculate(self):
+        changed, elapsed = controllers.recalculate_scores()
+        self.assertEqual(len(self.teams), changed)
+        self.assertGreaterEqual(elapsed, 0)
+        for team in models.Team.query.all():
+            self.assertEqual(self.expectedScore(team), team.score)
+            self.assertEqual(team.score, team.score_history[-1].score)
+
+    def testRecalculate_Unchanged(self):
+        controllers.recalculate_scores()
+        with self.queryLimit(4):
+            changed, _ = controllers.recalculate_scores()
+        self.assertEqual(0, changed)
+
+    def testRecalculate_AfterGame(self):
+        end = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+        late = self.teams[0].answers[0]
+        late.timestamp = end + datetime.timedelta(seconds=30)
+        models.commit()
+        with mock.patch.object(utils.GameTime, 'end', end):
+            controllers.recalculate_scores()
+        self.assertEqual(0, models.Team.query.get(self.teams[0].tid).score)
+
+    def testRecalculate_RepairsSolveCount(self):
+        chall = self.challs[0]
+        chall.solve_count = 42
+        models.commit()
+        controllers.recalculate_scores()
+        chall = models.Challenge.query.get(chall.cid)
+        self.assertEqual(len(chall.answers), chall.solve_count)
@@ -0,0 +1,190 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process stand-in for a Redis server, for tests.
+
+Only the commands used by cache.RedisCache and cache.RedisInvalidations are
+implemented, with the same argument names and return values as redis-py.
+"""
+
+import fnmatch
+import threading
+import time
+
+from six.moves import queue
+
+
+class Disconnected(IOError):
+    pass
+
+
+class Server(object):
+    """Data and subscriptions shared by every client."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}
+        self.channels = {}
+        self.commands = 0
+
+    def client(self):
+        return Client(self)
+
+
+class Client(object):
+    """A connection to a Server, like redis.Redis."""
+
+    def __init__(self, server):
+        self._server = server
+
+    def _live(self, name):
+        value, expires = self._server.data.get(name, (None, None))
+        if expires is not None and expires <= time.time():
+            del self._server.data[name]
+            return None
+        return value
+
+    def _command(self):
+        self._server.commands += 1
+        return self._server.lock
+
+    @staticmethod
+    def _bytes(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    def get(self, name):
+        with self._command():
+            return self._live(name)
+
+    def mget(self, keys):
+        with self._command():
+            return [self._live(k) for k in keys]
+
+    def set(self, name, value, ex=None, nx=False):
+        with self._command():
+            if nx and self._live(name) is not None:
+                return None
+            expires = None if ex is None else time.time() + ex
+            self._server.data[name] = (self._bytes(value), expires)
+            return True
+
+    def setex(self, name, time, value):
+        return self.set(name, value, ex=time)
+
+    def delete(self, *names):
+        with self._command():
+            count = 0
+            for name in names:
+                if self._live(name) is not None:
+                    del self._server.data[name]
+                    count += 1
+            return count
+
+    def exists(self, name):
+        with self._command():
+            return int(self._live(name) is not None)
+
+    def keys(self, pattern='*'):
+        with self._command():
+            return [k for k in list(self._server.data)
+                    if self._live(k) is not None and
+                    fnmatch.fnmatchcase(k, pattern)]
+
+    def flushdb(self):
+        with self._command():
+            self._server.data.clear()
+            return True
+
+    def incr(self, name, amount=1):
+        with self._command():
+            value = int(self._live(name) or 0) + amount
+            expires = self._server.data.get(name, (None, None))[1]
+            self._server.data[name] = (self._bytes(value), expires)
+            return value
+
+    def decr(self, name, amount=1):
+        return self.incr(name, -amount)
+
+    def info(self, section=None):
+        return {'evicted_keys': 0}
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+    def publish(self, channel, message):
+        with self._command():
+            subscribers = list(self._server.channels.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub.deliver(channel, self._bytes(message))
+        return len(subscribers)
+
+    def pubsub(self):
+        return PubSub(self._server)
+
+
+class Pipeline(object):
+    """Commands queued and sent together, like redis.client.Pipeline."""
+
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue_call(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return queue_call
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        return [method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+class PubSub(object):
+    """A subscription, like redis.client.PubSub."""
+
+    def __init__(self, server):
+        self._server = server
+        self._messages = queue.Queue()
+        self._channels = []
+
+    def subscribe(self, channel):
+        with self._server.lock:
+            self._server.channels.setdefault(channel, []).append(self)
+            self._channels.append(channel)
+        self._messages.put(
+                {'type': 'subscribe', 'channel': channel, 'data': 1})
+
+    def deliver(self, channel, data):
+        self._messages.put(
+                {'type': 'message', 'channel': channel, 'data': data})
+
+    def listen(self):
+        while True:
+            message = self._messages.get()
+            if message is None:
+                raise Disconnected('Connection closed.')
+            yield message
+
+    def close(self):
+        """Disconnect, as if the server went away."""
+        with self._server.lock:
+            for channel in self._channels:
+                self._server.channels[channel].remove(self)
+            self._channels = []
+        self._messages.put(None)
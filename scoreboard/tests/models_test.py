@@ -16,10 +16,12 @@
 
 import mock
 import os
+from sqlalchemy import orm
 import time
 
 from scoreboard.tests import base
 
+from scoreboard import controllers
 from scoreboard import errors
 from scoreboard import models
 
@@ -182,3 +184,87 @@ class UserTest(base.BaseTestCase):
         self.assertEqual(
                 self.user.nick, models.User.get_by_api_key(token).nick)
         self.assertIsNone(models.User.get_by_api_key(token[:-1]))
+
+
+class ChallengeTest(base.BaseTestCase):
+
+    def setUp(self):
+        super(ChallengeTest, self).setUp()
+        self.app.config['SCORING'] = 'progressive'
+        self.chall = models.Challenge.create(
+                'Chall', 'Challenge', 500, 'flag', unlocked=True)
+        self.chall.min_points = 100
+        self.teams = [models.Team.create('Team %d' % i) for i in range(6)]
+        models.commit()
+
+    def testUpdateAnswers_MatchesRecompute(self):
+        for team in self.teams:
+            controllers.save_team_answer(self.chall, team, None)
+            models.db.session.expire_all()
+            for t in models.Team.query.all():
+                expected = sum(a.current_points for a in t.answers)
+                self.assertEqual(expected, t.score)
+        self.assertLess(self.teams[0].score, 500)
+
+    def assertScoresMatchRecompute(self):
+        models.db.session.expire_all()
+        for t in models.Team.query.all():
+            expected = sum(a.current_points for a in t.answers)
+            self.assertEqual(expected, t.score)
+
+    def testUpdateAnswers_StaleSolveCount(self):
+        for team in self.teams[:2]:
+            controllers.save_team_answer(self.chall, team, None)
+        # Loaded before the second solve landed in another worker.
+        self.chall.name
+        orm.attributes.set_committed_value(self.chall, 'solve_count', 1)
+        controllers.save_team_answer(self.chall, self.teams[2], None)
+        self.assertEqual(3, self.chall.solves)
+        self.assertEqual(self.chall.points_at(3), self.chall.cur_points)
+        self.assertScoresMatchRecompute()
+
+    def testUpdateAnswers_StaleTeamScore(self):
+        other = models.Challenge.create(
+                'Other', 'Challenge', 300, 'flag', unlocked=True)
+        models.commit()
+        controllers.save_team_answer(self.chall, self.teams[0], None)
+        controllers.save_team_answer(self.chall, self.teams[1], None)
+        # The second solve lowered the first team's score behind its back.
+        team = self.teams[0]
+        team.name
+        orm.attributes.set_committed_value(
+                team, 'score', self.chall.points_at(1))
+        controllers.save_team_answer(other, team, None)
+        self.assertScoresMatchRecompute()
+
+    def testUpdateAnswers_BulkQueries(self):
+        for team in self.teams[:-1]:
+            controllers.save_team_answer(self.chall, team, None)
+        models.db.session.expire_all()
+        self.chall = models.Challenge.query.get(self.chall.cid)
+        with self.queryLimit(3) as block:
+            self.chall.update_answers()
+        self.assertEqual(1, sum(
+            1 for q in block.queries if q.startswith('UPDATE team')))
+        self.assertEqual(1, sum(
+            1 for q in block.queries if q.startswith('INSERT INTO score')))
+
+    def testSolveCount(self):
+        self.assertEqual(0, self.chall.solves)
+        for team in self.teams[:3]:
+            models.Answer.create(self.chall, team, '')
+        models.commit()
+        self.assertEqual(3, self.chall.solves)
+        models.db.session.delete(self.teams[0])
+        models.commit()
+        self.assertEqual(2, self.chall.solves)
+        self.assertEqual(self.chall, models.Challenge.query.filter(
+            models.Challenge.solves == 2).one())
+
+    def testSolveCount_FirstBlood(self):
+        self.app.config['FIRST_BLOOD'] = 10
+        first = models.Answer.create(self.chall, self.teams[0], '')
+        models.commit()
+        second = models.Answer.create(self.chall, self.teams[1], '')
+        self.assertEqual(10, first.first_blood)
+        self.assertEqual(0, second.first_blood)
@@ -0,0 +1,332 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for prerequisites."""
+
+import json
+
+import mock
+import time
+
+from scoreboard.tests import base
+
+from scoreboard import cache
+from scoreboard import controllers
+from scoreboard import models
+from scoreboard import prerequisites
+from scoreboard import rest  # noqa: F401
+from scoreboard import validators
+
+
+def solved(cid):
+    return json.dumps({'type': 'solved', 'challenge': cid})
+
+
+def state(*solved_cids, **kwargs):
+    return prerequisites.TeamState(
+            set(solved_cids), kwargs.get('tag_solves', {}),
+            kwargs.get('score', 0))
+
+
+class GraphTest(base.BaseTestCase):
+
+    def testUnlocked(self):
+        graph = prerequisites.Graph([
+            (1, True, ''),
+            (2, True, solved(1)),
+            (3, False, ''),
+            (4, True, json.dumps({'type': 'None'})),
+            (5, True, solved(3)),
+        ])
+        self.assertEqual(set([1, 4]), graph.unlocked(state()))
+        self.assertEqual(set([1, 2, 4]), graph.unlocked(state(1)))
+        self.assertEqual(set([1, 4, 5]), graph.unlocked(state(3)))
+        self.assertEqual(set([1, 4]), graph.unlocked(None))
+        self.assertIn(5, graph)
+        self.assertNotIn(6, graph)
+
+    def testInvalid(self):
+        graph = prerequisites.Graph([
+            (1, True, '{'),
+            (2, True, json.dumps({'type': 'unknown'})),
+            (3, True, solved(42)),
+        ])
+        self.assertEqual(set(), graph.unlocked(state(42)))
+
+    def testAllAny(self):
+        graph = prerequisites.Graph([
+            (1, True, ''),
+            (2, True, ''),
+            (3, True, json.dumps({'type': 'all', 'challenges': [1, 2]})),
+            (4, True, json.dumps({'type': 'any', 'challenges': [1, 2, 42]})),
+        ])
+        self.assertEqual(set([1, 2]), graph.unlocked(state()))
+        self.assertEqual(set([1, 2, 4]), graph.unlocked(state(2)))
+        self.assertEqual(set([1, 2, 3, 4]), graph.unlocked(state(1, 2)))
+
+    def testTagSolves(self):
+        graph = prerequisites.Graph(
+                [(1, True, ''), (2, True, ''), (3, True, ''),
+                 (4, True, json.dumps(
+                     {'type': 'tag_solves', 'tag': 'web', 'count': 2}))],
+                tags=[('web', 1), ('web', 2), ('pwn', 3)])
+        self.assertNotIn(4, graph.unlocked(graph.state(set([1, 3]), 0)))
+        self.assertIn(4, graph.unlocked(graph.state(set([1, 2]), 0)))
+        self.assertEqual(
+                {'web': 1, 'pwn': 1}, graph.state(set([1, 3]), 0).tag_solves)
+
+    def testTagged(self):
+        graph = prerequisites.Graph(
+                [(3, True, ''), (1, False, ''), (2, True, solved(3))],
+                tags=[('web', 2), ('web', 1), ('web', 3), ('web', 42)])
+        self.assertEqual([3, 2], graph.tagged('web'))
+        self.assertEqual([], graph.tagged('pwn'))
+
+    def testScore(self):
+        graph = prerequisites.Graph([
+            (1, True, json.dumps({'type': 'score', 'score': 200})),
+        ])
+        self.assertEqual(set(), graph.unlocked(state(score=199)))
+        self.assertEqual(set([1]), graph.unlocked(state(score=200)))
+
+    def testNested(self):
+        prereq = {'type': 'any', 'prerequisites': [
+            {'type': 'score', 'score': 500},
+            {'type': 'all', 'challenges': [1],
+             'prerequisites': [{'type': 'tag_solves', 'tag': 'web',
+                                'count': 1}]},
+        ]}
+        graph = prerequisites.Graph(
+                [(1, True, ''), (2, True, ''), (3, True, json.dumps(prereq))],
+                tags=[('web', 2)])
+        self.assertNotIn(3, graph.unlocked(graph.state(set([1]), 0)))
+        self.assertIn(3, graph.unlocked(graph.state(set([1, 2]), 0)))
+        self.assertIn(3, graph.unlocked(graph.state(set(), 500)))
+
+    def testMalformed(self):
+        graph = prerequisites.Graph([
+            (1, True, json.dumps({'type': 'score'})),
+            (2, True, json.dumps({'type': 'all', 'challenges': ['x']})),
+        ])
+        self.assertEqual(set(), graph.unlocked(state(score=1000)))
+
+
+class CatalogTestCase(base.RestTestCase):
+    """Two challenges, the second requiring the first, with a local cache."""
+
+    def setUp(self):
+        super(CatalogTestCase, self).setUp()
+        with mock.patch.dict(self.app.config, CACHE_TYPE='local'):
+            cache.global_cache = cache.CacheWrapper(self.app)
+        prerequisites._compiled = None
+        self.first = models.Challenge.create(
+                'First', 'Challenge', 100, 'flag', unlocked=True)
+        self.second = models.Challenge.create(
+                'Second', 'Challenge', 100, 'flag', unlocked=True)
+        self.second.prerequisite = solved(self.first.cid)
+        models.commit()
+
+
+class PrerequisitesTest(CatalogTestCase):
+
+    def listedCids(self):
+        resp = self.client.get('/api/challenges')
+        self.assert200(resp)
+        return [c['cid'] for c in resp.json['challenges']
+                if not c.get('teaser')]
+
+    def testCompiledOnce(self):
+        prerequisites.reset()
+        graph = prerequisites.get_graph()
+        prerequisites.reset()
+        with self.queryLimit(0):
+            self.assertIs(graph, prerequisites.get_graph())
+        cache.invalidate(cache.PREREQUISITES)
+        prerequisites.reset()
+        self.assertIsNot(graph, prerequisites.get_graph())
+
+    def testCompiledOnce_NoCache(self):
+        cache.global_cache = cache.cache.NullCache()
+        graph = prerequisites.get_graph()
+        prerequisites.reset()
+        with self.queryLimit(0):
+            self.assertIs(graph, prerequisites.get_graph())
+
+    def testOtherProcessEdit(self):
+        self.app.config['LOCAL_COPY_TTL'] = 10
+        with mock.patch.object(time, 'time', return_value=1000.0):
+            self.assertNotIn(
+                    self.second.cid, prerequisites.unlocked_cids(None))
+            # Committed elsewhere, without invalidating this process's copy.
+            self.second.prerequisite = ''
+            models.commit()
+            prerequisites.reset()
+            self.assertNotIn(
+                    self.second.cid, prerequisites.unlocked_cids(None))
+        prerequisites.reset()
+        with mock.patch.object(time, 'time', return_value=1010.0):
+            self.assertIn(
+                    self.second.cid, prerequisites.unlocked_cids(None))
+
+    @base.authenticated_test
+    def testGetList(self):
+        self.assertEqual([self.first.cid], self.listedCids())
+        team = models.Team.query.get(self.authenticated_client.team.tid)
+        controllers.save_team_answer(self.first, team, None)
+        cache.invalidate(cache.team_tag(team.tid))
+        self.assertEqual(
+                [self.first.cid, self.second.cid], self.listedCids())
+
+    @base.authenticated_test
+    def testGetList_Teaser(self):
+        self.app.config['TEASE_HIDDEN'] = True
+        resp = self.client.get('/api/challenges')
+        teasers = [c['cid'] for c in resp.json['challenges']
+                   if c.get('teaser')]
+        self.assertEqual([self.second.cid], teasers)
+
+    @base.admin_test
+    def testUpdatePrerequisite(self):
+        self.assertFalse(self.second.unlocked_for_team(None))
+        data = {'prerequisite': {'type': 'None'}}
+        self.assert200(self.putJSON(
+            '/api/challenges/%d' % self.second.cid, data))
+        prerequisites.reset()
+        self.assertTrue(models.Challenge.query.get(
+            self.second.cid).unlocked_for_team(None))
+
+    @base.authenticated_test
+    def testGetList_Score(self):
+        chall = models.Challenge.create(
+                'Third', 'Challenge', 100, 'flag', unlocked=True)
+        chall.prerequisite = json.dumps({'type': 'score', 'score': 100})
+        models.commit()
+        self.assertNotIn(chall.cid, self.listedCids())
+        team = models.Team.query.get(self.authenticated_client.team.tid)
+        controllers.save_team_answer(self.first, team, None)
+        cache.invalidate(cache.team_tag(team.tid))
+        self.assertIn(chall.cid, self.listedCids())
+
+    @base.admin_test
+    def testUpdateTags_Recompiles(self):
+        tag = models.Tag.create('Web', 'Web challenges')
+        models.commit()
+        graph = prerequisites.get_graph()
+        self.assert200(self.putJSON(
+            '/api/challenges/%d' % self.first.cid,
+            {'tags': [{'tagslug': tag.tagslug}]}))
+        prerequisites.reset()
+        self.assertIsNot(graph, prerequisites.get_graph())
+        self.assertEqual(
+                set([self.first.cid]), prerequisites.get_graph().tags['web'])
+
+    @base.admin_test
+    def testUpdateOther_KeepsGraph(self):
+        graph = prerequisites.get_graph()
+        self.assert200(self.putJSON(
+            '/api/challenges/%d' % self.second.cid,
+            {'name': 'Renamed',
+             'prerequisite': json.loads(self.second.prerequisite)}))
+        prerequisites.reset()
+        self.assertIs(graph, prerequisites.get_graph())
+
+
+class SolvedBitsTest(CatalogTestCase):
+
+    def setUp(self):
+        super(SolvedBitsTest, self).setUp()
+        self.team = models.Team.create('Team')
+        models.commit()
+
+    def testBits(self):
+        graph = prerequisites.Graph([(5, True, ''), (3, True, ''),
+                                     (9, True, '')])
+        bits = graph.to_bits([9, 3, 42])
+        self.assertEqual(0b101, bits)
+        self.assertEqual(set([3, 9]), graph.from_bits(bits))
+        self.assertEqual(set(), graph.from_bits(0))
+
+    def testSolvedBits_Cached(self):
+        self.assertEqual(set(), prerequisites.solved_cids(self.team))
+        controllers.save_team_answer(self.first, self.team, None)
+        prerequisites.reset()
+        # Reload what the commit expired.
+        for obj in (self.team, self.first, self.second):
+            models.db.session.refresh(obj)
+        with self.queryLimit(0):
+            self.assertEqual(
+                    set([self.first.cid]),
+                    prerequisites.solved_cids(self.team))
+            self.assertTrue(self.first.is_answered(self.team))
+            self.assertFalse(self.second.is_answered(self.team))
+            self.assertTrue(self.second.unlocked_for_team(self.team))
+
+    def testSolvedBits_SharedVersion(self):
+        with mock.patch.object(cache, 'is_shared', return_value=True):
+            controllers.save_team_answer(self.first, self.team, None)
+            prerequisites.reset()
+            version = prerequisites.get_graph().version
+            self.assertEqual(
+                    tuple(cache.get_generations([cache.PREREQUISITES])),
+                    version)
+            # Clears elsewhere don't change what every process stores.
+            with mock.patch.object(cache, '_local_epoch', 99):
+                prerequisites.reset()
+                models.db.session.refresh(self.team)
+                with self.queryLimit(0):
+                    self.assertEqual(
+                            set([self.first.cid]),
+                            prerequisites.solved_cids(self.team))
+
+    def testSolvedBits_NewCatalog(self):
+        controllers.save_team_answer(self.first, self.team, None)
+        cache.invalidate(cache.PREREQUISITES)
+        prerequisites.reset()
+        self.assertTrue(self.first.is_answered(self.team))
+
+    @base.authenticated_test
+    def testSubmit_IncorrectSkipsUnlock(self):
+        with mock.patch.object(prerequisites, 'is_unlocked') as m:
+            resp = self.postJSON('/api/answers', {
+                'cid': self.second.cid,
+                'answer': 'wrong',
+            })
+        self.assert403(resp)
+        self.assertEqual('Really?  Haha no....', resp.json['message'])
+        m.assert_not_called()
+
+    @base.authenticated_test
+    def testSubmit_Locked(self):
+        validators.GetValidatorForChallenge(self.second).change_answer('ok')
+        models.commit()
+        resp = self.postJSON('/api/answers', {
+            'cid': self.second.cid,
+            'answer': 'ok',
+        })
+        self.assert403(resp)
+        self.assertEqual('Challenge is locked!', resp.json['message'])
+        self.assertEqual(0, models.Answer.query.count())
+
+    @base.authenticated_test
+    def testSubmit_Duplicate(self):
+        team = models.Team.query.get(self.authenticated_client.team.tid)
+        controllers.save_team_answer(self.first, team, None)
+        with self.queryLimit(4):
+            resp = self.postJSON('/api/answers', {
+                'cid': self.first.cid,
+                'answer': 'flag',
+            })
+        self.assert403(resp)
+        self.assertEqual(1, models.Answer.query.filter_by(
+            team_tid=team.tid).count())
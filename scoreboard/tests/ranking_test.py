@@ -0,0 +1,119 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for ranking."""
+
+import datetime
+import mock
+import time
+
+from scoreboard.tests import base
+
+from scoreboard import cache
+from scoreboard import models
+from scoreboard import ranking
+
+
+class RankIndexTest(base.BaseTestCase):
+
+    def setUp(self):
+        super(RankIndexTest, self).setUp()
+        cache.global_cache = cache.cache.SimpleCache()
+        ranking.index = ranking.RankIndex()
+        now = datetime.datetime.utcnow()
+        self.teams = []
+        for i, score in enumerate((100, 300, 100, 0, 200)):
+            team = models.Team.create('team%d' % i)
+            team.score = score
+            team.last_solve = now - datetime.timedelta(minutes=i)
+            self.teams.append(team)
+        models.db.session.commit()
+        self.tids = [t.tid for t in self.teams]
+
+    def assertMatchesScoreboard(self):
+        expected = dict((t.tid, i) for i, t in models.Team.enumerate())
+        self.assertEqual(expected, ranking.ranks(expected.keys()))
+
+    def testRanks(self):
+        self.assertMatchesScoreboard()
+        self.assertEqual(1, ranking.rank(self.teams[1].tid))
+        self.assertIsNone(ranking.rank(-1))
+
+    def testUpdatedInPlace(self):
+        ranking.ranks([])
+        self.teams[3].score = 400
+        models.db.session.commit()
+        with self.queryLimit(0):
+            self.assertEqual(1, ranking.rank(self.tids[3]))
+        self.assertMatchesScoreboard()
+
+    def testNewAndDeletedTeams(self):
+        ranking.ranks([])
+        team = models.Team.create('new')
+        team.score = 150
+        models.db.session.delete(self.teams[1])
+        models.db.session.commit()
+        tid = team.tid
+        with self.queryLimit(0):
+            self.assertEqual(2, ranking.rank(tid))
+        self.assertMatchesScoreboard()
+
+    def testRollbackDiscarded(self):
+        ranking.ranks([])
+        self.teams[3].score = 400
+        models.db.session.flush()
+        models.db.session.rollback()
+        with self.queryLimit(0):
+            self.assertEqual(5, ranking.rank(self.tids[3]))
+
+    def testBulkUpdateRebuilds(self):
+        ranking.ranks([])
+        models.Team.query.filter(
+                models.Team.tid == self.tids[3]).update(
+                {models.Team.score: 1000}, synchronize_session=False)
+        models.db.session.commit()
+        with self.queryLimit(1):
+            self.assertEqual(1, ranking.rank(self.tids[3]))
+
+    def testOtherProcessChange(self):
+        with mock.patch.object(cache, 'is_shared', return_value=True):
+            ranking.ranks([])
+            other = ranking.RankIndex()
+            other.ranks([])
+            ranking.index, saved = other, ranking.index
+            self.teams[3].score = 400
+            models.db.session.commit()
+            ranking.index = saved
+            with self.queryLimit(1):
+                self.assertEqual(1, ranking.rank(self.tids[3]))
+
+    def testOtherProcessChange_NoSharedCache(self):
+        self.app.config['LOCAL_COPY_TTL'] = 10
+        table = models.Team.__table__
+        with mock.patch.object(time, 'time', return_value=1000.0):
+            ranking.ranks([])
+            # Committed by another process, unseen by this one's index.
+            models.db.session.execute(table.update().where(
+                table.c.tid == self.tids[3]).values(score=400))
+            models.db.session.commit()
+            with self.queryLimit(0):
+                self.assertEqual(5, ranking.rank(self.tids[3]))
+        with mock.patch.object(time, 'time', return_value=1010.0):
+            with self.queryLimit(1):
+                self.assertEqual(1, ranking.rank(self.tids[3]))
+
+    def testZerosHidden(self):
+        self.app.config['SCOREBOARD_ZEROS'] = False
+        self.assertIsNone(ranking.rank(self.teams[3].tid))
+        self.assertEqual(1, ranking.rank(self.teams[1].tid))
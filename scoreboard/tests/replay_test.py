@@ -0,0 +1,130 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for replay."""
+
+import datetime
+import mock
+
+from scoreboard.tests import base
+
+from scoreboard import controllers
+from scoreboard import models
+from scoreboard import replay
+from scoreboard import rest  # noqa: F401
+from scoreboard import utils
+
+
+class ReplayTest(base.RestTestCase):
+
+    def setUp(self):
+        super(ReplayTest, self).setUp()
+        replay._cached = None
+        self.app.config['SCORING'] = 'progressive'
+        self.start = datetime.datetime(2019, 6, 1, 12, 0, 0)
+        self.challs = [
+                models.Challenge.create(
+                    'Chall %d' % i, 'Challenge', 100 * (i + 1), 'flag',
+                    unlocked=True)
+                for i in range(3)]
+        self.teams = [models.Team.create('Team %d' % i) for i in range(5)]
+        models.commit()
+        minute = 0
+        for i, team in enumerate(self.teams):
+            for chall in self.challs[:i % 3 + 1]:
+                answer = models.Answer.create(chall, team, '')
+                answer.timestamp = self.at(minute)
+                minute += 1
+        models.commit()
+        self.minutes = minute
+
+    def at(self, minute):
+        return self.start + datetime.timedelta(minutes=minute)
+
+    def naiveScores(self, when):
+        """Recompute from scratch with the answers up to when."""
+        answers = models.Answer.query.filter(
+                models.Answer.timestamp <= when).all()
+        scores = dict((t.tid, 0) for t in self.teams)
+        for a in answers:
+            solves = len([b for b in answers if b.challenge is a.challenge])
+            if not utils.GameTime.end or a.timestamp <= utils.GameTime.end:
+                scores[a.team_tid] += (
+                        a.challenge.points_at(solves) + a.first_blood)
+        return scores
+
+    def assertReplayed(self, when, interval):
+        rp = replay.get_replay()
+        rp._interval = interval
+        rp._checkpoints = rp._checkpoints[:1]
+        scores, _ = rp.scores(when)
+        expected = self.naiveScores(when)
+        self.assertEqual(
+                expected, dict((tid, scores[tid]) for tid in expected))
+
+    def testMatchesRecalculate(self):
+        controllers.recalculate_scores()
+        scores, _ = replay.get_replay().scores(self.at(self.minutes))
+        for team in models.Team.query.all():
+            self.assertEqual(team.score, scores[team.tid])
+
+    def testCheckpoints(self):
+        for interval in (1, 2, 5, 1000):
+            for minute in range(-1, self.minutes + 1):
+                self.assertReplayed(self.at(minute), interval)
+
+    def testCheckpointsReused(self):
+        rp = replay.get_replay()
+        rp._interval = 2
+        rp.scores(self.at(self.minutes))
+        self.assertEqual(self.minutes // 2 + 1, len(rp._checkpoints))
+        with mock.patch.object(rp, '_advance', wraps=rp._advance) as m:
+            rp.scores(self.at(5))
+            m.assert_called_once_with(mock.ANY, 6, 6)
+        self.assertIs(rp, replay.get_replay())
+
+    def testPlain(self):
+        self.app.config['SCORING'] = 'plain'
+        self.assertReplayed(self.at(4), 3)
+
+    def testAfterGame(self):
+        with mock.patch.object(utils.GameTime, 'end', self.at(3)):
+            self.assertReplayed(self.at(self.minutes), 2)
+
+    def testScoreboard(self):
+        board = replay.scoreboard(self.at(0))
+        self.assertEqual(
+                list(range(1, models.Team.query.count() + 1)),
+                [p for p, _, _, _ in board])
+        self.assertEqual(
+                (1, self.teams[0].tid, 'Team 0', 100), board[0])
+        self.app.config['SCOREBOARD_ZEROS'] = False
+        self.assertEqual(1, len(replay.scoreboard(self.at(0))))
+
+    @base.admin_test
+    def testGetScoreboardAt(self):
+        resp = self.client.get('/api/scoreboard?at=2019-06-01T12:00:00Z')
+        self.assert200(resp)
+        board = resp.json['scoreboard']
+        self.assertEqual(self.teams[0].tid, board[0]['tid'])
+        self.assertEqual(100, board[0]['score'])
+        self.assertEqual(0, board[1]['score'])
+
+    @base.admin_test
+    def testGetScoreboardAt_Invalid(self):
+        self.assert400(self.client.get('/api/scoreboard?at=yesterday'))
+
+    @base.authenticated_test
+    def testGetScoreboardAt_NotAdmin(self):
+        self.assert403(self.client.get('/api/scoreboard?at=2019-06-01'))
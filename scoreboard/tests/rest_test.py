@@ -22,6 +22,8 @@ from werkzeug import datastructures
 
 from scoreboard.tests import base
 from scoreboard.tests import data
+from scoreboard import cache
+from scoreboard import controllers
 from scoreboard import models
 from scoreboard import rest
 from scoreboard import utils
@@ -138,6 +140,32 @@ class PageTest(base.RestTestCase):
         self.assertEqual(page_data['title'], resp.json['title'])
         self.assertEqual(page_data['contents'], resp.json['contents'])
 
+    @base.admin_test
+    def testUpdatePage_Cached(self):
+        cache.global_cache = cache.cache.SimpleCache()
+        self.client.get(self.PATH)
+        with self.queryLimit(0):
+            self.assert200(self.client.get(self.PATH))
+        self.postJSON(self.PATH, dict(title='Test', contents='Updated'))
+        resp = self.client.get(self.PATH)
+        self.assertEqual('Updated', resp.json['contents'])
+        self.assertEqual('Test', resp.json['title'])
+        self.assert200(self.client.delete(self.PATH))
+        self.assert404(self.client.get(self.PATH))
+
+    @base.admin_test
+    def testGetPage_NotModified(self):
+        cache.global_cache = cache.cache.SimpleCache()
+        etag = self.client.get(self.PATH).headers['ETag']
+        with self.queryLimit(0):
+            resp = self.client.get(self.PATH, headers={'If-None-Match': etag})
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(b'', resp.data)
+        self.postJSON(self.PATH, dict(title='Test', contents='Updated'))
+        resp = self.client.get(self.PATH, headers={'If-None-Match': etag})
+        self.assert200(resp)
+        self.assertNotEqual(etag, resp.headers['ETag'])
+
 
 class UpdateTeam(base.RestTestCase):
 
@@ -588,21 +616,37 @@ class TeamTest(base.RestTestCase):
 
     @base.admin_test
     def testGetTeamAdmin(self):
+        # Only the first request builds the rank index.
+        self.client.get(self.team_path)
         with self.queryLimit(4):
             resp = self.client.get(self.team_path)
         self.assert200(resp)
         self.assertEqual(1, len(resp.json['players']))
+        positions = dict((t.tid, i) for i, t in models.Team.enumerate())
+        self.assertEqual(positions[self.team.tid], resp.json['rank'])
 
     @base.admin_test
     def testUpdateTeamAdmin(self):
         data = {'name': 'Updated'}
-        with self.queryLimit(6):
+        with self.queryLimit(7):
             resp = self.putJSON(self.team_path, data)
         self.assert200(resp)
         self.assertEqual('Updated', resp.json['name'])
         team = models.Team.query.get(self.team.tid)
         self.assertEqual('Updated', team.name)
 
+    @base.admin_test
+    def testUpdateTeamAdmin_RefreshesSolves(self):
+        cache.global_cache = cache.cache.SimpleCache()
+        chall = makeTestChallenges()[0]
+        controllers.save_team_answer(chall, self.team, None)
+        path = '/api/challenges/%d/solves' % chall.cid
+        solves = self.client.get(path).json['solves']
+        self.assertEqual(self.team.name, solves[0]['team']['name'])
+        self.assert200(self.putJSON(self.team_path, {'name': 'Updated'}))
+        solves = self.client.get(path).json['solves']
+        self.assertEqual('Updated', solves[0]['team']['name'])
+
     def testGetTeamList(self):
         with self.client as c:
             with self.queryLimit(3) as ctr:
@@ -627,6 +671,8 @@ class SessionTest(base.RestTestCase):
 
     @base.authenticated_test
     def testGetSessionAuthenticated(self):
+        # Only the first request builds the rank index.
+        self.client.get(self.PATH)
         with self.queryLimit(1):
             resp = self.client.get(self.PATH)
         self.assert200(resp)
@@ -636,6 +682,7 @@ class SessionTest(base.RestTestCase):
         self.assertEqual(
                 self.authenticated_client.team.name,
                 resp.json['team']['name'])
+        self.assertEqual(1, resp.json['team']['rank'])
 
     @base.admin_test
     def testGetSessionAdmin(self):
@@ -648,7 +695,7 @@ class SessionTest(base.RestTestCase):
         self.assertTrue(resp.json['user']['admin'])
         self.assertItemsEqual(
                 {'tid': 0, 'score': 0, 'name': None,
-                    'code': None},
+                    'code': None, 'rank': None},
                 resp.json['team'])
 
     def testSessionLoginSucceeds(self):
@@ -781,6 +828,32 @@ class SessionTest(base.RestTestCase):
                 self.assertIsNone(flask.g.uid)
 
 
+class CacheStatsTest(base.RestTestCase):
+
+    PATH = '/api/cachez'
+
+    def testGetFails(self):
+        with self.queryLimit(0):
+            self.assert403(self.client.get(self.PATH))
+
+    testGetFailsNonAdmin = base.authenticated_test(testGetFails)
+
+    @base.admin_test
+    def testGet(self):
+        with mock.patch.dict(self.app.config, CACHE_TYPE='local'):
+            cache.global_cache = cache.CacheWrapper(self.app)
+        self.client.get('/api/scoreboard?limit=1')
+        self.client.get('/api/scoreboard?limit=1')
+        with self.queryLimit(0):
+            resp = self.client.get(self.PATH)
+        self.assert200(resp)
+        counts = resp.json['families']['scoreboard']
+        self.assertEqual(1, counts['misses'])
+        self.assertIn('shared', resp.json['tiers'])
+        self.assert200(self.client.delete(self.PATH))
+        self.assertEqual({}, self.client.get(self.PATH).json['families'])
+
+
 class ChallengeTest(base.RestTestCase):
 
     PATH_LIST = '/api/challenges'
@@ -811,6 +884,117 @@ class ChallengeTest(base.RestTestCase):
         self.assert200(resp)
         self.assertEqual(len(self.challs), len(resp.json['challenges']))
 
+    def solveAsOtherTeam(self, chall, name='other'):
+        team = models.Team.create(name)
+        models.db.session.commit()
+        controllers.save_team_answer(chall, team, None)
+
+    def challengeFromList(self, chall):
+        resp = self.client.get(self.PATH_LIST)
+        self.assert200(resp)
+        for c in resp.json['challenges']:
+            if c['cid'] == chall.cid:
+                return c
+
+    @base.authenticated_test
+    def testGetList_NoAnswers(self):
+        for i in range(3):
+            self.solveAsOtherTeam(self.chall, name='other %d' % i)
+        with self.queryLimit(3):
+            resp = self.client.get(self.PATH_LIST)
+        self.assert200(resp)
+        listed = [c for c in resp.json['challenges']
+                  if c['cid'] == self.chall.cid][0]
+        self.assertEqual(3, listed['solves'])
+        self.assertNotIn('answers', listed)
+
+    @base.authenticated_test
+    def testGetSolves(self):
+        self.solveAsOtherTeam(self.chall, name='first')
+        self.solveAsOtherTeam(self.chall, name='second')
+        path = self.PATH_SINGLE + '/solves'
+        with self.queryLimit(4):
+            resp = self.client.get(path)
+        self.assert200(resp)
+        self.assertEqual(
+                ['first', 'second'],
+                [s['team']['name'] for s in resp.json['solves']])
+
+    @base.authenticated_test
+    def testGetSolves_RefreshedAfterSolve(self):
+        cache.global_cache = cache.cache.SimpleCache()
+        path = self.PATH_SINGLE + '/solves'
+        self.assertEqual([], self.client.get(path).json['solves'])
+        self.solveAsOtherTeam(self.chall)
+        self.assertEqual(1, len(self.client.get(path).json['solves']))
+
+    @base.authenticated_test
+    def testGetSolves_Locked(self):
+        chall = models.Challenge.create(
+                'locked', 'test', 100, 'foobar', unlocked=False)
+        models.db.session.commit()
+        self.assert404(
+                self.client.get('/api/challenges/%d/solves' % chall.cid))
+
+    @base.authenticated_test
+    def testGetList_Cached(self):
+        cache.global_cache = cache.cache.SimpleCache()
+        expected = self.client.get(self.PATH_LIST).json
+        with self.queryLimit(0):
+            resp = self.client.get(self.PATH_LIST)
+        self.assertEqual(expected, resp.json)
+
+    @base.authenticated_test
+    def testGetList_RefreshedAfterSolve(self):
+        cache.global_cache = cache.cache.SimpleCache()
+        chall = models.Challenge.create(
+                'test', 'test', 100, 'foobar', unlocked=True)
+        models.db.session.commit()
+        self.assertFalse(self.challengeFromList(chall)['answered'])
+        self.assert200(self.postJSON('/api/answers', {
+            'cid': chall.cid,
+            'answer': 'foobar',
+        }))
+        self.assertTrue(self.challengeFromList(chall)['answered'])
+
+    @base.authenticated_test
+    def testGetList_OtherTeamSolves(self):
+        cache.global_cache = cache.cache.SimpleCache()
+        chall = self.challs[0]
+        etag = self.client.get(self.PATH_LIST).headers['ETag']
+        self.solveAsOtherTeam(chall)
+        resp = self.client.get(
+                self.PATH_LIST, headers={'If-None-Match': etag})
+        self.assert200(resp)
+        solves = dict((c['cid'], c['solves'])
+                      for c in resp.json['challenges'])
+        self.assertEqual(1, solves[chall.cid])
+
+    @base.authenticated_test
+    def testGetList_PointsChange(self):
+        cache.global_cache = cache.cache.SimpleCache()
+        self.app.config['SCORING'] = 'progressive'
+        chall = self.challs[0]
+        chall.min_points = 1
+        models.db.session.commit()
+        self.solveAsOtherTeam(chall)
+        before = self.challengeFromList(chall)
+        self.solveAsOtherTeam(chall, 'another')
+        after = self.challengeFromList(chall)
+        self.assertEqual(2, after['solves'])
+        self.assertLess(after['current_points'], before['current_points'])
+
+    @base.admin_test
+    def testCreateChallenge_RefreshesList(self):
+        cache.global_cache = cache.cache.SimpleCache()
+        with self.swapClient(self.authenticated_client):
+            count = len(self.client.get(self.PATH_LIST).json['challenges'])
+        self.assert200(self.postJSON(self.PATH_LIST, self.newChallengeData()))
+        with self.swapClient(self.authenticated_client):
+            self.assertEqual(
+                    count + 1,
+                    len(self.client.get(self.PATH_LIST).json['challenges']))
+
     def newChallengeData(self):
         return {
             'name': 'Chall 1',
@@ -894,6 +1078,60 @@ class ChallengeTest(base.RestTestCase):
             testDeleteChallengeAnonymous)
 
 
+class TagTest(base.RestTestCase):
+
+    PATH = '/api/tags/web'
+
+    def setUp(self):
+        super(TagTest, self).setUp()
+        self.tag = models.Tag.create('Web', 'Web challenges')
+        self.challs = []
+        for i, unlocked in enumerate((True, True, False)):
+            chall = models.Challenge.create(
+                    'Web %d' % i, 'Challenge', 100, 'flag',
+                    unlocked=unlocked)
+            chall.add_tags([self.tag])
+            self.challs.append(chall)
+        # Displayed before the others, and with no tag.
+        self.challs[1].weight = 0
+        models.Challenge.create(
+                'Other', 'Challenge', 100, 'flag', unlocked=True)
+        models.commit()
+
+    @base.authenticated_test
+    def testGetTag(self):
+        with self.queryLimit(7):
+            resp = self.client.get(self.PATH)
+        self.assert200(resp)
+        self.assertEqual(
+                [self.challs[1].cid, self.challs[0].cid],
+                [c['cid'] for c in resp.json['challenges']])
+        self.assertEqual(['web'], [
+            t['tagslug'] for t in resp.json['challenges'][0]['tags']])
+
+    @base.authenticated_test
+    def testGetTag_Teaser(self):
+        self.app.config['TEASE_HIDDEN'] = True
+        self.challs[0].prerequisite = json.dumps(
+                {'type': 'solved', 'challenge': self.challs[1].cid})
+        models.commit()
+        resp = self.client.get(self.PATH)
+        self.assertEqual(
+                [False, True],
+                [c['teaser'] for c in resp.json['challenges']])
+        self.assertIsNone(resp.json['challenges'][1]['description'])
+
+    @base.admin_test
+    def testGetTagAdmin(self):
+        resp = self.client.get(self.PATH)
+        self.assert200(resp)
+        self.assertEqual(3, len(resp.json['challenges']))
+
+    @base.authenticated_test
+    def testGetTag_Missing(self):
+        self.assert404(self.client.get('/api/tags/missing'))
+
+
 class ScoreboardTest(base.RestTestCase):
 
     PATH = '/api/scoreboard'
@@ -907,6 +1145,123 @@ class ScoreboardTest(base.RestTestCase):
         self.assert200(resp)
         # TODO: check contents
 
+    def testGetScoreboard_Snapshot(self):
+        resp = self.client.get(self.PATH)
+        self.assert200(resp)
+        version = resp.headers['X-Snapshot-Version']
+        self.assertIn('X-Snapshot-Age', resp.headers)
+        with self.queryLimit(0):
+            resp = self.client.get(self.PATH)
+        self.assertEqual(version, resp.headers['X-Snapshot-Version'])
+
+    def testGetScoreboard_NotModified(self):
+        etag = self.client.get(self.PATH).headers['ETag']
+        with self.queryLimit(0):
+            resp = self.client.get(self.PATH, headers={'If-None-Match': etag})
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(b'', resp.data)
+        rest.scoreboard_snapshot.invalidate()
+        resp = self.client.get(self.PATH, headers={'If-None-Match': etag})
+        self.assert200(resp)
+        self.assertNotEqual(etag, resp.headers['ETag'])
+
+    def testGetScoreboard_NewTeam(self):
+        with mock.patch.object(cache, 'is_shared', return_value=True):
+            cache.global_cache = cache.cache.SimpleCache()
+            before = self.client.get(self.PATH).json['scoreboard']
+            resp = self.postJSON('/api/users', UserTest.default_data())
+            self.assert200(resp)
+            after = self.client.get(self.PATH).json['scoreboard']
+        self.assertEqual(len(before) + 1, len(after))
+        self.assertIn('New Team', [t['name'] for t in after])
+
+    def testGetScoreboard_PageSnapshot(self):
+        path = self.PATH + '?history_for_top=10'
+        resp = self.client.get(path)
+        self.assert200(resp)
+        version = resp.headers['X-Snapshot-Version']
+        with self.queryLimit(0):
+            resp = self.client.get(path)
+        self.assertEqual(version, resp.headers['X-Snapshot-Version'])
+        board = resp.json['scoreboard']
+        self.assertTrue(board[0]['history'])
+        self.assertEqual([], board[10]['history'])
+        self.assertNotEqual(
+                resp.headers['ETag'],
+                self.client.get(self.PATH).headers['ETag'])
+        rest.scoreboard_snapshot.invalidate()
+        resp = self.client.get(path)
+        self.assertNotEqual(version, resp.headers['X-Snapshot-Version'])
+
+    def testGetScoreboard_Page(self):
+        full = self.client.get(self.PATH).json['scoreboard']
+        resp = self.client.get(self.PATH + '?limit=3&offset=2')
+        self.assert200(resp)
+        page = resp.json['scoreboard']
+        self.assertEqual(
+            [t['tid'] for t in full[2:5]], [t['tid'] for t in page])
+        self.assertEqual([3, 4, 5], [t['position'] for t in page])
+
+    def testGetScoreboard_HistoryForTop(self):
+        with self.queryLimit(2):
+            resp = self.client.get(self.PATH + '?history_for_top=2')
+        self.assert200(resp)
+        board = resp.json['scoreboard']
+        for team in board[:2]:
+            self.assertTrue(team['history'])
+        for team in board[2:]:
+            self.assertEqual([], team['history'])
+
+    def testGetScoreboard_BadArgs(self):
+        for query in ('limit=-1', 'offset=foo', 'history_for_top=1.5'):
+            self.assert400(self.client.get(self.PATH + '?' + query))
+
+    def testGetScoreboard_HistoryPoints(self):
+        self.app.config['SCOREBOARD_HISTORY_POINTS'] = 3
+        resp = self.client.get(self.PATH)
+        self.assert200(resp)
+        for team in resp.json['scoreboard']:
+            self.assertLessEqual(len(team['history']), 3)
+            full = models.Team.query.get(team['tid']).score_history
+            if full:
+                self.assertEqual(team['score'], team['history'][-1]['score'])
+
+
+class ReadOnlyTest(base.RestTestCase):
+    """GET endpoints must not write to the database."""
+
+    PATHS = (
+        '/api/challenges',
+        '/api/scoreboard',
+        '/api/session',
+        '/api/tags',
+        '/api/teams',
+    )
+
+    def setUp(self):
+        super(ReadOnlyTest, self).setUp()
+        self.app.config['SCORING'] = 'progressive'
+        self.challs = makeTestChallenges()
+        team = self.authenticated_client.team
+        for chall in self.challs[:3]:
+            models.Answer.create(chall, team, '')
+        models.db.session.commit()
+        self.paths = self.PATHS + ('/api/teams/%d' % team.tid,)
+
+    def assertNoWrites(self):
+        for path in self.paths:
+            with self.queryLimit() as block:
+                self.assert200(self.client.get(path))
+            self.assertEqual([], block.write_queries, path)
+
+    @base.authenticated_test
+    def testGetAuthenticated(self):
+        self.assertNoWrites()
+
+    @base.admin_test
+    def testGetAdmin(self):
+        self.assertNoWrites()
+
 
 class AnswerTest(base.RestTestCase):
 
@@ -959,6 +1314,17 @@ class AnswerTest(base.RestTestCase):
         self.assert200(resp)
         self.assertEqual(self.points, resp.json['points'])
 
+    @base.authenticated_test
+    def testSubmitCorrect_RefreshesScoreboard(self):
+        board = self.client.get('/api/scoreboard').json['scoreboard']
+        self.assertEqual(0, board[0]['score'])
+        self.assert200(self.postJSON(self.PATH, {
+            'cid': self.cid,
+            'answer': self.answer,
+        }))
+        board = self.client.get('/api/scoreboard').json['scoreboard']
+        self.assertEqual(self.points, board[0]['score'])
+
     @base.authenticated_test
     def testSubmitIncorrect(self):
         old_score = self.client.team.score
@@ -974,6 +1340,7 @@ class AnswerTest(base.RestTestCase):
     @base.authenticated_test
     def testSubmitDouble(self):
         models.Answer.create(self.chall, self.client.team, '')
+        models.db.session.flush()
         old_score = self.client.team.score
         with self.queryLimit(5):
             resp = self.postJSON(self.PATH, {
@@ -1165,6 +1532,31 @@ class NewsTest(base.RestTestCase):
 
     testGetNewsAdmin = base.admin_test(testGetNews)
 
+    def useLocalCache(self):
+        with mock.patch.dict(self.app.config, CACHE_TYPE='local'):
+            cache.global_cache = cache.CacheWrapper(self.app)
+
+    def testGetNews_Cached(self):
+        self.useLocalCache()
+        self.client.get(self.PATH)
+        with self.queryLimit(0):
+            resp = self.client.get(self.PATH)
+        self.assert200(resp)
+        self.assertEqual(1, len(resp.json))
+
+    def testGetNews_NotModified(self):
+        self.useLocalCache()
+        etag = self.client.get(self.PATH).headers['ETag']
+        resp = self.client.get(self.PATH, headers={'If-None-Match': etag})
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(b'', resp.data)
+        models.News.broadcast('test', 'Another message.')
+        models.commit()
+        cache.invalidate(cache.NEWS)
+        resp = self.client.get(self.PATH, headers={'If-None-Match': etag})
+        self.assert200(resp)
+        self.assertEqual(2, len(resp.json))
+
     @base.authenticated_test
     def testGetNewsAuthenticated(self):
         with self.queryLimit(2):
@@ -1208,6 +1600,13 @@ class NewsTest(base.RestTestCase):
         news = models.News.query.get(resp.json['nid'])
         self.assertEqual(tid, news.audience_team_tid)
 
+    @base.admin_test
+    def testCreateNewsAdmin_RefreshesList(self):
+        self.useLocalCache()
+        self.assertEqual(1, len(self.client.get(self.PATH).json))
+        self.assert200(self.postJSON(self.PATH, {'message': 'Another.'}))
+        self.assertEqual(2, len(self.client.get(self.PATH).json))
+
 
 class CTFTimeTest(base.RestTestCase):
 
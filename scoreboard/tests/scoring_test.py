@@ -0,0 +1,56 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for scoring."""
+
+import mock
+
+from scoreboard.tests import base
+
+from scoreboard import scoring
+
+
+class PointsTest(base.BaseTestCase):
+
+    def setUp(self):
+        super(PointsTest, self).setUp()
+        self.app.config['SCORING'] = 'progressive'
+        scoring.clear()
+
+    def testMatchesLogScore(self):
+        for solves in (0, 1, 2, 11, 12, 13, 50, 3, 200):
+            self.assertEqual(
+                scoring.log_score(500, 100, 12, solves),
+                scoring.points(500, 100, 12, solves))
+
+    def testMemoized(self):
+        with mock.patch.object(
+                scoring, 'log_score', wraps=scoring.log_score) as m:
+            scoring.points(500, 100, 12, 10)
+            self.assertEqual(11, m.call_count)
+            for solves in range(11):
+                scoring.points(500, 100, 12, solves)
+            self.assertEqual(11, m.call_count)
+            scoring.points(500, 100, 12, 12)
+            self.assertEqual(22, m.call_count)
+            scoring.points(300, 100, 12, 0)
+            self.assertEqual(23, m.call_count)
+
+    def testDroppedOnConfigChange(self):
+        scoring.points(500, 100, 12, 10)
+        self.app.config['SCORING_SPEED'] = 20
+        with mock.patch.object(
+                scoring, 'log_score', wraps=scoring.log_score) as m:
+            scoring.points(500, 100, 12, 10)
+            self.assertEqual(11, m.call_count)
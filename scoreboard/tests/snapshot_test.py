@@ -0,0 +1,122 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for snapshot."""
+
+import mock
+import time
+
+from scoreboard.tests import base
+
+from scoreboard import cache
+from scoreboard import snapshot
+
+
+class SnapshotTest(base.BaseTestCase):
+
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        cache.global_cache = cache.cache.SimpleCache()
+        self.builds = []
+
+    def tearDown(self):
+        snapshot.background = False
+        super(SnapshotTest, self).tearDown()
+
+    def build(self):
+        self.builds.append(time.time())
+        return str(len(self.builds)).encode('utf-8')
+
+    def waitForBuilds(self, n, timeout=5):
+        deadline = time.time() + timeout
+        while len(self.builds) < n and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(n, len(self.builds))
+
+    def testSynchronous(self):
+        snap = snapshot.Snapshot('sync', self.build)
+        self.assertEqual(b'1', snap.get()[2])
+        self.assertEqual(b'1', snap.get()[2])
+        snap.invalidate()
+        self.assertEqual(b'2', snap.get()[2])
+
+    def testColdStartWaits(self):
+        snapshot.background = True
+        snap = snapshot.Snapshot('cold', self.build)
+        self.assertEqual(b'1', snap.get()[2])
+
+    def testDebounced(self):
+        snapshot.background = True
+        self.app.config['SNAPSHOT_INTERVAL'] = 0.2
+        snap = snapshot.Snapshot('debounce', self.build)
+        first = snap.get()
+        for _ in range(5):
+            snap.invalidate()
+        # Served without waiting while the rebuild is pending.
+        self.assertEqual(first, snap.get())
+        self.waitForBuilds(2)
+        time.sleep(0.3)
+        self.assertEqual(2, len(self.builds))
+        self.assertGreaterEqual(self.builds[1] - self.builds[0], 0.2)
+        self.assertEqual(b'2', snap.get()[2])
+        self.assertGreater(snap.get()[0], first[0])
+
+    def testInvalidatedInOtherProcess(self):
+        with mock.patch.object(cache, 'is_shared', return_value=True):
+            one = snapshot.Snapshot('shared', self.build)
+            two = snapshot.Snapshot('shared', self.build)
+            self.assertEqual(b'1', one.get()[2])
+            self.assertEqual(b'2', two.get()[2])
+            two.invalidate()
+            self.assertEqual(b'3', two.get()[2])
+            self.assertEqual(b'4', one.get()[2])
+            self.assertIsNone(cache.global_cache.get('snapshot/shared'))
+
+    def testSharedGeneration(self):
+        one = snapshot.Snapshot('one', self.build)
+        two = snapshot.Snapshot('two', self.build, generation=one.generation)
+        one.get()
+        two.get()
+        one.invalidate()
+        self.assertEqual(b'3', one.get()[2])
+        self.assertEqual(b'4', two.get()[2])
+
+    def testAgeBounded(self):
+        self.app.config['LOCAL_COPY_TTL'] = 10
+        snap = snapshot.Snapshot('age', self.build)
+        with mock.patch.object(time, 'time', return_value=1000.0):
+            snap.get()
+            self.assertEqual(b'1', snap.get()[2])
+        with mock.patch.object(time, 'time', return_value=1010.0):
+            self.assertEqual(b'2', snap.get()[2])
+
+    def testMaxAge_SharedCache(self):
+        self.app.config['SNAPSHOT_MAX_AGE'] = 60
+        snap = snapshot.Snapshot('max-age', self.build)
+        with mock.patch.object(cache, 'is_shared', return_value=True):
+            with mock.patch.object(time, 'time', return_value=1000.0):
+                snap.get()
+            with mock.patch.object(time, 'time', return_value=1059.0):
+                self.assertEqual(b'1', snap.get()[2])
+            with mock.patch.object(time, 'time', return_value=1060.0):
+                self.assertEqual(b'2', snap.get()[2])
+
+    def testServedWhileRebuilding(self):
+        snapshot.background = True
+        self.app.config['SNAPSHOT_INTERVAL'] = 0.2
+        snap = snapshot.Snapshot('flush', self.build)
+        snap.get()
+        cache.clear()
+        self.assertEqual(b'1', snap.get()[2])
+        self.waitForBuilds(2)
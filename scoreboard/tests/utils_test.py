@@ -63,3 +63,34 @@ class ProofOfWorkTest(base.BaseTestCase):
         key = "!!"
         nbits = 12
         self.assertFalse(utils.validate_proof_of_work(val, key, nbits))
+
+
+class DownsampleTest(base.BaseTestCase):
+
+    def testLTTB_Short(self):
+        data = [(0, 0), (1, 5), (2, 5)]
+        self.assertEqual(data, utils.downsample_lttb(data, 10))
+
+    def testLTTB_KeepsEndsAndPeaks(self):
+        data = [(x, 0) for x in range(100)]
+        data[37] = (37, 500)
+        data[71] = (71, -500)
+        rv = utils.downsample_lttb(data, 10)
+        self.assertEqual(10, len(rv))
+        self.assertEqual(data[0], rv[0])
+        self.assertEqual(data[-1], rv[-1])
+        self.assertIn(data[37], rv)
+        self.assertIn(data[71], rv)
+        self.assertEqual(sorted(rv), rv)
+
+    def testBuckets(self):
+        data = [0, 1, 5, 9, 10, 11, 35]
+        self.assertEqual(
+                [0, 9, 10, 11, 35], utils.downsample_buckets(data, 10))
+        self.assertEqual([], utils.downsample_buckets([], 10))
+
+    def testBuckets_FirstAndLast(self):
+        data = [(12, 'a'), (13, 'b'), (15, 'c'), (19, 'd'), (20, 'e')]
+        self.assertEqual(
+                [(12, 'a'), (19, 'd'), (20, 'e')],
+                utils.downsample_buckets(data, 10, key=lambda p: p[0]))
@@ -0,0 +1,129 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for warmup."""
+
+import mock
+
+from scoreboard.tests import base
+
+from scoreboard import cache
+from scoreboard import models
+from scoreboard import rest  # noqa: F401
+from scoreboard import warmup
+
+
+class WarmupTest(base.RestTestCase):
+
+    def setUp(self):
+        super(WarmupTest, self).setUp()
+        with mock.patch.dict(self.app.config, CACHE_TYPE='local'):
+            cache.global_cache = cache.CacheWrapper(self.app)
+        self.app.config['WARMUP_TEAMS'] = 2
+        self.app.config['WARMUP_THREADS'] = 2
+        self.chall = models.Challenge.create(
+                'Chall', 'Challenge', 100, 'flag', unlocked=True)
+        self.teams = [models.Team.create('Team %d' % i) for i in range(3)]
+        page = models.Page()
+        page.path = 'rules'
+        page.title = 'Rules'
+        page.contents = 'Be nice.'
+        models.db.session.add(page)
+        models.commit()
+        models.Answer.create(self.chall, self.teams[2], '')
+        self.teams[2].last_solve = models.Answer.query.one().timestamp
+        models.commit()
+
+    def testTargets(self):
+        targets = warmup.targets()
+        self.assertIn(('/api/scoreboard', None), targets)
+        self.assertIn(('/api/scoreboard?history_for_top=10', None), targets)
+        self.assertIn(('/api/news', None), targets)
+        self.assertIn(('/api/page/rules', None), targets)
+        tids = set(tid for _, tid in targets if tid)
+        self.assertEqual(2, len(tids))
+        # The team with the latest solve comes first.
+        self.assertIn(self.teams[2].tid, tids)
+        self.assertIn(('/api/tags', self.teams[2].tid), targets)
+
+    def testWarm(self):
+        self.assertEqual(len(warmup.targets()), warmup.warm())
+        self.assertIsNone(cache.global_cache.get(warmup.LEASE_KEY))
+        with self.queryLimit(0):
+            self.assert200(self.client.get('/api/page/rules'))
+            self.assert200(self.client.get('/api/news'))
+
+    def testWarm_Teams(self):
+        warmup.warm()
+        counts = cache.stats.report()['families']['challenges/%d']
+        self.assertEqual(2, counts['misses'])
+        self.assertTrue(warmup._warm_one('/api/challenges', self.teams[2].tid))
+        counts = cache.stats.report()['families']['challenges/%d']
+        self.assertEqual(1, counts['hits'])
+
+    def testWarm_Leased(self):
+        cache.global_cache.add(warmup.LEASE_KEY, 1)
+        with self.queryLimit(0):
+            self.assertIsNone(warmup.warm())
+
+    def testWarm_NullCache(self):
+        cache.global_cache = cache.cache.NullCache()
+        with self.queryLimit(0):
+            self.assertIsNone(warmup.warm())
+
+    def testWarm_Failure(self):
+        self.assertTrue(warmup._warm_one('/api/news', None))
+        self.assertFalse(warmup._warm_one('/api/page/missing', None))
+
+    def testStart_Pending(self):
+        calls = []
+
+        def warm():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                warmup.start()
+
+        with mock.patch.object(warmup, 'warm', side_effect=warm):
+            warmup.start()
+        self.assertEqual([0, 1], calls)
+        self.assertFalse(warmup._running)
+
+    def testWarm_ScoreboardPage(self):
+        warmup.warm()
+        path = '/api/scoreboard?history_for_top=10'
+        with self.queryLimit(0):
+            self.assert200(self.client.get(path))
+
+    def testStart_FirstRequest(self):
+        self.app.config['WARMUP_ON_START'] = True
+        with mock.patch.object(warmup, '_started', False), \
+                mock.patch.object(warmup, 'warm') as m:
+            self.client.get('/api/news')
+            self.client.get('/api/news')
+        m.assert_called_once_with()
+
+    def testStart_AfterFork(self):
+        # State inherited from a parent that was warming when it forked.
+        with mock.patch.object(warmup, '_running', True), \
+                mock.patch.object(warmup, '_pid', -1), \
+                mock.patch.object(warmup, 'warm') as m:
+            warmup.start()
+        m.assert_called_once_with()
+
+    @base.admin_test
+    def testReset_Warms(self):
+        with mock.patch.object(warmup, 'warm') as m:
+            self.assert200(self.postJSON(
+                '/api/tools/reset', {'op': 'scores', 'ack': 'ack'}))
+        m.assert_called_once_with()
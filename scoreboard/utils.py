@@ -18,6 +18,7 @@ import flask
 import functools
 import hashlib
 import hmac
+import json
 import pytz
 import sys
 import time
@@ -181,6 +182,96 @@ def validate_proof_of_work(val, key, nbits):
     return True
 
 
+def downsample_lttb(data, threshold, key=lambda p: p):
+    """Downsample a series with Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last items plus, for each of threshold - 2 buckets,
+    the item forming the largest triangle with its neighbours, which
+    preserves the visual shape of the series.  key maps items to numeric
+    (x, y) pairs.
+    """
+    threshold = max(threshold, 3)
+    if len(data) <= threshold:
+        return list(data)
+    points = [key(d) for d in data]
+    sampled = [data[0]]
+    every = float(len(data) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third vertex.
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, len(data))
+        avg_len = avg_end - avg_start
+        avg_x = sum(p[0] for p in points[avg_start:avg_end]) / avg_len
+        avg_y = sum(p[1] for p in points[avg_start:avg_end]) / avg_len
+        ax, ay = points[a]
+        max_area = -1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (points[j][1] - ay) -
+                       (ax - points[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        sampled.append(data[next_a])
+        a = next_a
+    sampled.append(data[-1])
+    return sampled
+
+
+def downsample_buckets(data, width, key=lambda p: p):
+    """Keep the first item and the last item in each interval of width.
+
+    key maps items to a numeric x value.
+    """
+    sampled = []
+    last = None
+    first = 0
+    for item in data:
+        bucket = key(item) // width
+        if bucket != last:
+            first = len(sampled)
+            last = bucket
+            sampled.append(item)
+        elif len(sampled) - 1 == first:
+            sampled.append(item)
+        else:
+            sampled[-1] = item
+    return sampled
+
+
+def dump_json(data, xssi=True):
+    """Encode data as API responses are, with the JSONP buster."""
+    settings = {}
+    if app.debug:
+        settings['indent'] = 4
+        settings['sort_keys'] = True
+
+    dumped = json.dumps(data, **settings)
+    if xssi:
+        dumped = ")]}',\n" + dumped + "\n"
+    return dumped
+
+
+def parse_datetime(datestr):
+    """Return a UTC non-TZ-aware datetime from a string.
+
+    Raises ValueError if the string can't be parsed.
+    """
+    if dateutil:
+        dt = dateutil.parse(datestr)
+        if dt.tzinfo:
+            dt = dt.astimezone(pytz.UTC).replace(tzinfo=None)
+        return dt
+    datestr = datestr.rstrip('Z')
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(datestr, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Unable to parse date %r.' % datestr)
+
+
 def urlsafe_b64decode_nopadding(val):
     """Deal with unpadded urlsafe base64."""
     # Yes, it accepts extra = characters.
@@ -287,13 +378,7 @@ class GameTime(object):
     @staticmethod
     def _parsedate(datestr):
         """Return a UTC non-TZ-aware datetime from a string."""
-        if dateutil:
-            dt = dateutil.parse(datestr)
-            if dt.tzinfo:
-                dt = dt.astimezone(pytz.UTC).replace(tzinfo=None)
-            return dt
-        # TODO: parse with strptime
-        raise RuntimeError('No parser available.')
+        return parse_datetime(datestr)
 
 
 GameTime.setup()
@@ -0,0 +1,194 @@
+# Copyright 2019 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Precompute cached API responses before players ask for them.
+
+A cold cache, after a deploy or a bulk invalidation, otherwise means every
+request recomputes the same expensive views at once.  Warming replays the
+reads that do not depend on the session through the app itself, so entries
+land under the same keys as real requests: the scoreboard, public news,
+static pages, and the challenge and tag lists of the most active teams.
+
+With WARMUP_ON_START, each process warms on its first request, so nothing
+runs at import time: not in CLI commands, nor in a master process that later
+forks its workers.
+"""
+
+import os
+import threading
+
+import flask
+from six.moves import queue
+
+from scoreboard import cache
+from scoreboard import main
+from scoreboard import models
+
+app = main.get_app()
+
+# Only one process warms the shared cache at a time.
+LEASE_KEY = 'lease/warmup'
+LEASE_TIMEOUT = 300
+
+# The scoreboard page requests the history of the top 10 teams.
+PUBLIC_PATHS = (
+        '/api/scoreboard', '/api/scoreboard?history_for_top=10', '/api/news')
+TEAM_PATHS = ('/api/challenges', '/api/tags')
+
+# Warm in a separate thread, instead of in the caller.
+background = True
+
+_lock = threading.Lock()
+_running = False
+_pending = False
+# The process the state above belongs to, and whether it has warmed on start.
+_pid = None
+_started = False
+
+
+def targets():
+    """Get (path, tid) pairs to request, tid being None for public reads."""
+    rv = [(path, None) for path in PUBLIC_PATHS]
+    for page in models.Page.query.with_entities(models.Page.path):
+        rv.append(('/api/page/%s' % page.path, None))
+    teams = models.Team.query.with_entities(models.Team.tid).order_by(
+            models.Team.last_solve.is_(None),
+            models.Team.last_solve.desc()).limit(
+            app.config.get('WARMUP_TEAMS'))
+    for team in teams:
+        rv.extend((path, team.tid) for path in TEAM_PATHS)
+    return rv
+
+
+def warm():
+    """Request every target, with WARMUP_THREADS at a time.
+
+    Returns the number of targets warmed, or None if there is no cache to
+    warm or another process holds the lease.
+    """
+    if cache.is_disabled():
+        # Nothing would be kept, and the lease can't be held either.
+        return None
+    if not cache.global_cache.add(LEASE_KEY, 1, timeout=LEASE_TIMEOUT):
+        app.logger.info('Cache warm-up already running elsewhere.')
+        return None
+    try:
+        pending = queue.Queue()
+        if flask.has_app_context():
+            found = targets()
+        else:
+            with app.app_context():
+                found = targets()
+        for target in found:
+            pending.put(target)
+        warmed = []
+        workers = [
+                threading.Thread(target=_worker, args=(pending, warmed))
+                for _ in range(max(app.config.get('WARMUP_THREADS'), 1))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        app.logger.info('Warmed %d cache entries.', len(warmed))
+        return len(warmed)
+    finally:
+        cache.global_cache.delete(LEASE_KEY)
+
+
+def start():
+    """Warm the cache, unless this process is already doing so.
+
+    A warm-up requested while one is running starts again once it finishes,
+    as the running one may have read data from before the invalidation.
+    """
+    global _running, _pending
+    _check_pid()
+    with _lock:
+        if _running:
+            _pending = True
+            return
+        _running = True
+    thread = threading.Thread(target=_run)
+    thread.daemon = True
+    thread.start()
+    if not background:
+        thread.join()
+
+
+@app.before_request
+def _start_on_first_request():
+    global _started
+    _check_pid()
+    if _started or not app.config.get('WARMUP_ON_START'):
+        return
+    with _lock:
+        if _started:
+            return
+        _started = True
+    start()
+
+
+def _check_pid():
+    """Forget state inherited from the process this one was forked from.
+
+    Threads don't survive a fork, so a warm-up running there isn't here.
+    """
+    global _lock, _running, _pending, _pid, _started
+    if _pid == os.getpid():
+        return
+    _lock = threading.Lock()
+    _running = False
+    _pending = False
+    _started = False
+    _pid = os.getpid()
+
+
+def _run():
+    global _running, _pending
+    while True:
+        try:
+            warm()
+        except Exception:
+            app.logger.exception('Cache warm-up failed.')
+        with _lock:
+            if not _pending:
+                _running = False
+                return
+            _pending = False
+
+
+def _worker(pending, warmed):
+    while True:
+        try:
+            path, tid = pending.get_nowait()
+        except queue.Empty:
+            return
+        if _warm_one(path, tid):
+            warmed.append(path)
+
+
+def _warm_one(path, tid):
+    """Request path as an anonymous member of team tid."""
+    with app.test_request_context(path):
+        flask.g.uid = None
+        flask.g.admin = False
+        flask.g.user = None
+        flask.g.tid = tid
+        flask.g.team = models.Team.query.get(tid) if tid else None
+        try:
+            resp = app.make_response(app.dispatch_request())
+        except Exception as ex:
+            app.logger.info('Not warming %s: %s', path, ex)
+            return False
+        return resp.status_code == 200
@@ -481,7 +481,7 @@ adminChallengeCtrls.controller('AdminChallengeCtrl', [
         var type = $scope.challenge.prerequisite.type || 'None';
         if (type == 'None')
           return;
-        if (type == 'solved') {
+        if (type == 'solved' || type == 'all' || type == 'any') {
           // Load the challenge list
           loadingService.start();
           challengeService.get(function(data) {
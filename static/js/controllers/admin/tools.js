@@ -30,7 +30,12 @@ adminToolCtrls.controller('AdminToolCtrl', [
     function($scope, adminToolsService, errorService, sessionService, loadingService, apiKeyService) {
         if (!sessionService.requireAdmin()) return;
 
-        $scope.recalculateScores = adminToolsService.recalculateScores;
+        $scope.recalculateScores = function() {
+          adminToolsService.recalculateScores(
+            function(resp) {
+              errorService.success(resp.message);
+            }, errorService.error);
+        };
         $scope.resetScores = function() {
           adminToolsService.resetScores(
             errorService.success, errorService.error);
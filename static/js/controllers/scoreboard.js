@@ -30,9 +30,12 @@ scoreboardCtrls.controller('ScoreboardCtrl', [
         loadingService) {
       $scope.config = configService.get();
 
+      // Matches APIScoreboard.page_history_for_top, served from a snapshot.
+      var numChartTeams = 10;
+
       var topTeams = function(scoreboard, numTeams) {
         // Scoreboard data is sorted by backend
-        var numTeams = numTeams || 10;
+        var numTeams = numTeams || numChartTeams;
         return scoreboard.slice(0, numTeams);
       };
 
@@ -47,6 +50,7 @@ scoreboardCtrls.controller('ScoreboardCtrl', [
       var refresh = function() {
         errorService.clearErrors();
         $resource('/api/scoreboard').get(
+            {history_for_top: numChartTeams},
             function(data) {
               $scope.scoreboard = data.scoreboard;
               $scope.scoreHistory = getHistory(data.scoreboard);
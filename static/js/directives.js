@@ -361,15 +361,16 @@ sbDirectives.directive('challengeBox', [
     '$location',
     '$rootScope',
     'answerService',
+    'challengeService',
     'errorService',
     'loadingService',
     'proofOfWorkService',
     'scoreService',
     'sessionService',
     'validatorService',
-    function($resource, $location, $rootscope, answerService, errorService,
-      loadingService, proofOfWorkService, scoreService, sessionService,
-      validatorService) {
+    function($resource, $location, $rootscope, answerService,
+      challengeService, errorService, loadingService, proofOfWorkService,
+      scoreService, sessionService, validatorService) {
       return {
         restrict: 'AE',
         templateUrl: '/partials/components/challenge.html',
@@ -405,10 +406,17 @@ sbDirectives.directive('challengeBox', [
             scope.currentPoints = scoreService.getCurrentPoints(scope.chall);
             // Update loggedIn
             scope.loggedIn = (!!sessionService.session.user);
-            // Recent solves
+            // Recent solves, fetched separately from the challenge list
+            scope.solves = [];
+            if (scope.chall && scope.chall.solves) {
+              challengeService.getSolves({cid: scope.chall.cid},
+                function(data) {
+                  scope.solves = data.solves;
+                });
+            }
             scope.recent = function() {
               if (!scope.chall) return []
-              var answers = scope.chall.answers.map(function(e, i) {
+              var answers = scope.solves.map(function(e, i) {
                 e.date = (new Date(e.timestamp)).valueOf();
                 return e;
               })
@@ -32,7 +32,9 @@ challengeServices.service('challengeService', [
         'create': {method: 'POST'},
         'delete': {method: 'DELETE'},
       });
+      var solves = $resource('/api/challenges/:cid/solves');
       this.get = res.get;
+      this.getSolves = solves.get;
       this.delete = res.delete;
       this.save = function() {
         cache.removeAll();